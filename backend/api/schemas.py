@@ -6,7 +6,7 @@ Incluye modelos para solicitudes y respuestas de estado, procesamiento de texto,
 
 """
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Any, Dict, Optional, List
 from datetime import datetime
 
 
@@ -40,6 +40,31 @@ class ProcesarResponse(BaseModel):
     mensaje: Optional[str] = None
 
 
+# Modelos para procesamiento por lotes
+class ProcesarBatchRequest(BaseModel):
+    items: List[ProcesarRequest]
+
+
+# Resultado de un elemento del lote (en el mismo orden que la solicitud)
+class ProcesarBatchItem(BaseModel):
+    indice: int
+    chat_id: int
+    tipo_tarea: Optional[str] = None
+    resultado: Optional[str] = None
+    success: bool = True
+    error: Optional[Dict[str, Any]] = None  # code, message, details
+
+
+# Modelo para respuesta de procesamiento por lotes
+class ProcesarBatchResponse(BaseModel):
+    resultados: List[ProcesarBatchItem]
+    total: int
+    exitosos: int
+    fallidos: int
+    success: bool = True
+    mensaje: Optional[str] = None
+
+
 # Modelos para consulta de historial
 class ConsultaHistorialRequest(BaseModel):
     chat_id: int
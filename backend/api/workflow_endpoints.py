@@ -6,7 +6,10 @@ Incluye endpoints para gestionar el estado del usuario, procesar texto, consulta
 
 """
 from fastapi import APIRouter, Depends, HTTPException
-from typing import Dict, Any, Optional
+from fastapi.responses import StreamingResponse
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import json
 import logging
 from datetime import datetime
 import os
@@ -14,20 +17,31 @@ from services.db import (
     establecer_modo_usuario,
     obtener_modo_usuario,
     limpiar_modo_usuario,
+    consumir_modo_usuario,
     guardar_consulta,
+    guardar_consultas,
 )
 from core.logging import setup_logger
-from core.errors import handle_exception
-from sqlalchemy import select, desc
+from core.cache import cache_response, normalize_text
+from core.errors import APIError, handle_exception
+from core.retry import with_retry, get_circuit_breaker
+from core.rate_limit import acquire_openai_capacity
+from core.tokens import estimate_request_tokens
+from services.llm_client import get_openai_client
+from sqlalchemy import select, desc, func
 from sqlalchemy.ext.asyncio import AsyncSession
 from services.db import get_db
 from services.models import ConsultaIA
+from services.intent_parser import normalize_query, parse_intent
 from core.auth.api_key import verify_api_key
 from api.schemas import (
     EstadoUsuarioRequest,
     EstadoUsuarioResponse,
     ProcesarRequest,
     ProcesarResponse,
+    ProcesarBatchRequest,
+    ProcesarBatchItem,
+    ProcesarBatchResponse,
     ConsultaHistorialRequest,
     ConsultaHistorialResponse,
     ConsultaItem,
@@ -35,7 +49,6 @@ from api.schemas import (
     InterpretarConsultaResponse,
     ConsultaInteligenteRequest,
 )
-from openai import AsyncOpenAI
 from openai import APIError as OpenAIError
 from openai import RateLimitError as OpenAIRateLimitError
 from openai import APITimeoutError as OpenAITimeoutError
@@ -46,15 +59,21 @@ from services.tasks import translate, summarize, classify
 # Configurar logging
 logger = setup_logger("api.workflow_endpoints")
 
-# Initialize AsyncOpenAI client for consultarInteligente solamente
-client = AsyncOpenAI(
-    api_key=os.getenv("OPENAI_API_KEY"),
-    timeout=float(os.getenv("OPENAI_TIMEOUT", "30.0")),
-    max_retries=3,
-)
+# Definir el router con dependencia global de API Key y una unidad de trabajo por petición
+# (todas las funciones de services.db comparten la sesión de get_db)
+router = APIRouter(tags=["workflow"], dependencies=[Depends(verify_api_key), Depends(get_db)])
+
+# Servicios por tipo de tarea
+TASKS = {"resumir": summarize, "traducir": translate, "clasificar": classify}
 
-# Definir el router con dependencia global de API Key
-router = APIRouter(tags=["workflow"], dependencies=[Depends(verify_api_key)])
+# Configuración del procesamiento por lotes
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "100"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+
+# Modelo usado para interpretar consultas y su circuit breaker
+INTERPRETER_MODEL = "gpt-4o-mini-2024-07-18"
+INTERPRETER_PROMPT_VERSION = "1"  # Incrementar al cambiar el prompt para invalidar la caché
+openai_circuit = get_circuit_breaker(f"openai:{INTERPRETER_MODEL}:chat.completions")
 
 
 # Endpoints
@@ -106,77 +125,110 @@ async def gestionar_estado_usuario(request: EstadoUsuarioRequest):
         )
 
 
-@router.post("/procesar", response_model=ProcesarResponse)
-async def procesar_texto(request: ProcesarRequest):
-    """
-    Procesa texto según el tipo de tarea especificado o el estado del usuario.
-    Endpoint unificado para resumir, traducir, clasificar, etc.
-    """
-    try:
-        # Si no se especifica tipo_tarea, intentamos obtenerlo del estado del usuario
-        tipo_tarea = request.tipo_tarea
-        if not tipo_tarea:
-            modo_actual = await obtener_modo_usuario(request.chat_id)
-            if not modo_actual:
-                raise HTTPException(
-                    status_code=400,
-                    detail={
-                        "code": "E202",
-                        "message": "No se ha especificado tipo de tarea y no hay modo activo",
-                        "details": {"chat_id": request.chat_id},
-                    },
-                )
-            tipo_tarea = modo_actual.replace(
-                "/", ""
-            )  # Convertir '/resumir' a 'resumir'
+# Entrada del servicio según el tipo de tarea
+def _task_input(tipo_tarea: str, texto: str) -> Dict[str, Any]:
+    if tipo_tarea == "traducir":
+        return {"text": texto, "lang": "en"}
+    return {"text": texto}
+
 
-        # Validar texto
-        if not request.texto.strip():
+# Ejecuta una tarea con su servicio y devuelve el resultado completo y como texto
+async def _ejecutar_tarea(
+    tipo_tarea: str, texto: str, context: Dict[str, Any]
+) -> Tuple[Dict[str, Any], str]:
+    if tipo_tarea not in TASKS:
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "code": "E202",
+                "message": f"Tipo de tarea desconocido: {tipo_tarea}",
+                "details": {"tipo_tarea": tipo_tarea},
+            },
+        )
+
+    result = await TASKS[tipo_tarea].run(_task_input(tipo_tarea, texto), context)
+    if tipo_tarea == "resumir":
+        resultado = result.get("summary", "")
+    elif tipo_tarea == "traducir":
+        resultado = result.get("translation", "")
+    else:
+        # Convierte el dict a string
+        resultado = json.dumps(result.get("classification", ""), ensure_ascii=False)
+    return result, resultado
+
+
+# Determina la tarea (la indicada o el modo activo del usuario) y valida el texto
+async def _resolver_tarea(
+    request: ProcesarRequest,
+    leer_modo: Optional[Callable[[int], Awaitable[Optional[str]]]] = None,
+) -> str:
+    # Validar texto (antes de leer el modo, que puede consumirlo)
+    if not request.texto.strip():
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "code": "E202",
+                "message": "El texto no puede estar vacío",
+                "details": {"tipo_tarea": request.tipo_tarea},
+            },
+        )
+
+    # Si no se especifica tipo_tarea, intentamos obtenerlo del estado del usuario
+    tipo_tarea = request.tipo_tarea
+    if not tipo_tarea:
+        modo_actual = await (leer_modo or obtener_modo_usuario)(request.chat_id)
+        if not modo_actual:
             raise HTTPException(
                 status_code=400,
                 detail={
                     "code": "E202",
-                    "message": "El texto no puede estar vacío",
-                    "details": {"tipo_tarea": tipo_tarea},
+                    "message": "No se ha especificado tipo de tarea y no hay modo activo",
+                    "details": {"chat_id": request.chat_id},
                 },
             )
+        tipo_tarea = modo_actual.replace(
+            "/", ""
+        )  # Convertir '/resumir' a 'resumir'
+    return tipo_tarea
+
+
+# La tarea ha fallado: se restaura el modo consumido para que el usuario pueda reintentar
+async def _restaurar_modo(chat_id: int, tipo_tarea: str) -> None:
+    try:
+        await establecer_modo_usuario(chat_id, f"/{tipo_tarea}")
+    except Exception as e:
+        logger.error(f"Error restaurando modo usuario: {str(e)}")
+
+
+@router.post("/procesar", response_model=ProcesarResponse)
+async def procesar_texto(request: ProcesarRequest):
+    """
+    Procesa texto según el tipo de tarea especificado o el estado del usuario.
+    Endpoint unificado para resumir, traducir, clasificar, etc.
+    """
+    try:
+        # Sin tipo_tarea, el modo del usuario se lee y se limpia en la misma sentencia
+        tipo_tarea = await _resolver_tarea(request, leer_modo=consumir_modo_usuario)
+        modo_consumido = not request.tipo_tarea
 
         # Preparar contexto y entrada para los servicios
         context = {"user_id": str(request.chat_id)}
 
         # Ejecutar la tarea según el tipo utilizando los servicios tasks
-        if tipo_tarea == "resumir":
-            input_data = {"text": request.texto}
-            result = await summarize.run(input_data, context)
-            resultado = result.get("summary", "")
-        elif tipo_tarea == "traducir":
-            input_data = {"text": request.texto, "lang": "en"}
-            result = await translate.run(input_data, context)
-            resultado = result.get("translation", "")
-            idioma = "en"
-        elif tipo_tarea == "clasificar":
-            input_data = {"text": request.texto}
-            result = await classify.run(input_data, context)
-            # Convierte el dict a string (puedes usar json.dumps para formato legible)
-            import json
-
-            resultado = json.dumps(result.get("classification", ""), ensure_ascii=False)
-        else:
-            raise HTTPException(
-                status_code=400,
-                detail={
-                    "code": "E202",
-                    "message": f"Tipo de tarea desconocido: {tipo_tarea}",
-                    "details": {"tipo_tarea": tipo_tarea},
-                },
-            )
-
-        # Limpiar el estado del usuario solo si no se guardó en la función de tarea
         try:
-            await limpiar_modo_usuario(request.chat_id)
-        except Exception as e:
-            logger.error(f"Error limpiando modo usuario: {str(e)}")
-            # Continuamos aunque falle la limpieza
+            _, resultado = await _ejecutar_tarea(tipo_tarea, request.texto, context)
+        except Exception:
+            if modo_consumido:
+                await _restaurar_modo(request.chat_id, tipo_tarea)
+            raise
+
+        # Limpiar el estado del usuario si no se ha consumido al resolver la tarea
+        if not modo_consumido:
+            try:
+                await limpiar_modo_usuario(request.chat_id)
+            except Exception as e:
+                logger.error(f"Error limpiando modo usuario: {str(e)}")
+                # Continuamos aunque falle la limpieza
 
         return ProcesarResponse(
             chat_id=request.chat_id,
@@ -206,6 +258,9 @@ async def procesar_texto(request: ProcesarRequest):
     except HTTPException as e:
         # Reenviar HTTPExceptions lanzadas explícitamente
         raise e
+    except APIError as e:
+        # Errores propios (limitador, circuit breaker...) con su código y estado
+        raise e.to_http_exception()
     except Exception as e:
         logger.error(f"Error procesando texto: {str(e)}")
         # Para otros errores, usar el manejador general
@@ -220,6 +275,203 @@ async def procesar_texto(request: ProcesarRequest):
         )
 
 
+# Tareas con respuesta en streaming
+STREAMING_TASKS = {"resumir": summarize, "traducir": translate}
+
+
+# Formatea un evento Server-Sent Events
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+@router.post("/procesar/stream")
+async def procesar_texto_stream(request: ProcesarRequest):
+    """
+    Variante de /procesar que devuelve el resultado por partes (Server-Sent Events).
+    Envía eventos 'token' con cada parte según la genera OpenAI, un evento 'done' con la
+    respuesta completa (como ProcesarResponse) o un evento 'error'.
+    Resumir y traducir se transmiten en streaming; el resto de tareas envían el
+    resultado completo en un único 'token'.
+    """
+    # Como en /procesar, el modo del usuario se lee y se limpia en la misma sentencia
+    tipo_tarea = await _resolver_tarea(request, leer_modo=consumir_modo_usuario)
+    modo_consumido = not request.tipo_tarea
+    context = {"user_id": str(request.chat_id)}
+
+    async def eventos():
+        try:
+            if tipo_tarea in STREAMING_TASKS:
+                partes = []
+                async for parte in STREAMING_TASKS[tipo_tarea].run_stream(
+                    _task_input(tipo_tarea, request.texto), context
+                ):
+                    partes.append(parte)
+                    yield _sse("token", {"text": parte})
+                resultado = "".join(partes).strip()
+            else:
+                _, resultado = await _ejecutar_tarea(tipo_tarea, request.texto, context)
+                yield _sse("token", {"text": resultado})
+
+            if not modo_consumido:
+                try:
+                    await limpiar_modo_usuario(request.chat_id)
+                except Exception as e:
+                    logger.error(f"Error limpiando modo usuario: {str(e)}")
+
+            respuesta = ProcesarResponse(
+                chat_id=request.chat_id,
+                resultado=resultado,
+                tipo_tarea=tipo_tarea,
+                mensaje="Procesamiento completado con éxito",
+            )
+            yield _sse("done", respuesta.model_dump())
+        except Exception as e:
+            logger.error(f"Error procesando texto en streaming: {str(e)}")
+            if modo_consumido:
+                await _restaurar_modo(request.chat_id, tipo_tarea)
+            yield _sse("error", _error_detail(e))
+
+    return StreamingResponse(
+        eventos(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# Convierte una excepción en el detalle de error (elementos del lote, eventos de streaming)
+def _error_detail(e: Exception) -> Dict[str, Any]:
+    if isinstance(e, HTTPException) and isinstance(e.detail, dict):
+        return e.detail
+    if isinstance(e, APIError):
+        return e.to_dict()
+    return handle_exception(e).to_dict()
+
+
+@router.post("/procesar/batch", response_model=ProcesarBatchResponse)
+async def procesar_lote(request: ProcesarBatchRequest):
+    """
+    Procesa varios textos en una sola llamada.
+    Los textos idénticos (misma tarea) se procesan una sola vez, las tareas se ejecutan
+    con concurrencia limitada y el historial se guarda con un único INSERT.
+    Los errores se devuelven por elemento sin interrumpir el resto del lote.
+    """
+    items = request.items
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "code": "E202",
+                "message": f"El lote supera el máximo de {BATCH_MAX_ITEMS} elementos",
+                "details": {"items": len(items), "max_items": BATCH_MAX_ITEMS},
+            },
+        )
+
+    # Modo activo de los usuarios que no indican tipo de tarea (una consulta por usuario)
+    chats_sin_tarea = {item.chat_id for item in items if not item.tipo_tarea}
+    modos = dict(
+        zip(
+            chats_sin_tarea,
+            await asyncio.gather(*(obtener_modo_usuario(c) for c in chats_sin_tarea)),
+        )
+    )
+
+    resultados: List[Optional[ProcesarBatchItem]] = [None] * len(items)
+    grupos: Dict[Tuple[str, str], List[int]] = {}
+    for indice, item in enumerate(items):
+        tipo_tarea = item.tipo_tarea or (modos.get(item.chat_id) or "").replace("/", "")
+        if not tipo_tarea:
+            error = {
+                "code": "E202",
+                "message": "No se ha especificado tipo de tarea y no hay modo activo",
+                "details": {"chat_id": item.chat_id},
+            }
+        elif not item.texto.strip():
+            error = {
+                "code": "E202",
+                "message": "El texto no puede estar vacío",
+                "details": {"tipo_tarea": tipo_tarea},
+            }
+        elif tipo_tarea not in TASKS:
+            error = {
+                "code": "E202",
+                "message": f"Tipo de tarea desconocido: {tipo_tarea}",
+                "details": {"tipo_tarea": tipo_tarea},
+            }
+        else:
+            # Textos idénticos (tras normalizar) comparten una única ejecución
+            grupos.setdefault((tipo_tarea, normalize_text(item.texto)), []).append(indice)
+            continue
+        resultados[indice] = ProcesarBatchItem(
+            indice=indice, chat_id=item.chat_id, tipo_tarea=tipo_tarea or None,
+            success=False, error=error,
+        )
+
+    semaforo = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def ejecutar(tipo_tarea: str, indices: List[int]):
+        item = items[indices[0]]
+        # El historial se guarda al final en bloque, no desde cada tarea
+        context = {"user_id": str(item.chat_id), "persist": False}
+        async with semaforo:
+            try:
+                return await _ejecutar_tarea(tipo_tarea, item.texto, context)
+            except Exception as e:
+                logger.error(f"Error procesando elemento {indices[0]} del lote: {str(e)}")
+                return e
+
+    claves = list(grupos)
+    salidas = await asyncio.gather(
+        *(ejecutar(clave[0], grupos[clave]) for clave in claves)
+    )
+
+    registros = []
+    for clave, salida in zip(claves, salidas):
+        tipo_tarea = clave[0]
+        for indice in grupos[clave]:
+            item = items[indice]
+            if isinstance(salida, Exception):
+                resultados[indice] = ProcesarBatchItem(
+                    indice=indice, chat_id=item.chat_id, tipo_tarea=tipo_tarea,
+                    success=False, error=_error_detail(salida),
+                )
+                continue
+            result, resultado = salida
+            resultados[indice] = ProcesarBatchItem(
+                indice=indice, chat_id=item.chat_id, tipo_tarea=tipo_tarea, resultado=resultado,
+            )
+            registros.append(
+                {
+                    "user_id": str(item.chat_id),
+                    **TASKS[tipo_tarea].history_record(
+                        result, _task_input(tipo_tarea, item.texto)
+                    ),
+                }
+            )
+
+    # Persistencia del historial en bloque
+    try:
+        await guardar_consultas(registros)
+    except Exception as e:
+        logger.error(f"Error guardando el historial del lote: {str(e)}")
+        # Continuamos aunque falle la persistencia
+
+    # Limpiar el modo de los usuarios que lo han usado, como en /procesar
+    for chat_id in (c for c, modo in modos.items() if modo):
+        try:
+            await limpiar_modo_usuario(chat_id)
+        except Exception as e:
+            logger.error(f"Error limpiando modo usuario: {str(e)}")
+
+    exitosos = sum(1 for r in resultados if r.success)
+    return ProcesarBatchResponse(
+        resultados=resultados,
+        total=len(resultados),
+        exitosos=exitosos,
+        fallidos=len(resultados) - exitosos,
+        mensaje=f"Procesados {exitosos} de {len(resultados)} elementos ({len(claves)} textos distintos)",
+    )
+
+
 @router.post("/consultar", response_model=ConsultaHistorialResponse)
 async def consultar_historial(
     request: ConsultaHistorialRequest, db: AsyncSession = Depends(get_db)
@@ -273,6 +525,20 @@ async def consultar_historial(
         )
 
 
+# Columnas de ConsultaIA que se devuelven en un ConsultaItem
+CONSULTA_ITEM_COLUMNS = (
+    ConsultaIA.id,
+    ConsultaIA.tipo_tarea,
+    ConsultaIA.texto_original,
+    ConsultaIA.resultado,
+    ConsultaIA.fecha,
+)
+
+
+# Nombres de las posiciones contadas desde el final
+POSICIONES_DESDE_EL_FINAL = {1: "último", 2: "penúltimo", 3: "antepenúltimo"}
+
+
 @router.post("/consultar-inteligente")
 async def consultar_inteligente(
     request: ConsultaInteligenteRequest, db: AsyncSession = Depends(get_db)
@@ -285,112 +551,37 @@ async def consultar_inteligente(
     - "Quiero la fecha del primer registro traducido"
     - "Dame toda la tabla"
 
-    El endpoint interpreta la intención usando IA, consulta la base de datos y devuelve la respuesta adecuada.
+    El endpoint interpreta la intención con un intérprete local de reglas y, si no
+    reconoce la frase, usando IA; después consulta la base de datos y devuelve la respuesta adecuada.
     Ejemplo de entrada:
         {"chat_id": 12345, "texto": "dame los 3 últimos registros clasificados"}
     Ejemplo de salida:
         {"success": true, "consultas": [...], "total": 3, "mensaje": "Se encontraron 3 registros."}
     """
-    prompt = f"""
-Eres un asistente que ayuda a estructurar consultas de historial para un bot de Telegram.
-Dado el siguiente mensaje del usuario, responde SOLO con un JSON que indique:
-- accion: "listar", "contar", "campo_especifico"
-- tipo_tarea: "resumir", "traducir", "clasificar" o null
-- limit: número de resultados (por defecto 5)
-- orden: "desc" o "asc"
-- campo: si el usuario pide un campo específico (por ejemplo, "fecha"), si no, null
-- respuesta_esperada: "lista", "numero", "valor"
-- Si el usuario pide el primer, segundo, tercer, cuarto, etc. registro, incluye un campo "posicion" (base 1, es decir, 1=primero, 2=segundo, etc.)
-- Si el usuario pide el "antepenúltimo" registro, pon "posicion": -2; si pide el "penúltimo", pon "posicion": -1; si pide el "último", pon "posicion": -1.
-- Si el usuario pide el "registro número N", pon "posicion": N.
-
-Ejemplo: "cuántos registros se han clasificado"
-Respuesta: {{"accion": "contar", "tipo_tarea": "clasificar", "respuesta_esperada": "numero"}}
-
-Ejemplo: "quiero la fecha del primer registro traducido"
-Respuesta: {{"accion": "campo_especifico", "tipo_tarea": "traducir", "limit": 1, "orden": "asc", "campo": "fecha", "posicion": 1, "respuesta_esperada": "valor"}}
-
-Ejemplo: "dame la fecha del cuarto registro"
-Respuesta: {{"accion": "campo_especifico", "tipo_tarea": null, "limit": 4, "orden": "asc", "campo": "fecha", "posicion": 4, "respuesta_esperada": "valor"}}
-
-Ejemplo: "dame el tercer registro"
-Respuesta: {{"accion": "listar", "tipo_tarea": null, "limit": 3, "orden": "asc", "posicion": 3, "respuesta_esperada": "valor"}}
-
-Ejemplo: "dame el antepenúltimo registro"
-Respuesta: {{"accion": "listar", "tipo_tarea": null, "limit": 2, "orden": "desc", "posicion": -2, "respuesta_esperada": "valor"}}
-
-Ejemplo: "dame el registro número 15"
-Respuesta: {{"accion": "listar", "tipo_tarea": null, "limit": 15, "orden": "asc", "posicion": 15, "respuesta_esperada": "valor"}}
-
-Ejemplo: "dame los 3 últimos registros clasificados"
-Respuesta: {{"accion": "listar", "tipo_tarea": "clasificar", "limit": 3, "orden": "desc", "respuesta_esperada": "lista"}}
-
-Ejemplo: "dame toda la tabla"
-Respuesta: {{"accion": "listar", "tipo_tarea": null, "limit": 100, "orden": "desc", "respuesta_esperada": "lista"}}
+    # Primero el intérprete local; el modelo sólo si la frase no se reconoce
+    data = parse_intent(request.texto)
+    if data is None:
+        try:
+            data = await _interpretar_con_llm(request.texto)
+        except Exception as e:
+            logger.error(f"Error interpretando consulta: {str(e)}")
+            return {"success": False, "mensaje": f"Error interpretando consulta: {str(e)}"}
 
-Mensaje del usuario: "{request.texto}"
-    """
-    try:
-        response = await client.chat.completions.create(
-            model="gpt-4o-mini-2024-07-18",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "Eres un asistente experto en estructurar consultas para un historial de IA.",
-                },
-                {"role": "user", "content": prompt},
-            ],
-            temperature=0.1,
-            max_tokens=200,
-        )
-        import json
-
-        content = response.choices[0].message.content.strip()
-        data = json.loads(content)
-        accion = data.get("accion", "listar")
-        tipo_tarea = data.get("tipo_tarea")
-        limit = data.get("limit", 5)
-        orden = data.get("orden", "desc")
-        campo = data.get("campo")
-        respuesta_esperada = data.get("respuesta_esperada", "lista")
-    except Exception as e:
-        logger.error(f"Error interpretando consulta: {str(e)}")
-        return {"success": False, "mensaje": f"Error interpretando consulta: {str(e)}"}
+    accion = data.get("accion", "listar")
+    tipo_tarea = data.get("tipo_tarea")
+    limit = data.get("limit", 5)
+    orden = data.get("orden", "desc")
+    campo = data.get("campo")
+    respuesta_esperada = data.get("respuesta_esperada", "lista")
 
     try:
-        query = select(ConsultaIA).where(ConsultaIA.chat_id == request.chat_id)
+        filtros = [ConsultaIA.chat_id == request.chat_id]
         if tipo_tarea:
-            query = query.where(ConsultaIA.tipo_tarea == tipo_tarea)
-        if orden == "asc":
-            query = query.order_by(ConsultaIA.fecha.asc())
-        else:
-            query = query.order_by(desc(ConsultaIA.fecha))
+            filtros.append(ConsultaIA.tipo_tarea == tipo_tarea)
 
-        # Si se pide un registro específico por posición y no es una lista
-        if (accion in ["listar", "campo_especifico"]) and data.get("posicion") and respuesta_esperada != "lista":
-            idx = data.get("posicion", 1)
-            if idx < 0:
-                # Para negativos, necesitamos saber el total
-                count_query = select(ConsultaIA).where(ConsultaIA.chat_id == request.chat_id)
-                if tipo_tarea:
-                    count_query = count_query.where(ConsultaIA.tipo_tarea == tipo_tarea)
-                total = (await db.execute(count_query)).scalars().all()
-                total_count = len(total)
-                idx = total_count + idx
-            else:
-                idx = idx - 1
-            if idx < 0:
-                return {"success": False, "mensaje": f"No hay un registro en la posición solicitada (índice negativo)"}
-            query = query.offset(idx).limit(1)
-        elif accion in ["listar", "campo_especifico"]:
-            query = query.limit(limit)
-
-        result = await db.execute(query)
-        consultas = result.scalars().all()
-
-        # Acción: contar
+        # Acción: contar (COUNT(*) en la base de datos, sin cargar filas)
         if accion == "contar":
-            total = len(consultas)
+            total = await db.scalar(select(func.count()).select_from(ConsultaIA).where(*filtros))
             return {
                 "success": True,
                 "chat_id": request.chat_id,
@@ -398,21 +589,57 @@ Mensaje del usuario: "{request.texto}"
                 "mensaje": f"Se han encontrado {total} registros{f' de tipo {tipo_tarea}' if tipo_tarea else ''}.",
             }
 
-        # Acción: campo_especifico
-        if accion == "campo_especifico" and campo and consultas:
-            valor = getattr(consultas[0], campo, None)
+        # Si se pide un registro específico por posición y no es una lista
+        ascendente = orden == "asc"
+        offset, limite = 0, limit
+        if (accion in ["listar", "campo_especifico"]) and data.get("posicion") and respuesta_esperada != "lista":
+            idx = data.get("posicion", 1)
+            if idx < 0:
+                # Posición contada desde el final: se invierte el orden en lugar
+                # de contar todo el historial
+                ascendente = not ascendente
+                offset = -idx - 1
+            else:
+                offset = idx - 1
+            limite = 1
+        orden_fecha = ConsultaIA.fecha.asc() if ascendente else desc(ConsultaIA.fecha)
+
+        # Acción: campo_especifico (sólo se lee esa columna)
+        if accion == "campo_especifico" and campo:
+            columna_valida = campo in ConsultaIA.__table__.columns
+            columna = getattr(ConsultaIA, campo) if columna_valida else ConsultaIA.id
+            query = select(columna).where(*filtros).order_by(orden_fecha).offset(offset).limit(1)
+            fila = (await db.execute(query)).first()
+            if fila is None:
+                return {"success": False, "mensaje": "No hay un registro en la posición solicitada"}
+            valor = fila[0] if columna_valida else None
             return {
                 "success": True,
                 "chat_id": request.chat_id,
                 campo: valor,
                 "mensaje": f"El campo '{campo}' del registro solicitado {'de tipo ' + tipo_tarea if tipo_tarea else ''} es: {valor}",
             }
+
+        # Sólo las columnas de la respuesta
+        query = (
+            select(*CONSULTA_ITEM_COLUMNS)
+            .where(*filtros)
+            .order_by(orden_fecha)
+            .offset(offset)
+            .limit(limite)
+        )
+        result = await db.execute(query)
+        consultas = result.all()
+
         # Acción: listar con posición específica
         if accion == "listar" and data.get("posicion") and consultas and respuesta_esperada != "lista":
             item = consultas[0]
             # Construir descripción de la posición
             pos = data.get("posicion")
-            if pos == -1:
+            if isinstance(pos, int) and pos > 0 and orden == "desc":
+                # Posición positiva sobre el orden descendente (intérprete local): desde el final
+                pos_desc = POSICIONES_DESDE_EL_FINAL.get(pos, f"número {pos} empezando por el final")
+            elif pos == -1:
                 pos_desc = "penúltimo" if len(consultas) > 1 else "último"
             elif pos == -2:
                 pos_desc = "antepenúltimo"
@@ -456,6 +683,99 @@ Mensaje del usuario: "{request.texto}"
         return {"success": False, "mensaje": f"Error consultando historial: {str(e)}"}
 
 
+# Clave de caché de una intención: sólo depende del texto (sin mayúsculas, tildes ni signos)
+def _intent_cache_key(texto: str) -> Dict[str, Any]:
+    return {
+        "text": normalize_query(texto),
+        "model": INTERPRETER_MODEL,
+        "prompt": INTERPRETER_PROMPT_VERSION,
+    }
+
+
+# Interpreta la consulta del usuario con OpenAI y devuelve la intención en JSON
+@cache_response(
+    ttl=int(os.getenv("INTENT_CACHE_TTL", "604800")),  # 7 días por defecto
+    namespace="consultas.intent",
+    key_builder=_intent_cache_key,
+)
+async def _interpretar_con_llm(texto: str) -> Dict[str, Any]:
+    prompt = f"""
+Eres un asistente que ayuda a estructurar consultas de historial para un bot de Telegram.
+Dado el siguiente mensaje del usuario, responde SOLO con un JSON que indique:
+- accion: "listar", "contar", "campo_especifico"
+- tipo_tarea: "resumir", "traducir", "clasificar" o null
+- limit: número de resultados (por defecto 5)
+- orden: "desc" o "asc"
+- campo: si el usuario pide un campo específico (por ejemplo, "fecha"), si no, null
+- respuesta_esperada: "lista", "numero", "valor"
+- Si el usuario pide el primer, segundo, tercer, cuarto, etc. registro, incluye un campo "posicion" (base 1, es decir, 1=primero, 2=segundo, etc.)
+- Si el usuario pide el "antepenúltimo" registro, pon "posicion": -2; si pide el "penúltimo", pon "posicion": -1; si pide el "último", pon "posicion": -1.
+- Si el usuario pide el "registro número N", pon "posicion": N.
+
+Ejemplo: "cuántos registros se han clasificado"
+Respuesta: {{"accion": "contar", "tipo_tarea": "clasificar", "respuesta_esperada": "numero"}}
+
+Ejemplo: "quiero la fecha del primer registro traducido"
+Respuesta: {{"accion": "campo_especifico", "tipo_tarea": "traducir", "limit": 1, "orden": "asc", "campo": "fecha", "posicion": 1, "respuesta_esperada": "valor"}}
+
+Ejemplo: "dame la fecha del cuarto registro"
+Respuesta: {{"accion": "campo_especifico", "tipo_tarea": null, "limit": 4, "orden": "asc", "campo": "fecha", "posicion": 4, "respuesta_esperada": "valor"}}
+
+Ejemplo: "dame el tercer registro"
+Respuesta: {{"accion": "listar", "tipo_tarea": null, "limit": 3, "orden": "asc", "posicion": 3, "respuesta_esperada": "valor"}}
+
+Ejemplo: "dame el antepenúltimo registro"
+Respuesta: {{"accion": "listar", "tipo_tarea": null, "limit": 2, "orden": "desc", "posicion": -2, "respuesta_esperada": "valor"}}
+
+Ejemplo: "dame el registro número 15"
+Respuesta: {{"accion": "listar", "tipo_tarea": null, "limit": 15, "orden": "asc", "posicion": 15, "respuesta_esperada": "valor"}}
+
+Ejemplo: "dame los 3 últimos registros clasificados"
+Respuesta: {{"accion": "listar", "tipo_tarea": "clasificar", "limit": 3, "orden": "desc", "respuesta_esperada": "lista"}}
+
+Ejemplo: "dame toda la tabla"
+Respuesta: {{"accion": "listar", "tipo_tarea": null, "limit": 100, "orden": "desc", "respuesta_esperada": "lista"}}
+
+Mensaje del usuario: "{texto}"
+    """
+    response = await call_openai_with_retry(prompt)
+    content = response.choices[0].message.content.strip()
+    return json.loads(content)
+
+
+# Llama a OpenAI con reintentos para interpretar la consulta del usuario
+@with_retry
+async def call_openai_with_retry(prompt: str):
+    """
+    Función protegida con reintentos para interpretar una consulta con OpenAI
+
+    Args:
+        prompt: Prompt con las instrucciones y el mensaje del usuario
+
+    Returns:
+        Respuesta de OpenAI
+    """
+    messages = [
+        {
+            "role": "system",
+            "content": "Eres un asistente experto en estructurar consultas para un historial de IA.",
+        },
+        {"role": "user", "content": prompt},
+    ]
+    max_tokens = 200
+
+    # Esperar capacidad en el limitador de RPM/TPM antes de llamar
+    await acquire_openai_capacity(estimate_request_tokens(messages, max_tokens))
+
+    return await openai_circuit.call(
+        get_openai_client().chat.completions.create,
+        model=INTERPRETER_MODEL,
+        messages=messages,
+        temperature=0.1,
+        max_tokens=max_tokens,
+    )
+
+
 @router.get("/health")
 async def health_check():
     """
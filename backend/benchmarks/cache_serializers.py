@@ -0,0 +1,92 @@
+"""
+Benchmark de los códecs de caché frente al JSON plano anterior.
+
+Mide el tiempo medio de codificación/decodificación y el tamaño en bytes de entradas
+típicas (clasificación, resumen y traducción larga) para cada formato y compresión
+disponible.
+
+Uso (desde backend/):
+    python -m benchmarks.cache_serializers
+
+"""
+import json
+import time
+from typing import Any, Callable, Dict, List, Tuple
+from core.serializers import CacheCodec, msgpack, orjson, zstandard
+
+ITERATIONS = 2000
+
+PARAGRAPH = (
+    "El equipo de finanzas ha revisado el presupuesto trimestral y propone reducir "
+    "los gastos de viaje en un quince por ciento, manteniendo la inversión en "
+    "formación. Se solicita la aprobación antes del viernes para poder cerrar el mes. "
+)
+
+SAMPLES: Dict[str, Dict[str, Any]] = {
+    "clasificacion": {
+        "classification": {"category": "solicitud", "urgency": "high", "theme": "finanzas", "confidence": 0.9},
+        "text_length": 240,
+        "model_used": "gpt-4o-mini-2024-07-18",
+        "cached": False,
+    },
+    "resumen": {
+        "summary": PARAGRAPH * 3,
+        "original_length": 4800,
+        "summary_length": len(PARAGRAPH * 3),
+        "model_used": "gpt-4o-mini-2024-07-18",
+        "cached": False,
+    },
+    "traduccion_larga": {
+        "translation": PARAGRAPH * 60,
+        "source_language": "es",
+        "target_language": "en",
+        "model_used": "gpt-4o-mini-2024-07-18",
+        "cached": False,
+    },
+}
+
+
+# Mide el tiempo medio en microsegundos de una función
+def _time_us(fn: Callable[[], Any]) -> float:
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        fn()
+    return (time.perf_counter() - start) / ITERATIONS * 1e6
+
+
+def _candidates() -> List[Tuple[str, Callable[[Any], bytes], Callable[[bytes], Any]]]:
+    # Camino anterior: json.dumps a str, guardado con decode_responses=True
+    candidates = [
+        (
+            "json plano (actual)",
+            lambda v: json.dumps(v, default=str).encode(),
+            json.loads,
+        )
+    ]
+    configs = [("json", "none"), ("json", "zlib")]
+    if orjson is not None:
+        configs += [("orjson", "none"), ("orjson", "zlib")]
+    if msgpack is not None:
+        configs += [("msgpack", "zlib")]
+    if zstandard is not None:
+        configs += [("json", "zstd")] + ([("orjson", "zstd")] if orjson else [])
+    for fmt, compression in configs:
+        codec = CacheCodec(fmt=fmt, compression=compression)
+        candidates.append((f"{fmt}+{compression}", codec.encode, codec.decode))
+    return candidates
+
+
+def main() -> None:
+    for name, value in SAMPLES.items():
+        entry = {"_e": 1, "v": value, "t": time.time(), "d": 1.2}
+        print(f"\n== {name} ==")
+        print(f"{'códec':<22}{'bytes':>8}{'encode µs':>12}{'decode µs':>12}")
+        for label, encode, decode in _candidates():
+            data = encode(entry)
+            encode_us = _time_us(lambda: encode(entry))
+            decode_us = _time_us(lambda: decode(data))
+            print(f"{label:<22}{len(data):>8}{encode_us:>12.1f}{decode_us:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
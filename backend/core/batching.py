@@ -0,0 +1,119 @@
+"""
+Este módulo proporciona un agrupador de peticiones (micro-batching).
+
+Las peticiones que llegan dentro de una ventana corta se agrupan y se procesan con una
+sola llamada (p. ej. una única completion para varios textos); cada llamante recibe
+después su propio resultado. El lote se procesa fuera del contexto de las peticiones
+(presupuesto de tiempo, sesión de base de datos) y cada llamante espera su resultado
+dentro de su propio presupuesto.
+
+"""
+import asyncio
+import contextvars
+from typing import Awaitable, Callable, Dict, Generic, List, Optional, Set, Tuple, TypeVar, Union
+from core.logging import setup_logger
+from core.retry import wait_within_deadline
+
+logger = setup_logger("core.batching")
+
+# I: Tipo de los elementos, R: Tipo de los resultados
+I = TypeVar("I")
+R = TypeVar("R")
+
+
+class MicroBatcher(Generic[I, R]):
+    """
+    Agrupa elementos enviados de forma concurrente y los procesa por lotes.
+
+    El lote se procesa cuando alcanza `max_batch_size` elementos o cuando han pasado
+    `max_wait` segundos desde que llegó el primero.
+
+    Args:
+        name: Nombre del agrupador (para logs y estadísticas)
+        process: Función que recibe la lista de elementos y devuelve una lista de
+            resultados en el mismo orden; un resultado que sea una excepción se
+            propaga sólo al llamante de ese elemento
+        max_batch_size: Tamaño máximo del lote
+        max_wait: Espera máxima en segundos para completar un lote
+    """
+
+    def __init__(
+        self,
+        name: str,
+        process: Callable[[List[I]], Awaitable[List[Union[R, Exception]]]],
+        max_batch_size: int = 10,
+        max_wait: float = 0.02,
+    ):
+        self.name = name
+        self.process = process
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._pending: List[Tuple[I, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self.stats: Dict[str, int] = {"batches": 0, "items": 0, "errors": 0}
+
+    async def submit(self, item: I) -> R:
+        """
+        Añade un elemento al lote en curso y espera su resultado
+
+        Args:
+            item: Elemento a procesar
+
+        Returns:
+            R: Resultado del elemento
+
+        Raises:
+            asyncio.TimeoutError: Si se agota el presupuesto de tiempo de la petición
+                (el lote sigue para el resto de llamantes)
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(
+                self.max_wait, self._flush, context=contextvars.Context()
+            )
+
+        return await wait_within_deadline(future)
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        # El lote sirve a varias peticiones: no hereda el contexto (presupuesto de tiempo,
+        # sesión de base de datos) de la que lo ha completado
+        task = asyncio.get_running_loop().create_task(
+            self._run(batch), context=contextvars.Context()
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[I, asyncio.Future]]) -> None:
+        self.stats["batches"] += 1
+        self.stats["items"] += len(batch)
+        logger.debug(f"Procesando lote {self.name} de {len(batch)} elementos")
+        try:
+            results = await self.process([item for item, _ in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(
+                    f"El lote {self.name} devolvió {len(results)} resultados para {len(batch)} elementos"
+                )
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.error(f"Error procesando lote {self.name}: {str(e)}")
+            results = [e] * len(batch)
+
+        for (_, future), result in zip(batch, results):
+            if future.done():  # El llamante se canceló
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
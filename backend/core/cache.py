@@ -1,18 +1,44 @@
 """
 Este módulo proporciona una capa de caché para almacenar y recuperar resultados de funciones.
 
-Utiliza Redis como backend de caché.
+Utiliza Redis como backend de caché. Las funciones asíncronas usan un cliente
+`redis.asyncio` con pool de conexiones para no bloquear el event loop; su ciclo de
+vida se gestiona con `init_cache`/`close_cache` en el arranque y apagado de la app.
+
+Delante de Redis hay una caché en memoria por proceso (LRU con TTL y límite de
+tamaño en bytes) que sirve los aciertos repetidos sin salto de red ni deserialización.
+Los valores se guardan en Redis como bytes codificados por `core.serializers`.
+
+Los fallos concurrentes de la misma clave se agrupan (single-flight) para que sólo
+una llamada ejecute la función, también entre workers mediante un lock en Redis.
+
+Cada entrada guarda cuándo se calculó y cuánto costó calcularla. Las entradas
+caducadas hace poco se sirven mientras se refrescan en segundo plano
+(stale-while-revalidate), y las que están a punto de caducar pueden refrescarse
+antes de tiempo de forma probabilística (XFetch) para repartir los refrescos.
 
 """
 import os
 import json
 import hashlib
+import math
+import random
+import re
+import time
+import unicodedata
 import redis
-from typing import Dict, Any, Optional, Callable, TypeVar, ParamSpec, cast
+import redis.asyncio as aioredis
+from cachetools import TTLCache
+from typing import Dict, Any, Optional, Callable, Awaitable, TypeVar, ParamSpec, Tuple, Set, cast
 import functools
 import logging
 import asyncio
+import contextvars
+from contextvars import ContextVar
 from core.logging import setup_logger
+from core.retry import deadline_scope, remaining_time
+from core.singleflight import SingleFlight, distributed_do, acquire_lock, release_lock
+from core.serializers import CacheCodec, default_codec
 
 # Configuración del logger
 logger = setup_logger("core.cache")
@@ -22,16 +48,43 @@ REDIS_HOST = os.getenv("REDIS_HOST", "redis")
 REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
 REDIS_DB = int(os.getenv("REDIS_DB", "0"))
 REDIS_EXPIRE = int(os.getenv("REDIS_CACHE_TTL", "86400"))  # 24 horas por defecto
+# 'content': claves por contenido (si la función define key_builder); 'full': todos los argumentos
+CACHE_KEY_MODE = os.getenv("CACHE_KEY_MODE", "content").lower()
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "2.0"))
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", "5.0"))
+
+# Configuración de la caché local en memoria (primer nivel)
+LOCAL_CACHE_ENABLED = os.getenv("LOCAL_CACHE_ENABLED", "true").lower() == "true"
+LOCAL_CACHE_TTL = int(os.getenv("LOCAL_CACHE_TTL", "300"))  # 5 minutos por defecto
+LOCAL_CACHE_MAX_BYTES = int(os.getenv("LOCAL_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+LOCAL_CACHE_MAX_ITEM_BYTES = int(os.getenv("LOCAL_CACHE_MAX_ITEM_BYTES", str(256 * 1024)))
 
-# Inicializar conexión Redis
+# Configuración de la coalescencia de peticiones (single-flight)
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+SINGLE_FLIGHT_DISTRIBUTED = (
+    os.getenv("SINGLE_FLIGHT_DISTRIBUTED", "true").lower() == "true"
+)
+SINGLE_FLIGHT_LOCK_TTL = float(os.getenv("SINGLE_FLIGHT_LOCK_TTL", "60"))
+SINGLE_FLIGHT_WAIT_TIMEOUT = float(os.getenv("SINGLE_FLIGHT_WAIT_TIMEOUT", "45"))
+SINGLE_FLIGHT_POLL_INTERVAL = float(os.getenv("SINGLE_FLIGHT_POLL_INTERVAL", "0.1"))
+
+# Configuración del refresco de entradas (stale-while-revalidate y XFetch)
+CACHE_STALE_TTL = int(os.getenv("CACHE_STALE_TTL", "3600"))  # 0 desactiva el modo stale
+CACHE_XFETCH_BETA = float(os.getenv("CACHE_XFETCH_BETA", "1.0"))  # 0 desactiva el refresco anticipado
+
+# Inicializar conexión Redis (cliente síncrono, para funciones no asíncronas)
 redis_client = redis.Redis(
     host=REDIS_HOST,
     port=REDIS_PORT,
     db=REDIS_DB,
-    decode_responses=True,
-    socket_connect_timeout=5,
+    decode_responses=False,
+    socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
 )
 
+# Cliente asíncrono compartido (se crea en init_cache o bajo demanda)
+async_redis_client: Optional[aioredis.Redis] = None
+
 # Define tipos para los decoradores
 # T: Tipo de retorno de la función
 # P: Parámetros de la función
@@ -39,6 +92,325 @@ T = TypeVar("T")
 P = ParamSpec("P")
 
 
+# Caché local LRU con TTL y contabilidad de tamaño en bytes
+class LocalCache:
+    """
+    Caché en memoria de primer nivel para un espacio de nombres (una tarea).
+
+    Los valores se guardan ya deserializados y se devuelven sin copiar, por lo que
+    deben tratarse como de sólo lectura. El tamaño de cada entrada se estima con la
+    longitud de su serialización JSON, que es la misma que se envía a Redis.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = LOCAL_CACHE_MAX_BYTES,
+        ttl: int = LOCAL_CACHE_TTL,
+        max_item_bytes: int = LOCAL_CACHE_MAX_ITEM_BYTES,
+    ):
+        self.max_bytes = max_bytes
+        self.max_item_bytes = min(max_item_bytes, max_bytes)
+        self._entries: TTLCache = TTLCache(
+            maxsize=max_bytes, ttl=ttl, getsizeof=lambda entry: entry[1]
+        )
+
+    def get(self, key: str) -> Optional[Any]:
+        entry: Optional[Tuple[Any, int]] = self._entries.get(key)
+        return entry[0] if entry is not None else None
+
+    def set(self, key: str, value: Any, size: int) -> None:
+        # Las entradas demasiado grandes no compensan: se quedan sólo en Redis
+        if size > self.max_item_bytes:
+            return
+        self._entries[key] = (value, size)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._entries.currsize,
+            "max_bytes": self.max_bytes,
+        }
+
+
+# Cachés locales y contadores de aciertos/fallos por espacio de nombres
+_local_caches: Dict[str, LocalCache] = {}
+_cache_stats: Dict[str, Dict[str, int]] = {}
+
+# Ejecuciones en curso compartidas por todas las funciones cacheadas del proceso
+_flights = SingleFlight()
+
+# Refrescos en segundo plano en curso (las referencias evitan que el GC los cancele)
+_refreshing: Set[str] = set()
+_background_tasks: Set[asyncio.Task] = set()
+
+# Indica si el código se ejecuta dentro de un refresco en segundo plano
+_in_background_refresh: ContextVar[bool] = ContextVar(
+    "cache_background_refresh", default=False
+)
+
+
+def is_background_refresh() -> bool:
+    """
+    Indica si la llamada actual es un refresco de caché en segundo plano
+
+    Las funciones cacheadas lo usan para omitir efectos por usuario (historial,
+    estado), que ya se aplicaron al servir la entrada antigua.
+
+    Returns:
+        bool: True dentro de un refresco en segundo plano
+    """
+    return _in_background_refresh.get()
+
+
+def _get_stats(namespace: str) -> Dict[str, int]:
+    if namespace not in _cache_stats:
+        _cache_stats[namespace] = {
+            "local_hits": 0,
+            "local_misses": 0,
+            "redis_hits": 0,
+            "redis_misses": 0,
+            "redis_errors": 0,
+            "coalesced": 0,
+            "stale_served": 0,
+            "refreshes": 0,
+        }
+    return _cache_stats[namespace]
+
+
+def get_cache_stats() -> Dict[str, Any]:
+    """
+    Devuelve los contadores de aciertos/fallos de cada nivel por espacio de nombres
+
+    Returns:
+        Dict: Estadísticas de la caché local y de Redis
+    """
+    stats = {}
+    for namespace, counters in _cache_stats.items():
+        stats[namespace] = dict(counters)
+        if namespace in _local_caches:
+            stats[namespace]["local"] = _local_caches[namespace].stats()
+    return stats
+
+
+# Crea el cliente asíncrono con su pool de conexiones
+def _create_async_client() -> aioredis.Redis:
+    pool = aioredis.ConnectionPool(
+        host=REDIS_HOST,
+        port=REDIS_PORT,
+        db=REDIS_DB,
+        decode_responses=False,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+        socket_timeout=REDIS_SOCKET_TIMEOUT,
+        health_check_interval=30,
+    )
+    return aioredis.Redis(connection_pool=pool)
+
+
+def get_async_redis() -> aioredis.Redis:
+    """
+    Devuelve el cliente Redis asíncrono compartido
+
+    Si la aplicación no lo ha inicializado (scripts, tests), se crea bajo demanda.
+
+    Returns:
+        aioredis.Redis: Cliente asíncrono con pool de conexiones
+    """
+    global async_redis_client
+    if async_redis_client is None:
+        async_redis_client = _create_async_client()
+    return async_redis_client
+
+
+async def init_cache() -> None:
+    """Inicializa el cliente Redis asíncrono al arrancar la aplicación"""
+    client = get_async_redis()
+    try:
+        await client.ping()
+        logger.info(
+            f"Redis asíncrono conectado ({REDIS_HOST}:{REDIS_PORT}, "
+            f"pool={REDIS_MAX_CONNECTIONS})"
+        )
+    except redis.RedisError as e:
+        # La caché es opcional: la aplicación arranca aunque Redis no responda
+        logger.error(f"No se pudo conectar con Redis al iniciar: {str(e)}")
+
+
+async def close_cache() -> None:
+    """Cierra el cliente Redis asíncrono y libera su pool de conexiones"""
+    global async_redis_client
+    if async_redis_client is None:
+        return
+    try:
+        await async_redis_client.aclose(close_connection_pool=True)
+        logger.info("Conexiones Redis cerradas")
+    except redis.RedisError as e:
+        logger.error(f"Error cerrando conexiones Redis: {str(e)}")
+    finally:
+        async_redis_client = None
+
+
+# Envuelve un resultado con el momento de cálculo y su coste (para XFetch)
+def _make_entry(value: Any, delta: float) -> Dict[str, Any]:
+    return {"_e": 1, "v": value, "t": time.time(), "d": round(delta, 4)}
+
+
+# Deserializa una entrada leída de Redis
+def _decode(raw: bytes, codec: CacheCodec) -> Dict[str, Any]:
+    data = codec.decode(raw)
+    if not isinstance(data, dict):
+        raise ValueError("El valor cacheado no es un dict")
+    # Entradas anteriores al formato con metadatos: se consideran recién calculadas
+    if data.get("_e") != 1:
+        data = {"_e": 1, "v": data, "t": time.time(), "d": 0.0}
+    # Aseguramos que siempre se deserializa a dict
+    if not isinstance(data["v"], dict):
+        raise ValueError("El valor cacheado no es un dict")
+    return data
+
+
+# Estado de una entrada: 'fresh', 'refresh' (servir y refrescar) o 'expired'
+def _freshness(entry: Dict[str, Any], ttl: int, stale_ttl: int, beta: float) -> str:
+    age = time.time() - entry["t"]
+    if age >= ttl + stale_ttl:
+        return "expired"
+    if age >= ttl:
+        return "refresh"
+    # XFetch: la probabilidad de refrescar crece al acercarse la caducidad y con el
+    # coste de recalcular (-log(u) con u en (0, 1] es una exponencial)
+    if beta > 0 and entry["d"] > 0:
+        if age - entry["d"] * beta * math.log(1.0 - random.random()) >= ttl:
+            return "refresh"
+    return "fresh"
+
+
+# Lee y deserializa una entrada de caché sin bloquear el event loop
+async def _async_cache_get(
+    cache_key: str, stats: Dict[str, int], codec: CacheCodec = default_codec
+) -> Optional[Tuple[Dict[str, Any], int]]:
+    try:
+        cached_result = await get_async_redis().get(cache_key)
+    except redis.RedisError as e:
+        stats["redis_errors"] += 1
+        logger.error(f"Redis error: {str(e)}")
+        return None
+    if not cached_result:
+        stats["redis_misses"] += 1
+        return None
+    try:
+        result = _decode(cached_result, codec)
+    except Exception as e:
+        stats["redis_errors"] += 1
+        logger.error(f"Error deserializando caché: {str(e)}")
+        return None
+    stats["redis_hits"] += 1
+    return result, len(cached_result)
+
+
+# Serializa y guarda una entrada de caché sin bloquear el event loop
+async def _async_cache_set(
+    cache_key: str,
+    value: Any,
+    ttl: int,
+    stats: Dict[str, int],
+    codec: CacheCodec = default_codec,
+) -> Optional[int]:
+    try:
+        payload = codec.encode(value)
+        await get_async_redis().setex(cache_key, ttl, payload)
+        return len(payload)
+    except redis.RedisError as e:
+        stats["redis_errors"] += 1
+        logger.error(f"Redis error: {str(e)}")
+    except (TypeError, ValueError) as e:
+        logger.error(f"Error serializando caché: {str(e)}")
+    return None
+
+
+# Ejecuta `compute` una sola vez por clave, en el proceso y entre workers
+async def _coalesce(
+    cache_key: str,
+    compute: Callable[[], Any],
+    check: Callable[[], Awaitable[Optional[Any]]],
+    stats: Dict[str, int],
+) -> Any:
+    # Con el lock adquirido, otro worker puede haber terminado justo antes
+    async def compute_if_missing() -> Any:
+        cached = await check()
+        return cached if cached is not None else await compute()
+
+    # run_once se ejecuta en un contexto vacío (ver SingleFlight.do): se le pasa lo que
+    # necesita del contexto de quien la lanza
+    background = _in_background_refresh.get()
+    remaining = remaining_time()
+    wait_timeout = (
+        SINGLE_FLIGHT_WAIT_TIMEOUT
+        if remaining is None
+        else min(SINGLE_FLIGHT_WAIT_TIMEOUT, max(remaining, 0))
+    )
+
+    async def run_once() -> Any:
+        _in_background_refresh.set(background)
+        if not SINGLE_FLIGHT_DISTRIBUTED:
+            return await compute()
+        return await distributed_do(
+            get_async_redis(),
+            cache_key,
+            compute_if_missing,
+            check,
+            lock_ttl=SINGLE_FLIGHT_LOCK_TTL,
+            wait_timeout=wait_timeout,
+            poll_interval=SINGLE_FLIGHT_POLL_INTERVAL,
+        )
+
+    if cache_key in _flights:
+        stats["coalesced"] += 1
+    return await _flights.do(cache_key, run_once)
+
+
+# Lanza un refresco en segundo plano (uno por clave en el proceso y entre workers)
+def _schedule_refresh(
+    cache_key: str, refresh: Callable[[], Awaitable[Any]], stats: Dict[str, int]
+) -> None:
+    if cache_key in _refreshing or cache_key in _flights:
+        return
+    _refreshing.add(cache_key)
+    stats["refreshes"] += 1
+
+    async def runner() -> None:
+        _in_background_refresh.set(True)
+        lock_key = f"refresh:{cache_key}"
+        token = None
+        try:
+            if SINGLE_FLIGHT_DISTRIBUTED:
+                try:
+                    token = await acquire_lock(
+                        get_async_redis(), lock_key, SINGLE_FLIGHT_LOCK_TTL
+                    )
+                    if token is None:
+                        return  # Otro worker ya lo está refrescando
+                except redis.RedisError as e:
+                    logger.error(f"Redis error: {str(e)}")
+            logger.info(f"Refrescando en segundo plano: {cache_key}")
+            # El refresco no pertenece a la petición que lo disparó ni a su presupuesto
+            with deadline_scope(None):
+                await refresh()
+        except Exception as e:
+            logger.error(f"Error refrescando {cache_key}: {str(e)}")
+        finally:
+            if token is not None:
+                await release_lock(get_async_redis(), lock_key, token)
+            _refreshing.discard(cache_key)
+
+    # Contexto vacío: tampoco usa la sesión de base de datos de la petición
+    task = asyncio.create_task(runner(), context=contextvars.Context())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
 # Función para generar una clave de caché única basada en los argumentos
 def generate_cache_key(prefix: str, *args, **kwargs) -> str:
     """
@@ -62,71 +434,222 @@ def generate_cache_key(prefix: str, *args, **kwargs) -> str:
     return f"{prefix}:{key_hash}"
 
 
+_HORIZONTAL_SPACE_RE = re.compile(r"[ \t\f\v]+")
+
+
+# Normaliza un texto para que variaciones triviales compartan entrada de caché
+def normalize_text(text: str) -> str:
+    """
+    Normaliza un texto para usarlo en claves de caché
+
+    Unifica la forma Unicode y los saltos de línea, colapsa espacios repetidos y
+    elimina los de los extremos. Conserva los saltos de línea (importan en el formato).
+
+    Args:
+        text: Texto original
+
+    Returns:
+        str: Texto normalizado
+    """
+    text = unicodedata.normalize("NFC", text).replace("\r\n", "\n")
+    text = _HORIZONTAL_SPACE_RE.sub(" ", text)
+    return "\n".join(line.strip() for line in text.strip().split("\n"))
+
+
 # Decorador para cachear respuestas de funciones
 def cache_response(
     ttl: int = REDIS_EXPIRE,
+    namespace: Optional[str] = None,
+    local_max_bytes: Optional[int] = None,
+    local_ttl: Optional[int] = None,
+    single_flight: bool = SINGLE_FLIGHT_ENABLED,
+    stale_ttl: int = CACHE_STALE_TTL,
+    early_refresh_beta: float = CACHE_XFETCH_BETA,
+    serializer: Optional[CacheCodec] = None,
+    key_builder: Optional[Callable[..., Dict[str, Any]]] = None,
+    on_hit: Optional[Callable[..., Awaitable[None]]] = None,
 ) -> Callable[[Callable[P, T]], Callable[P, T]]:
     """
     Decorador para cachear respuestas de funciones
 
     Args:
         ttl: Tiempo de vida en segundos para la entrada en caché
+        namespace: Prefijo de las claves (por defecto 'modulo.funcion')
+        local_max_bytes: Capacidad en bytes de la caché en memoria (None usa el valor global, 0 la desactiva)
+        local_ttl: Tiempo de vida en la caché en memoria (nunca mayor que ttl)
+        single_flight: Agrupa las llamadas concurrentes con la misma clave (sólo asíncronas)
+        stale_ttl: Segundos tras `ttl` durante los que se sirve la entrada caducada
+            mientras se refresca en segundo plano (sólo asíncronas, 0 lo desactiva)
+        early_refresh_beta: Factor XFetch de refresco anticipado (0 lo desactiva)
+        serializer: Códec de los valores en Redis (None usa el configurado en el entorno)
+        key_builder: Extrae de los argumentos sólo los campos que determinan el
+            resultado (texto normalizado, idioma, modelo...). Si es None se usan todos.
+        on_hit: Corrutina `(resultado, *args, **kwargs)` que se ejecuta cuando el
+            resultado viene de caché o de otra llamada agrupada (p. ej. guardar historial)
 
     Returns:
         Callable: Función decorada con capacidad de caché
     """
 
     def decorator(func: Callable[P, T]) -> Callable[P, T]:
+        # Todas las tareas se llaman 'run': el módulo evita que compartan claves
+        prefix = namespace or f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+        stats = _get_stats(prefix)
+        codec = serializer or default_codec
+        max_bytes = LOCAL_CACHE_MAX_BYTES if local_max_bytes is None else local_max_bytes
+        local: Optional[LocalCache] = None
+        if LOCAL_CACHE_ENABLED and max_bytes > 0:
+            local = LocalCache(
+                max_bytes=max_bytes,
+                ttl=min(ttl, local_ttl if local_ttl is not None else LOCAL_CACHE_TTL),
+            )
+            _local_caches[prefix] = local
+
+        # Clave por contenido (independiente del usuario) o por todos los argumentos
+        def build_key(*args: Any, **kwargs: Any) -> str:
+            if key_builder is not None and CACHE_KEY_MODE == "content":
+                return generate_cache_key(prefix, key_builder(*args, **kwargs))
+            return generate_cache_key(prefix, *args, **kwargs)
+
+        # Consulta el primer nivel (memoria del proceso)
+        def local_get(cache_key: str) -> Optional[Any]:
+            if local is None:
+                return None
+            value = local.get(cache_key)
+            if value is None:
+                stats["local_misses"] += 1
+                return None
+            stats["local_hits"] += 1
+            return value
+
         if asyncio.iscoroutinefunction(func):
+            # Guarda el resultado en ambos niveles junto con su coste de cálculo
+            async def store(cache_key: str, result: Any, delta: float) -> None:
+                entry = _make_entry(result, delta)
+                size = await _async_cache_set(
+                    cache_key, entry, ttl + stale_ttl, stats, codec
+                )
+                if local is not None and size is not None:
+                    local.set(cache_key, entry, size)
+
             @functools.wraps(func)
             async def async_wrapper(*args: P.args, **kwargs: P.kwargs) -> T:
-                cache_key = generate_cache_key(func.__name__, *args, **kwargs)
-                try:
-                    cached_result = redis_client.get(cache_key)
-                    if cached_result:
-                        logger.info(f"Cache hit for key: {cache_key}")
-                        # Aseguramos que siempre se deserializa a dict
-                        result = json.loads(cached_result)
-                        if not isinstance(result, dict):
-                            raise ValueError("El valor cacheado no es un dict")
-                        return cast(T, result)
-                    logger.info(f"Cache miss for key: {cache_key}")
+                cache_key = build_key(*args, **kwargs)
+                executed = False
+
+                # Los errores de la función se propagan; sólo los de Redis se ignoran
+                async def compute() -> T:
+                    nonlocal executed
+                    executed = True
+                    start = time.monotonic()
                     result = await func(*args, **kwargs)
-                    redis_client.setex(
-                        cache_key,
-                        ttl,
-                        json.dumps(result, default=str),
-                    )
+                    await store(cache_key, result, time.monotonic() - start)
                     return result
-                except redis.RedisError as e:
-                    logger.error(f"Redis error: {str(e)}")
-                    return await func(*args, **kwargs)
-                except Exception as e:
-                    logger.error(f"Error deserializando caché: {str(e)}")
-                    return await func(*args, **kwargs)
+
+                # Recalcula sin marcar la llamada como ejecutada (va en segundo plano)
+                async def refresh() -> None:
+                    start = time.monotonic()
+                    result = await func(*args, **kwargs)
+                    await store(cache_key, result, time.monotonic() - start)
+
+                async def check() -> Optional[Any]:
+                    cached = await _async_cache_get(cache_key, stats, codec)
+                    if cached is None:
+                        return None
+                    entry = cached[0]
+                    if _freshness(entry, ttl, stale_ttl, 0) == "expired":
+                        return None
+                    return entry["v"]
+
+                entry = local_get(cache_key)
+                if entry is not None:
+                    logger.debug(f"Local cache hit for key: {cache_key}")
+                else:
+                    cached = await _async_cache_get(cache_key, stats, codec)
+                    if cached is not None:
+                        logger.info(f"Cache hit for key: {cache_key}")
+                        entry, size = cached
+                        if local is not None:
+                            local.set(cache_key, entry, size)
+
+                if entry is not None:
+                    state = _freshness(entry, ttl, stale_ttl, early_refresh_beta)
+                    if state == "expired":
+                        entry = None
+                    elif state == "refresh":
+                        if time.time() - entry["t"] >= ttl:
+                            stats["stale_served"] += 1
+                        _schedule_refresh(cache_key, refresh, stats)
+
+                if entry is not None:
+                    result = entry["v"]
+                else:
+                    logger.info(f"Cache miss for key: {cache_key}")
+                    if single_flight:
+                        result = await _coalesce(cache_key, compute, check, stats)
+                    else:
+                        result = await compute()
+
+                # Efectos por usuario cuando el resultado no lo calculó esta llamada
+                if not executed and on_hit is not None:
+                    try:
+                        await on_hit(result, *args, **kwargs)
+                    except Exception as e:
+                        logger.error(f"Error en on_hit para {cache_key}: {str(e)}")
+                return cast(T, result)
+
+            # Acceso directo a la caché de la función, p. ej. para respuestas en streaming
+            # que no pasan por el wrapper: sólo devuelve entradas vigentes
+            async def cache_get(*args: Any, **kwargs: Any) -> Optional[Any]:
+                cache_key = build_key(*args, **kwargs)
+                entry = local_get(cache_key)
+                if entry is None:
+                    cached = await _async_cache_get(cache_key, stats, codec)
+                    if cached is None:
+                        return None
+                    entry, size = cached
+                    if local is not None:
+                        local.set(cache_key, entry, size)
+                if time.time() - entry["t"] >= ttl:
+                    return None
+                return entry["v"]
+
+            async def cache_set(result: Any, *args: Any, **kwargs: Any) -> None:
+                await store(build_key(*args, **kwargs), result, 0.0)
+
+            async_wrapper.cache_get = cache_get  # type: ignore[attr-defined]
+            async_wrapper.cache_set = cache_set  # type: ignore[attr-defined]
             return async_wrapper  # type: ignore
         else:
             @functools.wraps(func)
             def wrapper(*args: P.args, **kwargs: P.kwargs) -> T:
-                cache_key = generate_cache_key(func.__name__, *args, **kwargs)
+                cache_key = build_key(*args, **kwargs)
+                # Sin refresco en segundo plano: las entradas caducadas son fallos
+                local_entry = local_get(cache_key)
+                if local_entry is not None and time.time() - local_entry["t"] < ttl:
+                    return cast(T, local_entry["v"])
                 try:
                     cached_result = redis_client.get(cache_key)
                     if cached_result:
-                        logger.info(f"Cache hit for key: {cache_key}")
-                        # Aseguramos que siempre se deserializa a dict
-                        result = json.loads(cached_result)
-                        if not isinstance(result, dict):
-                            raise ValueError("El valor cacheado no es un dict")
-                        return cast(T, result)
+                        entry = _decode(cached_result, codec)
+                        if time.time() - entry["t"] < ttl:
+                            logger.info(f"Cache hit for key: {cache_key}")
+                            stats["redis_hits"] += 1
+                            if local is not None:
+                                local.set(cache_key, entry, len(cached_result))
+                            return cast(T, entry["v"])
                     logger.info(f"Cache miss for key: {cache_key}")
+                    stats["redis_misses"] += 1
+                    start = time.monotonic()
                     result = func(*args, **kwargs)
-                    redis_client.setex(
-                        cache_key,
-                        ttl,
-                        json.dumps(result, default=str),
-                    )
+                    entry = _make_entry(result, time.monotonic() - start)
+                    payload = codec.encode(entry)
+                    redis_client.setex(cache_key, ttl, payload)
+                    if local is not None:
+                        local.set(cache_key, entry, len(payload))
                     return result
                 except redis.RedisError as e:
+                    stats["redis_errors"] += 1
                     logger.error(f"Redis error: {str(e)}")
                     return func(*args, **kwargs)
                 except Exception as e:
@@ -144,6 +667,11 @@ def clear_cache(prefix: Optional[str] = None) -> None:
     Args:
         prefix: Prefijo de las claves a eliminar. Si es None, elimina todas.
     """
+    # Primer nivel: cachés en memoria de este proceso
+    for namespace, local in _local_caches.items():
+        if prefix is None or namespace == prefix:
+            local.clear()
+
     try:
         if prefix:
             # Eliminar claves con el prefijo especificado
@@ -163,7 +691,7 @@ def clear_cache(prefix: Optional[str] = None) -> None:
         logger.error(f"Error clearing cache: {str(e)}")
 
 
-def get_cache_health() -> Dict[str, Any]:
+async def get_cache_health() -> Dict[str, Any]:
     """
     Comprueba el estado de la conexión Redis
 
@@ -172,8 +700,12 @@ def get_cache_health() -> Dict[str, Any]:
     """
     try:
         # Prueba simple de Redis
-        redis_client.ping()
-        return {"status": "healthy", "details": "Redis connection OK"}
+        await get_async_redis().ping()
+        return {
+            "status": "healthy",
+            "details": "Redis connection OK",
+            "stats": get_cache_stats(),
+        }
     except redis.RedisError as e:
         logger.error(f"Redis health check failed: {str(e)}")
         return {"status": "unhealthy", "details": str(e)}
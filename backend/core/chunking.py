@@ -0,0 +1,69 @@
+"""
+Este módulo proporciona la división de textos largos en fragmentos por número de tokens.
+
+Los cortes se hacen, por orden de preferencia, entre párrafos, entre frases y, si una
+frase sola no cabe, entre palabras. Así un cambio en un párrafo sólo altera el
+fragmento que lo contiene y los demás se pueden reutilizar desde la caché.
+
+"""
+import math
+import re
+from typing import Iterator, List, Tuple
+from core.tokens import count_tokens
+
+# Separadores de párrafo y de frase
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+")
+
+
+# Divide un texto sin puntos de corte naturales en partes de palabras completas
+def _split_words(text: str, max_tokens: int) -> List[str]:
+    words = text.split()
+    parts = math.ceil(count_tokens(text) / max_tokens)
+    if parts <= 1 or len(words) <= 1:
+        return [text]
+    size = math.ceil(len(words) / parts)
+    return [" ".join(words[i : i + size]) for i in range(0, len(words), size)]
+
+
+# Unidades mínimas (texto, tokens, separador previo) que caben en un fragmento
+def _units(text: str, max_tokens: int) -> Iterator[Tuple[str, int, str]]:
+    for paragraph in _PARAGRAPH_BREAK.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        tokens = count_tokens(paragraph)
+        if tokens <= max_tokens:
+            yield paragraph, tokens, "\n\n"
+            continue
+
+        separator = "\n\n"
+        for sentence in _SENTENCE_END.split(paragraph):
+            for piece in _split_words(sentence, max_tokens):
+                yield piece, count_tokens(piece), separator
+                separator = " "
+
+
+def split_text(text: str, max_tokens: int) -> List[str]:
+    """
+    Divide un texto en fragmentos de como máximo `max_tokens` tokens
+
+    Args:
+        text: Texto a dividir
+        max_tokens: Tokens máximos por fragmento
+
+    Returns:
+        List[str]: Fragmentos en el orden original
+    """
+    chunks: List[str] = []
+    current = ""
+    current_tokens = 0
+    for unit, tokens, separator in _units(text, max_tokens):
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(current)
+            current, current_tokens = "", 0
+        current = f"{current}{separator}{unit}" if current else unit
+        current_tokens += tokens
+    if current:
+        chunks.append(current)
+    return chunks
@@ -19,6 +19,7 @@ ERROR_CODES = {
     "OPENAI_TIMEOUT": "E302",
     "OPENAI_RATE_LIMIT": "E303",
     "OPENAI_CONTENT_FILTER": "E304",
+    "OPENAI_CIRCUIT_OPEN": "E305",
     # Errores internos (9xx)
     "INTERNAL_SERVER_ERROR": "E901",
     "UNKNOWN_ERROR": "E999",
@@ -135,6 +136,18 @@ class OpenAIRateLimitError(OpenAIError):
         )
 
 
+class CircuitOpenError(OpenAIError):
+    """Circuito abierto: OpenAI no está respondiendo y se falla inmediatamente"""
+
+    def __init__(self, circuit: str, retry_after: float = 0):
+        super().__init__(
+            "OPENAI_CIRCUIT_OPEN",
+            "Servicio de OpenAI no disponible temporalmente",
+            {"circuit": circuit, "retry_after": retry_after},
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        )
+
+
 # Errores internos
 class InternalServerError(APIError):
     """Error interno del servidor"""
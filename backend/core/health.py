@@ -6,9 +6,11 @@ Incluye verificaciones de conexión a la base de datos y caché.
 """
 from typing import Dict, Any
 from sqlalchemy.sql import text
-from services.db import get_db_session
+from services.db import get_db_session, get_write_behind_stats
 import logging
 from core.cache import get_cache_health
+from core.retry import get_circuit_breakers_state
+from services.intent_parser import get_intent_stats
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
@@ -32,7 +34,17 @@ async def check_database() -> Dict[str, Any]:
 async def check_services() -> Dict[str, Any]:
     """Verifica el estado de todos los servicios"""
     db_status = await check_database()
-    cache_status = get_cache_health()
+    db_status["write_behind"] = get_write_behind_stats()
+    cache_status = await get_cache_health()
+    circuits = get_circuit_breakers_state()
+    openai_status = {
+        "status": "healthy"
+        if all(c["state"] == "closed" for c in circuits.values())
+        else "degraded",
+        "circuits": circuits,
+        # Consultas de historial resueltas sin llamar al modelo
+        "intent_parser": get_intent_stats(),
+    }
 
     return {
         "status": "healthy"
@@ -40,7 +52,7 @@ async def check_services() -> Dict[str, Any]:
         else "unhealthy",
         "timestamp": datetime.now(datetime.UTC).isoformat(),
         "version": "1.0.0",
-        "services": {"database": db_status, "cache": cache_status},
+        "services": {"database": db_status, "cache": cache_status, "openai": openai_status},
     }
 
 
@@ -0,0 +1,189 @@
+"""
+Este módulo proporciona la detección local del idioma de un texto.
+
+Usa perfiles de trigramas de caracteres (log-probabilidades con suavizado de Laplace)
+calculados una sola vez al importar el módulo a partir de textos de muestra de cada
+idioma. Para puntuar un texto se cuentan sus trigramas una sola vez y se busca el vector
+de pesos (uno por idioma) de cada trigrama distinto; el coste crece con los trigramas
+distintos del texto y el análisis se limita a los primeros MAX_CHARS caracteres.
+
+"""
+import math
+import re
+from collections import Counter
+from typing import Dict, Tuple
+
+# Caracteres analizados como máximo: a partir de ahí el idioma ya no cambia
+MAX_CHARS = 2000
+
+# Trigramas mínimos para dar una respuesta (textos más cortos usan el idioma por defecto)
+MIN_TRIGRAMS = 3
+
+# Textos de muestra con los que se construyen los perfiles de cada idioma
+_SAMPLES: Dict[str, str] = {
+    "es": (
+        "El equipo de finanzas ha revisado el presupuesto del trimestre y propone reducir los "
+        "gastos de viaje, pero quiere mantener la inversion en formacion para todos los "
+        "empleados. Necesitamos que nos envies el informe antes del viernes porque el cliente "
+        "lo pidio ayer por la tarde y todavia no tenemos los datos de ventas. Hola, buenos "
+        "dias, queria saber si es posible cambiar la fecha de la reunion de la semana que viene. "
+        "La empresa tiene que contratar a mas personas para el departamento de atencion al "
+        "cliente, ya que las quejas por los retrasos en los pedidos han aumentado mucho. Por "
+        "favor, revisa el contrato y dime si estas de acuerdo con las condiciones que nos han "
+        "propuesto. Cuando llegues a la oficina, llama a la directora para que te explique el "
+        "nuevo proyecto. Los usuarios no pueden acceder al sistema desde esta manana y el "
+        "servidor sigue sin responder. Gracias por tu ayuda, un saludo y hasta pronto. Este "
+        "documento resume las decisiones que se tomaron en la junta y las tareas pendientes "
+        "de cada area. Tambien hay que actualizar la pagina web con los precios nuevos."
+    ),
+    "en": (
+        "The finance team has reviewed the quarterly budget and proposes to reduce travel "
+        "expenses, but they want to keep the investment in training for all employees. We need "
+        "you to send us the report before Friday because the client asked for it yesterday "
+        "afternoon and we still do not have the sales figures. Hello, good morning, I would like "
+        "to know if it is possible to change the date of next week's meeting. The company has "
+        "to hire more people for the customer service department, since complaints about late "
+        "orders have increased a lot. Please review the contract and tell me whether you agree "
+        "with the conditions they have offered. When you get to the office, call the director "
+        "so she can explain the new project to you. Users have not been able to access the "
+        "system since this morning and the server is still not responding. Thanks for your "
+        "help, best regards and see you soon. This document summarizes the decisions that were "
+        "made at the board meeting and the pending tasks of each area. We also have to update "
+        "the website with the new prices."
+    ),
+    "pt": (
+        "A equipe de financas revisou o orcamento do trimestre e propoe reduzir as despesas de "
+        "viagem, mas quer manter o investimento em formacao para todos os funcionarios. "
+        "Precisamos que voce nos envie o relatorio antes de sexta-feira porque o cliente pediu "
+        "ontem a tarde e ainda nao temos os dados de vendas. Ola, bom dia, gostaria de saber se "
+        "e possivel mudar a data da reuniao da semana que vem. A empresa tem que contratar mais "
+        "pessoas para o departamento de atendimento ao cliente, ja que as reclamacoes pelos "
+        "atrasos nos pedidos aumentaram muito. Por favor, revise o contrato e diga se esta de "
+        "acordo com as condicoes que nos propuseram. Quando chegar ao escritorio, ligue para a "
+        "diretora para que ela explique o novo projeto. Os usuarios nao conseguem acessar o "
+        "sistema desde esta manha e o servidor continua sem responder. Obrigado pela ajuda, um "
+        "abraco e ate logo. Este documento resume as decisoes que foram tomadas na reuniao e as "
+        "tarefas pendentes de cada area. Tambem e preciso atualizar o site com os novos precos."
+    ),
+    "fr": (
+        "L'equipe des finances a examine le budget du trimestre et propose de reduire les frais "
+        "de deplacement, mais elle veut maintenir l'investissement dans la formation pour tous "
+        "les employes. Nous avons besoin que tu nous envoies le rapport avant vendredi parce que "
+        "le client l'a demande hier apres-midi et nous n'avons toujours pas les chiffres des "
+        "ventes. Bonjour, je voudrais savoir s'il est possible de changer la date de la reunion "
+        "de la semaine prochaine. L'entreprise doit embaucher plus de personnes pour le service "
+        "client, car les plaintes pour les retards des commandes ont beaucoup augmente. S'il te "
+        "plait, relis le contrat et dis-moi si tu es d'accord avec les conditions qu'ils nous "
+        "ont proposees. Quand tu arrives au bureau, appelle la directrice pour qu'elle "
+        "t'explique le nouveau projet. Les utilisateurs ne peuvent pas acceder au systeme depuis "
+        "ce matin et le serveur ne repond toujours pas. Merci pour ton aide, cordialement et a "
+        "bientot. Ce document resume les decisions qui ont ete prises lors de la reunion et les "
+        "taches en attente de chaque service. Il faut aussi mettre a jour le site avec les "
+        "nouveaux prix."
+    ),
+    "it": (
+        "Il gruppo delle finanze ha esaminato il bilancio del trimestre e propone di ridurre le "
+        "spese di viaggio, ma vuole mantenere l'investimento nella formazione per tutti i "
+        "dipendenti. Abbiamo bisogno che tu ci mandi la relazione prima di venerdi perche il "
+        "cliente l'ha chiesta ieri pomeriggio e non abbiamo ancora i dati delle vendite. Ciao, "
+        "buongiorno, vorrei sapere se e possibile cambiare la data della riunione della "
+        "settimana prossima. L'azienda deve assumere piu persone per il servizio clienti, "
+        "poiche i reclami per i ritardi negli ordini sono aumentati molto. Per favore, controlla "
+        "il contratto e dimmi se sei d'accordo con le condizioni che ci hanno proposto. Quando "
+        "arrivi in ufficio, chiama la direttrice perche ti spieghi il nuovo progetto. Gli utenti "
+        "non riescono ad accedere al sistema da questa mattina e il server continua a non "
+        "rispondere. Grazie per il tuo aiuto, cordiali saluti e a presto. Questo documento "
+        "riassume le decisioni che sono state prese nella riunione e i compiti in sospeso di "
+        "ogni area. Bisogna anche aggiornare il sito con i nuovi prezzi. Ho ricevuto il tuo "
+        "messaggio e ti rispondo appena posso, ma c'e un errore nella fattura dello scorso mese."
+    ),
+    "de": (
+        "Das Finanzteam hat das Budget des Quartals gepruft und schlagt vor, die Reisekosten zu "
+        "senken, aber es mochte die Investitionen in die Weiterbildung fur alle Mitarbeiter "
+        "beibehalten. Wir brauchen den Bericht vor Freitag, weil der Kunde ihn gestern "
+        "Nachmittag angefordert hat und wir die Verkaufszahlen immer noch nicht haben. Hallo, "
+        "guten Morgen, ich mochte wissen, ob es moglich ist, das Datum der Besprechung in der "
+        "nachsten Woche zu andern. Das Unternehmen muss mehr Leute fur den Kundendienst "
+        "einstellen, da die Beschwerden uber verspatete Bestellungen stark zugenommen haben. "
+        "Bitte lies den Vertrag und sag mir, ob du mit den Bedingungen einverstanden bist, die "
+        "sie uns angeboten haben. Wenn du im Buro ankommst, ruf die Direktorin an, damit sie dir "
+        "das neue Projekt erklart. Die Benutzer konnen seit heute Morgen nicht auf das System "
+        "zugreifen und der Server antwortet immer noch nicht. Danke fur deine Hilfe, viele "
+        "Gruße und bis bald. Dieses Dokument fasst die Entscheidungen zusammen, die in der "
+        "Sitzung getroffen wurden, und die offenen Aufgaben jedes Bereichs. Wir mussen auch die "
+        "Webseite mit den neuen Preisen aktualisieren."
+    ),
+}
+
+# Idiomas soportados, en el orden de los vectores de pesos
+LANGUAGES: Tuple[str, ...] = tuple(_SAMPLES)
+
+# Se quitan los acentos para que un texto escrito sin ellos puntúe igual
+_ACCENTS = str.maketrans("áàâãäéèêëíìîïóòôõöúùûüçß", "aaaaaeeeeiiiiooooouuuucs")
+_NON_LETTERS = re.compile(r"[^a-zñ]+")
+
+
+# Normaliza el texto: minúsculas, sin acentos y sólo letras separadas por un espacio
+def _normalize(text: str) -> str:
+    text = text[:MAX_CHARS].lower().translate(_ACCENTS)
+    return f" {_NON_LETTERS.sub(' ', text).strip()} "
+
+
+# Cuenta los trigramas de caracteres del texto normalizado
+def _trigrams(text: str) -> Counter:
+    return Counter([text[i : i + 3] for i in range(len(text) - 2)])
+
+
+# Construye los pesos: trigrama -> vector log(cuenta + 1) por idioma, y el vector de
+# log-probabilidades de un trigrama no visto (-log(total + vocabulario)), que es el
+# término común que se suma al final
+def _build_profiles() -> Tuple[Dict[str, Tuple[float, ...]], Tuple[float, ...]]:
+    counts = [_trigrams(_normalize(_SAMPLES[lang])) for lang in LANGUAGES]
+    vocabulary = set().union(*counts)
+    unseen = tuple(-math.log(sum(c.values()) + len(vocabulary)) for c in counts)
+    weights = {trigram: tuple(math.log(c[trigram] + 1) for c in counts) for trigram in vocabulary}
+    return weights, unseen
+
+
+_WEIGHTS, _UNSEEN = _build_profiles()
+
+
+def language_scores(text: str) -> Dict[str, float]:
+    """
+    Calcula la log-verosimilitud media por trigrama del texto en cada idioma
+
+    Args:
+        text: Texto a analizar
+
+    Returns:
+        Dict[str, float]: Puntuación por idioma (mayor es más probable); vacío si el
+            texto no tiene suficientes letras
+    """
+    counts = _trigrams(_normalize(text))
+    total = sum(counts.values())
+    if total < MIN_TRIGRAMS:
+        return {}
+
+    # Un vector de pesos por trigrama conocido; cada idioma suma su columna
+    rows = [(_WEIGHTS[trigram], count) for trigram, count in counts.items() if trigram in _WEIGHTS]
+    scores = [sum(weights[i] * count for weights, count in rows) for i in range(len(LANGUAGES))]
+    return {
+        lang: (score / total) + unseen for lang, score, unseen in zip(LANGUAGES, scores, _UNSEEN)
+    }
+
+
+def detect_language(text: str, default: str = "en") -> str:
+    """
+    Detecta el idioma del texto
+
+    Args:
+        text: Texto a analizar
+        default: Idioma devuelto si el texto es demasiado corto para decidir
+
+    Returns:
+        str: Código ISO 639-1 del idioma más probable (ver LANGUAGES)
+    """
+    scores = language_scores(text)
+    if not scores:
+        return default
+    return max(scores, key=scores.get)
@@ -0,0 +1,193 @@
+"""
+Este módulo proporciona un limitador de tráfico hacia OpenAI por token bucket.
+
+Controla las peticiones por minuto (RPM) y los tokens por minuto (TPM) antes de cada
+llamada, en lugar de esperar a que OpenAI responda 429. Los buckets viven en Redis
+(un script Lua los actualiza de forma atómica) para compartirse entre workers; si
+Redis no está disponible se usa un bucket local por proceso.
+
+"""
+import asyncio
+import os
+import time
+from typing import Dict, Optional, Tuple
+import redis
+from core.cache import get_async_redis
+from core.errors import OpenAIRateLimitError
+from core.logging import setup_logger
+
+logger = setup_logger("core.rate_limit")
+
+# Configuración desde variables de entorno
+OPENAI_RATE_LIMIT_ENABLED = (
+    os.getenv("OPENAI_RATE_LIMIT_ENABLED", "true").lower() == "true"
+)
+OPENAI_RPM_LIMIT = int(os.getenv("OPENAI_RPM_LIMIT", "500"))
+OPENAI_TPM_LIMIT = int(os.getenv("OPENAI_TPM_LIMIT", "200000"))
+OPENAI_RATE_LIMIT_MAX_WAIT = float(os.getenv("OPENAI_RATE_LIMIT_MAX_WAIT", "30.0"))
+
+# Consume de dos buckets (peticiones y tokens) sólo si ambos tienen saldo.
+# Devuelve 0 si se concede o los milisegundos a esperar si no.
+_ACQUIRE_SCRIPT = """
+local now = redis.call("TIME")
+local now_ms = now[1] * 1000 + math.floor(now[2] / 1000)
+local wait_ms = 0
+local levels = {}
+for i = 1, 2 do
+    local capacity = tonumber(ARGV[(i - 1) * 3 + 1])
+    local rate = tonumber(ARGV[(i - 1) * 3 + 2])
+    local amount = math.min(tonumber(ARGV[(i - 1) * 3 + 3]), capacity)
+    local state = redis.call("HMGET", KEYS[i], "level", "ts")
+    local level = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now_ms
+    level = math.min(capacity, level + (now_ms - ts) * rate)
+    levels[i] = level
+    if level < amount then
+        wait_ms = math.max(wait_ms, math.ceil((amount - level) / rate))
+    end
+end
+for i = 1, 2 do
+    local capacity = tonumber(ARGV[(i - 1) * 3 + 1])
+    local amount = math.min(tonumber(ARGV[(i - 1) * 3 + 3]), capacity)
+    local level = levels[i]
+    if wait_ms == 0 then
+        level = level - amount
+    end
+    redis.call("HSET", KEYS[i], "level", level, "ts", now_ms)
+    redis.call("PEXPIRE", KEYS[i], 120000)
+end
+return wait_ms
+"""
+
+
+class TokenBucket:
+    """
+    Token bucket local (por proceso).
+
+    Args:
+        capacity: Saldo máximo (ráfaga permitida)
+        per_minute: Reposición por minuto
+    """
+
+    def __init__(self, capacity: float, per_minute: float):
+        self.capacity = capacity
+        self.rate = per_minute / 60.0  # Unidades por segundo
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Segundos hasta que haya saldo para `amount` (0 si ya lo hay)"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def consume(self, amount: float) -> None:
+        self.level -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    """
+    Limitador de peticiones y tokens por minuto compartido entre workers.
+
+    Args:
+        name: Nombre del limitador (prefijo de las claves en Redis)
+        rpm: Peticiones por minuto permitidas
+        tpm: Tokens por minuto permitidos
+        max_wait: Espera máxima en segundos antes de rechazar la petición
+    """
+
+    def __init__(self, name: str, rpm: int, tpm: int, max_wait: float):
+        self.name = name
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_wait = max_wait
+        self._local_requests = TokenBucket(rpm, rpm)
+        self._local_tokens = TokenBucket(tpm, tpm)
+        self._keys = (f"ratelimit:{name}:rpm", f"ratelimit:{name}:tpm")
+        self.stats: Dict[str, float] = {"acquired": 0, "throttled": 0, "rejected": 0, "waited_seconds": 0.0}
+
+    async def _redis_wait_time(self, tokens: int) -> float:
+        wait_ms = await get_async_redis().eval(
+            _ACQUIRE_SCRIPT,
+            2,
+            *self._keys,
+            self.rpm, self.rpm / 60000.0, 1,
+            self.tpm, self.tpm / 60000.0, tokens,
+        )
+        return int(wait_ms) / 1000.0
+
+    def _local_wait_time(self, tokens: int) -> float:
+        wait = max(
+            self._local_requests.wait_time(1), self._local_tokens.wait_time(tokens)
+        )
+        if wait == 0:
+            self._local_requests.consume(1)
+            self._local_tokens.consume(tokens)
+        return wait
+
+    async def _wait_time(self, tokens: int) -> Tuple[float, bool]:
+        try:
+            return await self._redis_wait_time(tokens), True
+        except redis.RedisError as e:
+            logger.warning(f"Limitador sin Redis, se usa el bucket local: {str(e)}")
+            return self._local_wait_time(tokens), False
+
+    async def acquire(self, tokens: int, max_wait: Optional[float] = None) -> None:
+        """
+        Espera hasta que haya capacidad para una petición de `tokens` tokens
+
+        Args:
+            tokens: Tokens estimados de la petición
+            max_wait: Espera máxima (None usa la del limitador)
+
+        Raises:
+            OpenAIRateLimitError: Si la espera necesaria supera `max_wait`
+        """
+        max_wait = self.max_wait if max_wait is None else max_wait
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + max_wait
+        throttled = False
+        while True:
+            wait, _ = await self._wait_time(tokens)
+            if wait <= 0:
+                self.stats["acquired"] += 1
+                return
+            if loop.time() + wait > deadline:
+                self.stats["rejected"] += 1
+                raise OpenAIRateLimitError(
+                    details={
+                        "limiter": self.name,
+                        "estimated_tokens": tokens,
+                        "retry_after": round(wait, 2),
+                    }
+                )
+            if not throttled:
+                throttled = True
+                self.stats["throttled"] += 1
+            logger.info(f"Limitador {self.name}: esperando {wait:.2f}s ({tokens} tokens)")
+            self.stats["waited_seconds"] += wait
+            await asyncio.sleep(wait)
+
+
+# Limitador compartido para todas las llamadas a OpenAI
+openai_rate_limiter = RateLimiter(
+    "openai", OPENAI_RPM_LIMIT, OPENAI_TPM_LIMIT, OPENAI_RATE_LIMIT_MAX_WAIT
+)
+
+
+async def acquire_openai_capacity(tokens: int) -> None:
+    """
+    Reserva capacidad en el limitador de OpenAI antes de una llamada
+
+    Args:
+        tokens: Tokens estimados de la petición (prompt + max_tokens)
+    """
+    if OPENAI_RATE_LIMIT_ENABLED:
+        await openai_rate_limiter.acquire(tokens)
@@ -1,14 +1,24 @@
 """
 Este módulo proporciona un decorador para reintentar funciones asíncronas en caso de excepciones específicas.
 
-Utiliza un enfoque de backoff exponencial con jitter para controlar el tiempo de espera entre reintentos.
+Utiliza backoff exponencial con jitter aleatorio (full, decorrelated o proporcional) y políticas
+por tipo de excepción, respeta las indicaciones del servidor (Retry-After, x-ratelimit-reset-*)
+y el presupuesto de tiempo total de la petición. Incluye además un circuit breaker por dependencia.
 
 """
 import asyncio
+import email.utils
 import functools
+import math
 import os
+import random
+import re
 import time
-from typing import TypeVar, Callable, Awaitable, Optional, Any, Dict, List, Union, Type
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import TypeVar, Callable, Awaitable, Optional, Any, Dict, Iterator, List, Tuple, Union, Type
+from core.errors import CircuitOpenError
 from core.logging import setup_logger
 
 logger = setup_logger("core.retry")
@@ -21,6 +31,20 @@ MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
 RETRY_DELAY_BASE = float(os.getenv("OPENAI_RETRY_DELAY_BASE", "1.0"))
 RETRY_DELAY_MAX = float(os.getenv("OPENAI_RETRY_DELAY_MAX", "10.0"))
 RETRY_JITTER = float(os.getenv("OPENAI_RETRY_JITTER", "0.1"))
+RETRY_JITTER_MODE = os.getenv("OPENAI_RETRY_JITTER_MODE", "full").lower()
+RETRY_HINT_MAX = float(os.getenv("OPENAI_RETRY_HINT_MAX", "60.0"))
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "60.0"))
+REQUEST_DEADLINE_MIN_SECONDS = float(os.getenv("REQUEST_DEADLINE_MIN_SECONDS", "1.0"))
+
+# Configuración del circuit breaker
+CIRCUIT_BREAKER_ENABLED = os.getenv("CIRCUIT_BREAKER_ENABLED", "true").lower() == "true"
+CIRCUIT_WINDOW_SECONDS = float(os.getenv("CIRCUIT_WINDOW_SECONDS", "60"))
+CIRCUIT_MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", "10"))
+CIRCUIT_FAILURE_RATE = float(os.getenv("CIRCUIT_FAILURE_RATE", "0.5"))
+CIRCUIT_SLOW_CALL_SECONDS = float(os.getenv("CIRCUIT_SLOW_CALL_SECONDS", "10.0"))
+CIRCUIT_SLOW_CALL_RATE = float(os.getenv("CIRCUIT_SLOW_CALL_RATE", "0.8"))
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", "30.0"))
+CIRCUIT_HALF_OPEN_MAX_CALLS = int(os.getenv("CIRCUIT_HALF_OPEN_MAX_CALLS", "1"))
 
 # Lista de excepciones que son retryables
 RETRYABLE_EXCEPTIONS: List[Type[Exception]] = [
@@ -45,9 +69,160 @@ try:
     )
     logger.info("OpenAI exceptions loaded for retry handling")
 except ImportError:
+    RateLimitError = APIConnectionError = APITimeoutError = None
     logger.warning("OpenAI exceptions not found, retry will use basic exceptions only")
 
 
+# Presupuesto de tiempo de la petición en curso (instante límite en time.monotonic)
+_deadline: ContextVar[Optional[float]] = ContextVar("retry_deadline", default=None)
+
+
+@contextmanager
+def deadline_scope(seconds: Optional[float]) -> Iterator[None]:
+    """
+    Fija el presupuesto de tiempo total para las llamadas hechas dentro del bloque
+
+    Un bloque anidado nunca amplía el presupuesto del exterior; con None se elimina
+    (p. ej. en tareas en segundo plano que no pertenecen a ninguna petición).
+
+    Args:
+        seconds: Segundos disponibles desde ahora, o None para no tener límite
+    """
+    if seconds is None:
+        token = _deadline.set(None)
+    else:
+        deadline = time.monotonic() + seconds
+        current = _deadline.get()
+        token = _deadline.set(deadline if current is None else min(deadline, current))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def parse_request_timeout(value: str) -> Optional[float]:
+    """
+    Interpreta el presupuesto de tiempo pedido por el cliente (cabecera X-Request-Timeout)
+
+    Args:
+        value: Segundos en texto
+
+    Returns:
+        Optional[float]: Segundos (como mínimo REQUEST_DEADLINE_MIN_SECONDS), o None si
+            el valor no es un número finito mayor que cero
+    """
+    try:
+        seconds = float(value)
+    except ValueError:
+        return None
+    if not math.isfinite(seconds) or seconds <= 0:
+        return None
+    return max(seconds, REQUEST_DEADLINE_MIN_SECONDS)
+
+
+def remaining_time() -> Optional[float]:
+    """Segundos que quedan del presupuesto de la petición (None si no hay límite)"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+async def wait_within_deadline(aw: Awaitable[T]) -> T:
+    """
+    Espera `aw` sin pasarse del presupuesto de tiempo de la petición en curso
+
+    Para esperar trabajo compartido con otras peticiones (lotes, ejecuciones agrupadas)
+    que se ejecuta fuera del presupuesto de cada una: al agotarse se cancela sólo la
+    espera de este llamante.
+
+    Args:
+        aw: Futuro o tarea a esperar
+
+    Returns:
+        T: Resultado de `aw`
+
+    Raises:
+        asyncio.TimeoutError: Si se agota el presupuesto de la petición
+    """
+    remaining = remaining_time()
+    if remaining is None:
+        return await aw
+    return await asyncio.wait_for(aw, max(remaining, 0))
+
+
+class RetryPolicy:
+    """
+    Política de reintentos para un tipo de excepción.
+
+    Args:
+        max_retries: Número máximo de reintentos
+        base_delay: Retraso base del backoff exponencial (segundos)
+        max_delay: Retraso máximo entre reintentos (segundos)
+        jitter: 'full', 'decorrelated', 'proportional' o 'none'
+        honor_retry_after: Si se respetan las indicaciones de espera del servidor
+    """
+
+    def __init__(
+        self,
+        max_retries: int = MAX_RETRIES,
+        base_delay: float = RETRY_DELAY_BASE,
+        max_delay: float = RETRY_DELAY_MAX,
+        jitter: str = RETRY_JITTER_MODE,
+        honor_retry_after: bool = True,
+    ):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.honor_retry_after = honor_retry_after
+
+    def backoff(self, retry_count: int, previous_delay: float = 0.0) -> float:
+        """
+        Calcula el tiempo de espera antes del reintento
+
+        Args:
+            retry_count: Número de reintento (empieza en 1)
+            previous_delay: Espera del reintento anterior (para 'decorrelated')
+
+        Returns:
+            float: Tiempo de espera en segundos
+        """
+        delay = min(self.max_delay, self.base_delay * (2 ** (retry_count - 1)))
+        if self.jitter == "full":
+            # Espera uniforme entre 0 y el backoff exponencial
+            return random.uniform(0, delay)
+        if self.jitter == "decorrelated":
+            # Cada espera depende de la anterior: aleatoria entre la base y 3 veces la previa
+            upper = max(self.base_delay, previous_delay * 3)
+            return min(self.max_delay, random.uniform(self.base_delay, upper))
+        if self.jitter == "proportional":
+            return max(0.0, delay * (1 + random.uniform(-RETRY_JITTER, RETRY_JITTER)))
+        return delay
+
+
+# Política por defecto y políticas por tipo de excepción (la primera que coincida)
+DEFAULT_POLICY = RetryPolicy()
+RETRY_POLICIES: List[Tuple[Type[Exception], RetryPolicy]] = [
+    # Un timeout ya ha consumido OPENAI_TIMEOUT segundos: pocos reintentos
+    (TimeoutError, RetryPolicy(max_retries=min(MAX_RETRIES, 2))),
+    # Fallos de conexión: suelen ser breves, se reintenta pronto
+    (ConnectionError, RetryPolicy(base_delay=RETRY_DELAY_BASE / 2, jitter="decorrelated")),
+]
+if RateLimitError is not None:
+    RETRY_POLICIES[:0] = [
+        # Cuota agotada: más reintentos y esperas más largas (o las que indique el servidor)
+        (RateLimitError, RetryPolicy(
+            max_retries=MAX_RETRIES + 2,
+            base_delay=RETRY_DELAY_BASE * 2,
+            max_delay=RETRY_DELAY_MAX * 3,
+        )),
+        # APITimeoutError hereda de APIConnectionError: debe ir antes
+        (APITimeoutError, RetryPolicy(max_retries=min(MAX_RETRIES, 2))),
+        (APIConnectionError, RetryPolicy(base_delay=RETRY_DELAY_BASE / 2, jitter="decorrelated")),
+    ]
+
+
 # Calcula el tiempo de espera con backoff exponencial y jitter
 def exponential_backoff(retry_count: int) -> float:
     """
@@ -59,9 +234,89 @@ def exponential_backoff(retry_count: int) -> float:
     Returns:
         float: Tiempo de espera en segundos
     """
-    delay = min(RETRY_DELAY_MAX, RETRY_DELAY_BASE * (2 ** (retry_count - 1)))
-    jitter = delay * RETRY_JITTER * (2 * (0.5 - (time.time() % 1)))  # Jitter aleatorio
-    return max(0, delay + jitter)  # Aseguramos que no sea negativo
+    return DEFAULT_POLICY.backoff(retry_count)
+
+
+def get_policy(
+    exception: Exception,
+    policies: Optional[List[Tuple[Type[Exception], RetryPolicy]]] = None,
+) -> RetryPolicy:
+    """
+    Devuelve la política de reintentos aplicable a una excepción
+
+    Args:
+        exception: La excepción producida
+        policies: Políticas por tipo (None usa RETRY_POLICIES)
+
+    Returns:
+        RetryPolicy: La primera política cuyo tipo coincide, o la política por defecto
+    """
+    for exception_class, policy in RETRY_POLICIES if policies is None else policies:
+        if isinstance(exception, exception_class):
+            return policy
+    return DEFAULT_POLICY
+
+
+# Duraciones de las cabeceras x-ratelimit-reset-* ("20ms", "1s", "6m0s", "1h2m3.5s")
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def _parse_duration(value: str) -> Optional[float]:
+    parts = _DURATION_PART.findall(value.strip())
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def get_retry_after(exception: Exception) -> Optional[float]:
+    """
+    Extrae de la respuesta del servidor cuánto hay que esperar antes de reintentar
+
+    Consulta, por orden, `retry-after-ms`, `retry-after` (segundos o fecha HTTP) y
+    `x-ratelimit-reset-requests`/`x-ratelimit-reset-tokens` de los límites agotados.
+
+    Args:
+        exception: Excepción con la respuesta HTTP (p. ej. openai.RateLimitError)
+
+    Returns:
+        Optional[float]: Segundos a esperar, o None si el servidor no lo indica
+    """
+    response = getattr(exception, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return max(0.0, float(retry_after_ms) / 1000)
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            try:
+                retry_at = email.utils.parsedate_to_datetime(retry_after)
+                return max(0.0, retry_at.timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+
+    # Límites de OpenAI: esperar a que se reponga el que se ha agotado
+    resets = []
+    for kind in ("requests", "tokens"):
+        reset = headers.get(f"x-ratelimit-reset-{kind}")
+        if reset and headers.get(f"x-ratelimit-remaining-{kind}") == "0":
+            seconds = _parse_duration(reset)
+            if seconds is not None:
+                resets.append(seconds)
+    return max(resets) if resets else None
 
 
 def is_retryable_exception(exception: Exception) -> bool:
@@ -74,6 +329,10 @@ def is_retryable_exception(exception: Exception) -> bool:
     Returns:
         bool: True si se debe reintentar, False en caso contrario
     """
+    # Con el circuito abierto no tiene sentido reintentar
+    if isinstance(exception, CircuitOpenError):
+        return False
+
     for exception_class in RETRYABLE_EXCEPTIONS:
         if isinstance(exception, exception_class):
             return True
@@ -101,19 +360,23 @@ def async_retry(
     max_retries: Optional[int] = None,
     retryable_exceptions: Optional[List[Type[Exception]]] = None,
     on_retry: Optional[Callable[[int, Exception], Awaitable[None]]] = None,
+    policies: Optional[List[Tuple[Type[Exception], RetryPolicy]]] = None,
 ):
     """
     Decorador para reintentar funciones asíncronas en caso de excepciones específicas
 
+    Cada intento se limita al presupuesto de tiempo restante (ver `deadline_scope`) y no
+    se reintenta si la espera no cabe en él.
+
     Args:
-        max_retries: Número máximo de reintentos (None usa el valor por defecto)
+        max_retries: Número máximo de reintentos (None usa el de la política de cada excepción)
         retryable_exceptions: Lista de excepciones que provocan reintentos (None usa la lista por defecto)
         on_retry: Callback ejecutado antes de cada reintento
+        policies: Políticas por tipo de excepción (None usa RETRY_POLICIES)
 
     Returns:
         Callable: Decorador configurado
     """
-    _max_retries = max_retries if max_retries is not None else MAX_RETRIES
     _retryable_exceptions = (
         retryable_exceptions if retryable_exceptions is not None else None
     )
@@ -121,15 +384,21 @@ def async_retry(
     def decorator(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
         @functools.wraps(func)
         async def wrapper(*args: Any, **kwargs: Any) -> T:
-            last_exception = None
+            retry_count = 0
+            previous_delay = 0.0
 
-            for retry_count in range(
-                1, _max_retries + 2
-            ):  # +2 porque el primer intento no es reintento
+            while True:
+                remaining = remaining_time()
+                if remaining is not None and remaining <= 0:
+                    raise asyncio.TimeoutError("Presupuesto de tiempo de la petición agotado")
                 try:
-                    return await func(*args, **kwargs)
+                    if remaining is None:
+                        return await func(*args, **kwargs)
+                    return await asyncio.wait_for(func(*args, **kwargs), remaining)
                 except Exception as e:
-                    last_exception = e
+                    retry_count += 1
+                    policy = get_policy(e, policies)
+                    _max_retries = max_retries if max_retries is not None else policy.max_retries
 
                     # Decidir si reintentamos
                     should_retry = False
@@ -149,13 +418,34 @@ def async_retry(
                         )
                         raise
 
-                    # Calculamos el tiempo de espera
-                    delay = exponential_backoff(retry_count)
+                    # Calculamos el tiempo de espera: primero lo que indique el servidor
+                    hint = get_retry_after(e) if policy.honor_retry_after else None
+                    if hint is not None:
+                        if hint > RETRY_HINT_MAX:
+                            logger.warning(
+                                f"El servidor pide esperar {hint:.2f}s (máximo {RETRY_HINT_MAX}s), no se reintenta"
+                            )
+                            raise
+                        # Pequeña dispersión para que los clientes no vuelvan a la vez
+                        delay = hint * (1 + random.uniform(0, RETRY_JITTER))
+                    else:
+                        delay = policy.backoff(retry_count, previous_delay)
+                    previous_delay = delay
+
+                    # Sin presupuesto para esperar y volver a intentarlo
+                    remaining = remaining_time()
+                    if remaining is not None and delay >= remaining:
+                        logger.warning(
+                            f"Sin tiempo para reintentar ({remaining:.2f}s restantes, espera {delay:.2f}s): "
+                            f"{type(e).__name__}: {str(e)}"
+                        )
+                        raise
 
                     # Log del reintento
                     logger.warning(
                         f"Reintento {retry_count}/{_max_retries} después de error: "
                         f"{type(e).__name__}: {str(e)}. Esperando {delay:.2f}s"
+                        f"{' (indicado por el servidor)' if hint is not None else ''}"
                     )
 
                     # Ejecutar callback si existe
@@ -165,11 +455,6 @@ def async_retry(
                     # Esperar antes de reintentar
                     await asyncio.sleep(delay)
 
-            # Este punto nunca debería alcanzarse, pero por si acaso
-            if last_exception:
-                raise last_exception
-            raise RuntimeError("Error desconocido en sistema de reintentos")
-
         return wrapper
 
     return decorator
@@ -187,3 +472,205 @@ def with_retry(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]
         Callable: Función decorada con reintentos
     """
     return async_retry()(func)
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker para una dependencia externa (p. ej. un modelo de OpenAI).
+
+    - closed: las llamadas pasan; se abre si en la ventana hay al menos `min_calls`
+      llamadas y la tasa de errores o de llamadas lentas supera su umbral.
+    - open: las llamadas fallan inmediatamente con CircuitOpenError durante `open_seconds`.
+    - half_open: se dejan pasar `half_open_max_calls` llamadas de prueba; si todas
+      terminan bien se cierra, y si alguna falla se vuelve a abrir.
+
+    Sólo cuentan como errores los transitorios (timeouts, conexión, 429, 5xx); los
+    errores de la petición (p. ej. 400) no indican que la dependencia esté caída.
+
+    Args:
+        name: Nombre del circuito (dependencia, modelo y endpoint)
+        window_seconds: Ventana deslizante de llamadas consideradas
+        min_calls: Llamadas mínimas en la ventana para evaluar las tasas
+        failure_rate: Tasa de errores a partir de la cual se abre
+        slow_call_seconds: Duración a partir de la cual una llamada es lenta
+        slow_call_rate: Tasa de llamadas lentas a partir de la cual se abre
+        open_seconds: Tiempo que permanece abierto antes de pasar a half_open
+        half_open_max_calls: Llamadas de prueba permitidas en half_open
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        window_seconds: float = CIRCUIT_WINDOW_SECONDS,
+        min_calls: int = CIRCUIT_MIN_CALLS,
+        failure_rate: float = CIRCUIT_FAILURE_RATE,
+        slow_call_seconds: float = CIRCUIT_SLOW_CALL_SECONDS,
+        slow_call_rate: float = CIRCUIT_SLOW_CALL_RATE,
+        open_seconds: float = CIRCUIT_OPEN_SECONDS,
+        half_open_max_calls: int = CIRCUIT_HALF_OPEN_MAX_CALLS,
+    ):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.rejected = 0
+        self._calls: deque = deque()  # (timestamp, fallida, lenta)
+        self._half_open_in_flight = 0
+        self._half_open_successes = 0
+
+    def _prune(self, now: float) -> None:
+        while self._calls and now - self._calls[0][0] > self.window_seconds:
+            self._calls.popleft()
+
+    def _open(self, now: float, reason: str) -> None:
+        self.state = self.OPEN
+        self.opened_at = now
+        self._calls.clear()
+        logger.warning(f"Circuito {self.name} abierto: {reason}")
+
+    def _close(self) -> None:
+        self.state = self.CLOSED
+        self._calls.clear()
+        logger.info(f"Circuito {self.name} cerrado")
+
+    def _before_call(self) -> bool:
+        """Admite o rechaza la llamada; devuelve True si es una llamada de prueba"""
+        now = time.monotonic()
+        if self.state == self.OPEN:
+            if now - self.opened_at < self.open_seconds:
+                self.rejected += 1
+                raise CircuitOpenError(
+                    self.name,
+                    retry_after=round(self.open_seconds - (now - self.opened_at), 2),
+                )
+            self.state = self.HALF_OPEN
+            self._half_open_in_flight = 0
+            self._half_open_successes = 0
+            logger.info(f"Circuito {self.name} en half_open: probando la dependencia")
+
+        if self.state == self.HALF_OPEN:
+            if self._half_open_in_flight >= self.half_open_max_calls:
+                self.rejected += 1
+                raise CircuitOpenError(self.name, retry_after=0)
+            self._half_open_in_flight += 1
+            return True
+        return False
+
+    def _record(self, probe: bool, failed: bool, duration: float) -> None:
+        now = time.monotonic()
+        slow = duration >= self.slow_call_seconds
+
+        if probe:
+            self._half_open_in_flight -= 1
+            if self.state != self.HALF_OPEN:
+                return
+            if failed or slow:
+                self._open(now, f"falló la llamada de prueba ({duration:.2f}s)")
+                return
+            self._half_open_successes += 1
+            if self._half_open_successes >= self.half_open_max_calls:
+                self._close()
+            return
+
+        if self.state != self.CLOSED:
+            return
+        self._calls.append((now, failed, slow))
+        self._prune(now)
+        total = len(self._calls)
+        if total < self.min_calls:
+            return
+        failures = sum(1 for _, f, _ in self._calls if f)
+        slow_calls = sum(1 for _, _, sl in self._calls if sl)
+        if failures / total >= self.failure_rate:
+            self._open(now, f"{failures}/{total} errores en {self.window_seconds:.0f}s")
+        elif slow_calls / total >= self.slow_call_rate:
+            self._open(now, f"{slow_calls}/{total} llamadas lentas en {self.window_seconds:.0f}s")
+
+    async def call(self, func: Callable[..., Awaitable[T]], *args: Any, **kwargs: Any) -> T:
+        """
+        Ejecuta la llamada a través del circuito
+
+        Args:
+            func: Función asíncrona a ejecutar
+            *args, **kwargs: Argumentos de la función
+
+        Returns:
+            El resultado de la función
+
+        Raises:
+            CircuitOpenError: Si el circuito está abierto
+        """
+        if not CIRCUIT_BREAKER_ENABLED:
+            return await func(*args, **kwargs)
+
+        probe = self._before_call()
+        start = time.monotonic()
+        try:
+            result = await func(*args, **kwargs)
+        except asyncio.CancelledError:
+            # Una cancelación no dice nada de la dependencia: sólo liberamos la prueba
+            if probe:
+                self._half_open_in_flight -= 1
+            raise
+        except Exception as e:
+            self._record(probe, is_retryable_exception(e), time.monotonic() - start)
+            raise
+        self._record(probe, False, time.monotonic() - start)
+        return result
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Estado actual del circuito para el health check"""
+        now = time.monotonic()
+        self._prune(now)
+        total = len(self._calls)
+        failures = sum(1 for _, f, _ in self._calls if f)
+        slow_calls = sum(1 for _, _, sl in self._calls if sl)
+        state = self.state
+        if state == self.OPEN and now - self.opened_at >= self.open_seconds:
+            state = self.HALF_OPEN  # Pasará a half_open con la próxima llamada
+        return {
+            "state": state,
+            "calls": total,
+            "failure_rate": round(failures / total, 3) if total else 0.0,
+            "slow_call_rate": round(slow_calls / total, 3) if total else 0.0,
+            "rejected": self.rejected,
+            "open_remaining": round(max(0.0, self.open_seconds - (now - self.opened_at)), 2)
+            if self.state == self.OPEN
+            else 0.0,
+        }
+
+
+# Registro de circuitos por nombre (uno por dependencia/modelo/endpoint)
+_circuit_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_circuit_breaker(name: str) -> CircuitBreaker:
+    """
+    Devuelve el circuit breaker con ese nombre, creándolo si no existe
+
+    Args:
+        name: Nombre del circuito, p. ej. 'openai:gpt-4o-mini:chat.completions'
+
+    Returns:
+        CircuitBreaker: Circuito compartido por todas las llamadas con ese nombre
+    """
+    breaker = _circuit_breakers.get(name)
+    if breaker is None:
+        breaker = _circuit_breakers[name] = CircuitBreaker(name)
+    return breaker
+
+
+def get_circuit_breakers_state() -> Dict[str, Dict[str, Any]]:
+    """Estado de todos los circuitos registrados"""
+    return {name: breaker.snapshot() for name, breaker in _circuit_breakers.items()}
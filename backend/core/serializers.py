@@ -0,0 +1,163 @@
+"""
+Este módulo proporciona la codificación binaria de los valores guardados en caché.
+
+Cada valor se serializa (JSON, orjson o msgpack) y, por encima de un umbral de tamaño,
+se comprime (zlib o zstd). Una cabecera con versión, formato y compresión permite leer
+cualquier combinación y cambiar la configuración sin invalidar la caché existente.
+Los valores antiguos en JSON plano, sin cabecera, también se leen.
+
+"""
+import json
+import os
+import zlib
+from typing import Any, Callable, Dict, Tuple
+from core.logging import setup_logger
+
+logger = setup_logger("core.serializers")
+
+# Configuración desde variables de entorno
+CACHE_SERIALIZER = os.getenv("CACHE_SERIALIZER", "orjson").lower()
+CACHE_COMPRESSION = os.getenv("CACHE_COMPRESSION", "zlib").lower()
+CACHE_COMPRESSION_THRESHOLD = int(os.getenv("CACHE_COMPRESSION_THRESHOLD", "1024"))
+CACHE_COMPRESSION_LEVEL = int(os.getenv("CACHE_COMPRESSION_LEVEL", "3"))
+
+# Cabecera: MAGIC (2 bytes) + versión + formato + compresión
+HEADER_MAGIC = b"\x00\xca"
+HEADER_VERSION = 1
+HEADER_SIZE = len(HEADER_MAGIC) + 3
+
+# Identificadores de formato y compresión (no cambiar: se guardan en la cabecera)
+FORMAT_IDS = {"json": 1, "orjson": 2, "msgpack": 3}
+COMPRESSION_IDS = {"none": 0, "zlib": 1, "zstd": 2}
+
+# Librerías opcionales
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Funciones de serialización por formato: (dumps, loads)
+def _json_dumps(value: Any) -> bytes:
+    return json.dumps(value, default=str, ensure_ascii=False).encode("utf-8")
+
+
+def _orjson_dumps(value: Any) -> bytes:
+    return orjson.dumps(value, default=str)
+
+
+def _msgpack_dumps(value: Any) -> bytes:
+    return msgpack.packb(value, default=str, use_bin_type=True)
+
+
+def _msgpack_loads(data: bytes) -> Any:
+    return msgpack.unpackb(data, raw=False)
+
+
+def _available_formats() -> Dict[str, Tuple[Callable[[Any], bytes], Callable[[bytes], Any]]]:
+    formats = {"json": (_json_dumps, json.loads)}
+    if orjson is not None:
+        # orjson lee lo que escribe json (y viceversa): comparten formato de texto
+        formats["orjson"] = (_orjson_dumps, orjson.loads)
+    if msgpack is not None:
+        formats["msgpack"] = (_msgpack_dumps, _msgpack_loads)
+    return formats
+
+
+_FORMATS = _available_formats()
+
+
+class CacheCodec:
+    """
+    Codifica y decodifica valores de caché a bytes con cabecera versionada.
+
+    Args:
+        fmt: Formato de serialización ('json', 'orjson' o 'msgpack')
+        compression: Compresión ('none', 'zlib' o 'zstd')
+        threshold: Tamaño mínimo en bytes a partir del cual se comprime
+        level: Nivel de compresión
+    """
+
+    def __init__(
+        self,
+        fmt: str = CACHE_SERIALIZER,
+        compression: str = CACHE_COMPRESSION,
+        threshold: int = CACHE_COMPRESSION_THRESHOLD,
+        level: int = CACHE_COMPRESSION_LEVEL,
+    ):
+        if fmt not in _FORMATS:
+            logger.warning(f"Serializador '{fmt}' no disponible, se usa json")
+            fmt = "json"
+        if compression == "zstd" and zstandard is None:
+            logger.warning("zstandard no instalado, se usa compresión zlib")
+            compression = "zlib"
+        if compression not in COMPRESSION_IDS:
+            logger.warning(f"Compresión '{compression}' desconocida, se usa zlib")
+            compression = "zlib"
+
+        self.fmt = fmt
+        self.compression = compression
+        self.threshold = threshold
+        self.level = level
+        self._dumps = _FORMATS[fmt][0]
+        self._zstd_compressor = (
+            zstandard.ZstdCompressor(level=level) if compression == "zstd" else None
+        )
+
+    def encode(self, value: Any) -> bytes:
+        """Serializa el valor y lo comprime si supera el umbral"""
+        payload = self._dumps(value)
+        compression = "none"
+        if self.compression != "none" and len(payload) >= self.threshold:
+            if self._zstd_compressor is not None:
+                payload = self._zstd_compressor.compress(payload)
+            else:
+                payload = zlib.compress(payload, self.level)
+            compression = self.compression
+        header = HEADER_MAGIC + bytes(
+            (HEADER_VERSION, FORMAT_IDS[self.fmt], COMPRESSION_IDS[compression])
+        )
+        return header + payload
+
+    def decode(self, data: bytes) -> Any:
+        """Decodifica un valor escrito por cualquier configuración del códec"""
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        # Valores sin cabecera: JSON plano del formato anterior
+        if not data.startswith(HEADER_MAGIC):
+            return json.loads(data)
+
+        version, fmt_id, compression_id = data[len(HEADER_MAGIC) : HEADER_SIZE]
+        if version != HEADER_VERSION:
+            raise ValueError(f"Versión de formato de caché desconocida: {version}")
+        payload = data[HEADER_SIZE:]
+
+        if compression_id == COMPRESSION_IDS["zlib"]:
+            payload = zlib.decompress(payload)
+        elif compression_id == COMPRESSION_IDS["zstd"]:
+            if zstandard is None:
+                raise ValueError("Valor comprimido con zstd pero zstandard no está instalado")
+            payload = zstandard.ZstdDecompressor().decompress(payload)
+        elif compression_id != COMPRESSION_IDS["none"]:
+            raise ValueError(f"Compresión de caché desconocida: {compression_id}")
+
+        for name, format_id in FORMAT_IDS.items():
+            if format_id == fmt_id:
+                if name not in _FORMATS:
+                    raise ValueError(f"Valor serializado con {name}, que no está instalado")
+                return _FORMATS[name][1](payload)
+        raise ValueError(f"Formato de caché desconocido: {fmt_id}")
+
+
+# Códec por defecto según la configuración del entorno
+default_codec = CacheCodec()
@@ -0,0 +1,167 @@
+"""
+Este módulo proporciona coalescencia de peticiones ("single-flight").
+
+Las llamadas concurrentes con la misma clave comparten una única ejecución: dentro del
+proceso mediante una tarea compartida y, entre workers, mediante un lock en Redis.
+La ejecución compartida no hereda el contexto de la petición que la lanzó (presupuesto
+de tiempo, sesión de base de datos); cada llamante espera dentro de su propio
+presupuesto.
+
+"""
+import asyncio
+import contextvars
+import uuid
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+import redis
+import redis.asyncio as aioredis
+from core.logging import setup_logger
+from core.retry import remaining_time, wait_within_deadline
+
+logger = setup_logger("core.singleflight")
+
+# T: Tipo del resultado compartido
+T = TypeVar("T")
+
+# Libera el lock sólo si sigue perteneciendo a quien lo adquirió
+_RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+class SingleFlight:
+    """
+    Agrupa llamadas concurrentes con la misma clave dentro del proceso.
+
+    La primera llamada lanza la ejecución como tarea compartida; las siguientes la
+    esperan. Si quien la lanzó se cancela o agota su presupuesto de tiempo, la tarea
+    sigue para el resto.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.coalesced = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        task = self._inflight.get(key)
+        if task is None:
+            # Contexto vacío: la tarea no debe usar el presupuesto ni la sesión del líder
+            task = asyncio.get_running_loop().create_task(fn(), context=contextvars.Context())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            self.coalesced += 1
+            logger.debug(f"Llamada agrupada con la ejecución en curso: {key}")
+        return await wait_within_deadline(asyncio.shield(task))
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Evita el aviso de excepción no recuperada si nadie quedaba esperando
+        if not task.cancelled():
+            task.exception()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._inflight
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+
+async def acquire_lock(
+    client: aioredis.Redis, lock_key: str, lock_ttl: float
+) -> Optional[str]:
+    """
+    Intenta adquirir un lock en Redis sin esperar
+
+    Args:
+        client: Cliente Redis asíncrono
+        lock_key: Clave del lock
+        lock_ttl: Tiempo máximo de vida del lock en segundos
+
+    Returns:
+        Token del lock si se adquirió, None si ya lo tiene otro
+
+    Raises:
+        redis.RedisError: Si Redis no está disponible
+    """
+    token = uuid.uuid4().hex
+    acquired = await client.set(lock_key, token, nx=True, px=int(lock_ttl * 1000))
+    return token if acquired else None
+
+
+async def release_lock(client: aioredis.Redis, lock_key: str, token: str) -> None:
+    """Libera un lock adquirido con `acquire_lock` (sólo si sigue siendo nuestro)"""
+    try:
+        await client.eval(_RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+    except redis.RedisError as e:
+        logger.error(f"Error liberando lock distribuido: {str(e)}")
+
+
+async def distributed_do(
+    client: aioredis.Redis,
+    key: str,
+    fn: Callable[[], Awaitable[T]],
+    check: Callable[[], Awaitable[Optional[T]]],
+    lock_ttl: float,
+    wait_timeout: float,
+    poll_interval: float,
+) -> T:
+    """
+    Coalescencia entre procesos usando un lock en Redis
+
+    Quien obtiene el lock ejecuta `fn` (que debe publicar su resultado, p. ej. en
+    caché); el resto consulta `check` periódicamente hasta ver el resultado, hasta que
+    el lock desaparece o hasta agotar `wait_timeout` (o el presupuesto de tiempo de la
+    petición, si es menor), y en ese caso ejecuta `fn`.
+
+    Args:
+        client: Cliente Redis asíncrono
+        key: Clave lógica de la operación
+        fn: Operación a ejecutar una sola vez
+        check: Busca el resultado publicado por otro worker (None si aún no existe)
+        lock_ttl: Tiempo máximo de vida del lock en segundos
+        wait_timeout: Tiempo máximo de espera por el resultado de otro worker
+        poll_interval: Intervalo entre comprobaciones
+
+    Returns:
+        Resultado de la operación
+    """
+    lock_key = f"lock:{key}"
+    try:
+        token = await acquire_lock(client, lock_key, lock_ttl)
+    except redis.RedisError as e:
+        # Sin Redis no hay coordinación posible: ejecutamos directamente
+        logger.error(f"Error adquiriendo lock distribuido: {str(e)}")
+        return await fn()
+
+    if token is not None:
+        try:
+            return await fn()
+        finally:
+            await release_lock(client, lock_key, token)
+
+    logger.debug(f"Esperando resultado de otro worker para: {key}")
+    remaining = remaining_time()
+    if remaining is not None:
+        wait_timeout = min(wait_timeout, max(remaining, 0))
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait_timeout
+    try:
+        while loop.time() < deadline:
+            await asyncio.sleep(poll_interval)
+            result = await check()
+            if result is not None:
+                return result
+            if not await client.exists(lock_key):
+                break
+        result = await check()
+        if result is not None:
+            return result
+    except redis.RedisError as e:
+        logger.error(f"Error esperando lock distribuido: {str(e)}")
+
+    # El otro worker falló o tardó demasiado: lo calculamos nosotros
+    return await fn()
@@ -0,0 +1,123 @@
+"""
+Este módulo proporciona la estimación del número de tokens de un texto.
+
+Usa tiktoken cuando la codificación está disponible y, si no (p. ej. sin acceso a red
+para descargarla), una aproximación por caracteres suficiente para limitar tráfico y
+trocear textos. La codificación se carga al arrancar (init_tokenizer) en un hilo, para
+no bloquear el event loop con la descarga, y se reintenta si falla.
+
+"""
+import asyncio
+import math
+import time
+from typing import Any, Dict, List, Optional
+from core.logging import setup_logger
+
+logger = setup_logger("core.tokens")
+
+# Codificación de tiktoken (o200k_base, la de gpt-4o, requiere tiktoken >= 0.7; la
+# versión fijada en requirements.txt sólo incluye cl100k_base, que da una estimación
+# muy próxima)
+ENCODING = "cl100k_base"
+
+# Aproximación: ~4 caracteres por token en textos latinos
+CHARS_PER_TOKEN = 4.0
+
+# Tokens extra por mensaje del chat (rol y separadores)
+TOKENS_PER_MESSAGE = 4
+
+# Segundos entre intentos de carga de la codificación si falla (p. ej. sin red)
+ENCODING_RETRY_SECONDS = 60.0
+
+_encoding: Optional[Any] = None
+_tiktoken_missing = False
+_loading = False
+_last_attempt: Optional[float] = None
+
+
+# Carga la codificación (puede descargar el fichero BPE: no llamar desde el event loop)
+def _load_encoding() -> Optional[Any]:
+    global _encoding, _tiktoken_missing, _loading, _last_attempt
+    _last_attempt = time.monotonic()
+    try:
+        import tiktoken
+
+        _encoding = tiktoken.get_encoding(ENCODING)
+        logger.info(f"Codificación de tokens cargada: {ENCODING}")
+    except ImportError:
+        _tiktoken_missing = True
+        logger.warning("tiktoken no instalado, se estiman los tokens por caracteres")
+    except Exception as e:
+        # Sólo queda marcada como cargada si tiene éxito: se reintentará
+        logger.warning(
+            f"Codificación {ENCODING} no disponible, se estiman los tokens por caracteres: {str(e)}"
+        )
+    finally:
+        _loading = False
+    return _encoding
+
+
+# Inicializa el tokenizador al arrancar la aplicación
+async def init_tokenizer() -> None:
+    """Carga la codificación de tiktoken en un hilo para no bloquear el event loop"""
+    global _loading
+    if _encoding is not None or _tiktoken_missing:
+        return
+    _loading = True
+    await asyncio.to_thread(_load_encoding)
+
+
+# Codificación cargada, o None mientras no esté disponible (se reintenta en segundo
+# plano cada ENCODING_RETRY_SECONDS)
+def _get_encoding() -> Optional[Any]:
+    global _loading
+    if _encoding is not None or _tiktoken_missing or _loading:
+        return _encoding
+    if _last_attempt is not None and time.monotonic() - _last_attempt < ENCODING_RETRY_SECONDS:
+        return None
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # Fuera del event loop (scripts, benchmarks) se puede cargar directamente
+        return _load_encoding()
+    _loading = True
+    loop.run_in_executor(None, _load_encoding)
+    return None
+
+
+def count_tokens(text: str) -> int:
+    """
+    Cuenta (o estima) los tokens de un texto
+
+    Args:
+        text: Texto a medir
+
+    Returns:
+        int: Número de tokens
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def estimate_request_tokens(messages: List[Dict[str, Any]], max_tokens: int = 0) -> int:
+    """
+    Estima los tokens que consume una petición de chat
+
+    OpenAI descuenta del límite por minuto el prompt más `max_tokens` de la respuesta.
+
+    Args:
+        messages: Mensajes de la petición
+        max_tokens: Máximo de tokens de la respuesta
+
+    Returns:
+        int: Tokens estimados de la petición
+    """
+    prompt_tokens = sum(
+        count_tokens(str(message.get("content") or "")) + TOKENS_PER_MESSAGE
+        for message in messages
+    )
+    return prompt_tokens + max_tokens
@@ -0,0 +1,159 @@
+"""
+Este módulo proporciona una cola de escritura diferida (write-behind).
+
+Los elementos se encolan sin esperar a la base de datos y una tarea en segundo plano
+los escribe por lotes cuando se alcanza `max_batch_size` elementos o pasan
+`flush_interval` segundos. Si la cola se llena, `put` espera a que haya hueco
+(contrapresión) y al cerrar se vacía la cola antes de terminar.
+
+"""
+import asyncio
+import contextvars
+from typing import Awaitable, Callable, Dict, Generic, List, Optional, TypeVar
+from core.logging import setup_logger
+
+logger = setup_logger("core.write_behind")
+
+# T: Tipo de los elementos encolados
+T = TypeVar("T")
+
+
+class WriteBehindQueue(Generic[T]):
+    """
+    Cola con escritura por lotes en segundo plano.
+
+    Args:
+        name: Nombre de la cola (para logs y estadísticas)
+        flush: Corrutina que escribe un lote de elementos
+        max_batch_size: Elementos máximos por lote
+        flush_interval: Espera máxima en segundos para completar un lote
+        max_queue_size: Elementos pendientes a partir de los cuales `put` espera
+        max_attempts: Intentos de escritura de un lote antes de descartarlo
+    """
+
+    def __init__(
+        self,
+        name: str,
+        flush: Callable[[List[T]], Awaitable[object]],
+        max_batch_size: int = 100,
+        flush_interval: float = 0.2,
+        max_queue_size: int = 10000,
+        max_attempts: int = 3,
+    ):
+        self.name = name
+        self.flush = flush
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+        self.max_attempts = max_attempts
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._closing = False
+        self.stats: Dict[str, int] = {
+            "queued": 0,
+            "written": 0,
+            "batches": 0,
+            "errors": 0,
+            "dropped": 0,
+            "waited": 0,
+        }
+
+    def _ensure_worker(self) -> asyncio.Queue:
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        if self._worker is None or self._worker.done():
+            # Contexto limpio: el worker no hereda la fecha límite ni la sesión de la
+            # petición que encoló el primer elemento
+            self._worker = asyncio.get_running_loop().create_task(
+                self._run(), context=contextvars.Context()
+            )
+        return self._queue
+
+    async def put(self, item: T) -> None:
+        """
+        Encola un elemento para escribirlo en segundo plano
+
+        Args:
+            item: Elemento a escribir
+
+        Raises:
+            RuntimeError: Si la cola se está cerrando
+        """
+        if self._closing:
+            raise RuntimeError(f"La cola {self.name} se está cerrando")
+        queue = self._ensure_worker()
+        if queue.full():
+            # Contrapresión: el llamante espera a que se escriba el lote en curso
+            self.stats["waited"] += 1
+            logger.warning(f"Cola {self.name} llena ({queue.qsize()} elementos), esperando hueco")
+        await queue.put(item)
+        self.stats["queued"] += 1
+
+    def pending(self) -> int:
+        """Elementos pendientes de escribir"""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def _next_batch(self, queue: asyncio.Queue) -> List[T]:
+        batch = [await queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval
+        while len(batch) < self.max_batch_size:
+            if not queue.empty():
+                batch.append(queue.get_nowait())
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _write(self, batch: List[T]) -> None:
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                await self.flush(batch)
+                self.stats["batches"] += 1
+                self.stats["written"] += len(batch)
+                return
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error(
+                    f"Error escribiendo lote de {len(batch)} en {self.name} "
+                    f"(intento {attempt}/{self.max_attempts}): {str(e)}"
+                )
+                if attempt < self.max_attempts:
+                    await asyncio.sleep(min(2 ** attempt * 0.1, 2.0))
+        self.stats["dropped"] += len(batch)
+        logger.error(f"Descartado lote de {len(batch)} elementos en {self.name}")
+
+    async def _run(self) -> None:
+        queue = self._queue
+        while True:
+            batch = await self._next_batch(queue)
+            try:
+                await self._write(batch)
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+    async def close(self, timeout: float = 10.0) -> None:
+        """
+        Deja de aceptar elementos y espera a que se escriban los pendientes
+
+        Args:
+            timeout: Espera máxima en segundos; lo que quede pendiente se descarta
+        """
+        self._closing = True
+        if self._queue is None or self._worker is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+            logger.info(f"Cola {self.name} vaciada ({self.stats['written']} elementos escritos)")
+        except asyncio.TimeoutError:
+            self.stats["dropped"] += self._queue.qsize()
+            logger.error(f"Cola {self.name} cerrada con {self._queue.qsize()} elementos sin escribir")
+        finally:
+            self._worker.cancel()
+            self._worker = None
@@ -13,6 +13,11 @@ from api.routes.router import api_router
 from core.logging import setup_logger
 from core.health import setup_health_routes
 from core.errors import APIError, handle_exception
+from core.cache import init_cache, close_cache
+from services.llm_client import init_llm_client, close_llm_client
+from core.tokens import init_tokenizer
+from services.db import close_write_behind
+from core.retry import REQUEST_DEADLINE_SECONDS, deadline_scope, parse_request_timeout
 
 # Configura el logger
 logger = setup_logger("main")
@@ -37,6 +42,29 @@ app.add_middleware(
     allow_headers=["*"],  # Para producción, limitar a encabezados específicos
 )
 
+
+# Presupuesto de tiempo por petición para las llamadas externas (reintentos incluidos)
+@app.middleware("http")
+async def request_deadline(request: Request, call_next):
+    """
+    Fija el presupuesto de tiempo de la petición
+
+    El cliente puede pedir uno menor con la cabecera X-Request-Timeout (segundos); los
+    valores no positivos o no finitos se ignoran y los muy pequeños se elevan a
+    REQUEST_DEADLINE_MIN_SECONDS.
+    """
+    timeout = REQUEST_DEADLINE_SECONDS if REQUEST_DEADLINE_SECONDS > 0 else None
+    header = request.headers.get("x-request-timeout")
+    if header:
+        requested = parse_request_timeout(header)
+        if requested is None:
+            logger.warning(f"Cabecera X-Request-Timeout inválida: {header}")
+        else:
+            timeout = requested if timeout is None else min(timeout, requested)
+    with deadline_scope(timeout):
+        return await call_next(request)
+
+
 # Incluir rutas API
 app.include_router(api_router, prefix="/api/v1")
 
@@ -130,6 +158,9 @@ async def startup_event():
     """
     logger.info("Iniciando aplicación...")
     # Inicializar aquí conexiones, pool, etc.
+    await init_cache()
+    await init_llm_client()
+    await init_tokenizer()
 
 
 @app.on_event("shutdown")
@@ -142,6 +173,10 @@ async def shutdown_event():
     """
     logger.info("Cerrando aplicación...")
     # Cerrar aquí conexiones, etc.
+    # Primero se escriben las consultas pendientes de la cola de escritura diferida
+    await close_write_behind()
+    await close_cache()
+    await close_llm_client()
 
 
 if __name__ == "__main__":
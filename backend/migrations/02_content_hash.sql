@@ -0,0 +1,45 @@
+-- Migración para detectar duplicados exactos en consultas_ia con un hash del contenido
+-- en lugar de un índice único sobre los textos completos (que ocupa tanto como los
+-- propios textos y falla con textos mayores que el límite de fila del btree)
+
+-- Debe ejecutarse fuera de una transacción (psql -f): cada lote del relleno hace su commit
+
+-- Añadir la columna con el hash (la aplicación la rellena al guardar cada consulta)
+ALTER TABLE consultas_ia ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64);
+
+-- Rellenar el hash de las filas existentes por lotes de ids, con un commit por lote
+-- para no bloquear la tabla ni generar una única transacción enorme.
+-- Mismo cálculo que services.db.content_hash
+DO $$
+DECLARE
+    desde BIGINT := 0;
+    maximo BIGINT;
+    lote CONSTANT INTEGER := 10000;
+BEGIN
+    SELECT COALESCE(MAX(id), 0) INTO maximo FROM consultas_ia;
+    WHILE desde < maximo LOOP
+        UPDATE consultas_ia
+        SET content_hash = encode(
+            sha256(convert_to(texto_original || chr(31) || COALESCE(resultado, ''), 'UTF8')),
+            'hex'
+        )
+        WHERE id > desde AND id <= desde + lote AND content_hash IS NULL;
+        COMMIT;
+        desde := desde + lote;
+    END LOOP;
+END $$;
+
+-- Eliminar los duplicados exactos que ya existan (se conserva el más antiguo)
+DELETE FROM consultas_ia a
+USING consultas_ia b
+WHERE a.chat_id = b.chat_id
+  AND a.tipo_tarea = b.tipo_tarea
+  AND a.content_hash = b.content_hash
+  AND a.id > b.id;
+
+-- Índice único compacto: chat, tarea y 64 caracteres de hash
+CREATE UNIQUE INDEX IF NOT EXISTS idx_consultas_ia_content_hash
+ON consultas_ia (chat_id, tipo_tarea, content_hash);
+
+-- El índice único anterior sobre los textos completos ya no es necesario
+DROP INDEX IF EXISTS idx_consultas_ia_unique;
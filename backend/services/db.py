@@ -5,20 +5,28 @@ Incluye funciones para inicializar la base de datos, obtener sesiones de base de
 
 """
 import os
+import asyncio
+import hashlib
 import logging
-from typing import AsyncGenerator, Any, Dict
-from datetime import datetime
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncGenerator, AsyncIterator, Any, Dict, List, Tuple
+from datetime import datetime, timedelta
 from typing import Optional
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
-from sqlalchemy import select, insert, create_engine, update, Index
+from sqlalchemy import select, insert, create_engine, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import sessionmaker
 import asyncpg
+import redis
 from services.models import (
     ConsultaIA,
     EstadoUsuario,
     Base,
 )
 from core.logging import setup_logger
+from core.write_behind import WriteBehindQueue
+from core.cache import get_async_redis
 from pathlib import Path
 
 # Configure logging
@@ -37,6 +45,21 @@ POSTGRES_MAX_OVERFLOW = int(os.getenv("POSTGRES_MAX_OVERFLOW", "10"))
 POSTGRES_POOL_TIMEOUT = float(os.getenv("POSTGRES_POOL_TIMEOUT", "30"))
 POSTGRES_POOL_RECYCLE = int(os.getenv("POSTGRES_POOL_RECYCLE", "1800"))
 
+# Escritura diferida del historial: las consultas se guardan por lotes en segundo plano
+DB_WRITE_BEHIND_ENABLED = os.getenv("DB_WRITE_BEHIND_ENABLED", "true").lower() == "true"
+# 7 columnas por fila (con content_hash): 1000 filas son 7000 parámetros, lejos del límite
+# de 32767 parámetros de asyncpg
+DB_WRITE_BATCH_SIZE = min(int(os.getenv("DB_WRITE_BATCH_SIZE", "200")), 1000)
+DB_WRITE_FLUSH_MS = float(os.getenv("DB_WRITE_FLUSH_MS", "200"))
+DB_WRITE_QUEUE_MAX = int(os.getenv("DB_WRITE_QUEUE_MAX", "10000"))
+DB_WRITE_DRAIN_TIMEOUT = float(os.getenv("DB_WRITE_DRAIN_TIMEOUT", "10"))
+
+# Estado de usuario en Redis: lecturas sin ir a Postgres y escritura en segundo plano
+ESTADO_REDIS_ENABLED = os.getenv("ESTADO_REDIS_ENABLED", "true").lower() == "true"
+ESTADO_TTL = int(os.getenv("ESTADO_TTL", "86400"))  # El modo caduca tras 24 horas sin cambios
+ESTADO_WRITE_THROUGH = os.getenv("ESTADO_WRITE_THROUGH", "true").lower() == "true"
+ESTADO_KEY_PREFIX = "estado_usuario"
+
 # URL de conexión a la base de datos
 SQLALCHEMY_DATABASE_URL = f"postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
 
@@ -63,25 +86,80 @@ AsyncSessionLocal = async_sessionmaker(
     class_=AsyncSession,
 )
 
+# Unidad de trabajo de la petición en curso: sesión compartida y modos de usuario ya leídos
+_sesion_peticion: ContextVar[Optional[Tuple[AsyncSession, asyncio.Lock]]] = ContextVar(
+    "sesion_peticion", default=None
+)
+_modos_peticion: ContextVar[Optional[Dict[int, Optional[str]]]] = ContextVar(
+    "modos_peticion", default=None
+)
+
+
+# Abre la unidad de trabajo de una petición
+@asynccontextmanager
+async def unidad_de_trabajo() -> AsyncIterator[AsyncSession]:
+    """
+    Comparte una sesión entre todas las funciones de este módulo dentro del bloque
+
+    Las funciones que se llamen dentro del bloque (también desde los servicios de
+    tareas) usan esta sesión en lugar de abrir una propia, y el modo de cada usuario se
+    lee como mucho una vez. Cada operación termina con su commit, que devuelve la
+    conexión al pool: no se retiene durante las llamadas a OpenAI. Las operaciones
+    concurrentes de la misma petición (procesar/lote) se ejecutan de una en una sobre la
+    sesión. Si ya hay una unidad de trabajo abierta se reutiliza.
+
+    Yields:
+        AsyncSession: Sesión compartida de la petición
+    """
+    actual = _sesion_peticion.get()
+    if actual is not None:
+        yield actual[0]
+        return
+    async with AsyncSessionLocal() as session:
+        token_sesion = _sesion_peticion.set((session, asyncio.Lock()))
+        token_modos = _modos_peticion.set({})
+        try:
+            yield session
+        finally:
+            _sesion_peticion.reset(token_sesion)
+            _modos_peticion.reset(token_modos)
+
+
+# Sesión para una operación: la de la unidad de trabajo o una propia con su transacción
+@asynccontextmanager
+async def _sesion() -> AsyncIterator[AsyncSession]:
+    actual = _sesion_peticion.get()
+    if actual is None:
+        async with AsyncSessionLocal() as session:
+            async with session.begin():
+                yield session
+        return
+    session, lock = actual
+    # Una AsyncSession no admite operaciones concurrentes
+    async with lock:
+        try:
+            yield session
+            await session.commit()
+        except BaseException:
+            await session.rollback()
+            raise
+
+
+# Anota el modo del usuario en la unidad de trabajo en curso (si la hay)
+def _recordar_modo(chat_id: int, modo: Optional[str]) -> None:
+    modos = _modos_peticion.get()
+    if modos is not None:
+        modos[chat_id] = modo
+
 
 # Inicialización asíncrona de tablas
 async def init_db():
     """Inicializa la base de datos de forma asíncrona"""
+    # Crea las tablas con sus índices, incluido el único por content_hash (las bases
+    # de datos existentes lo obtienen con migrations/02_content_hash.sql)
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
 
-        # Crear índice único para evitar duplicados exactos en consultas_ia
-        await conn.run_sync(
-            lambda schema: Index(
-                "idx_consultas_ia_unique",
-                ConsultaIA.chat_id,
-                ConsultaIA.tipo_tarea,
-                ConsultaIA.texto_original,
-                ConsultaIA.resultado,
-                unique=True,
-            ).create(schema)
-        )
-
     logger.info("Base de datos inicializada")
 
 
@@ -90,14 +168,13 @@ async def get_db() -> AsyncGenerator[AsyncSession, None]:
     """
     Proporciona una sesión de base de datos asíncrona
 
+    Es la sesión de la unidad de trabajo de la petición (ver unidad_de_trabajo).
+
     Yields:
         AsyncSession: Sesión asíncrona de SQLAlchemy
     """
-    session = AsyncSessionLocal()
-    try:
+    async with unidad_de_trabajo() as session:
         yield session
-    finally:
-        await session.close()
 
 
 # Para compatibilidad con health checks síncronos
@@ -114,6 +191,25 @@ def get_db_session():
     return SessionLocal()
 
 
+# Hash del contenido de una consulta para detectar duplicados exactos
+def content_hash(texto_original: str, resultado: Optional[str]) -> str:
+    """
+    Calcula el hash que identifica el contenido de una consulta
+
+    Coincide con el que calcula Postgres en migrations/02_content_hash.sql:
+    encode(sha256(convert_to(texto_original || chr(31) || coalesce(resultado, ''), 'UTF8')), 'hex')
+
+    Args:
+        texto_original: Texto original procesado
+        resultado: Resultado de la operación
+
+    Returns:
+        str: SHA-256 en hexadecimal (64 caracteres)
+    """
+    contenido = f"{texto_original}\x1f{resultado or ''}"
+    return hashlib.sha256(contenido.encode("utf-8")).hexdigest()
+
+
 # Función unificada para guardar consultas IA
 async def guardar_consulta(
     user_id: str,
@@ -121,17 +217,40 @@ async def guardar_consulta(
     texto_original: str,
     resultado: str,
     metadata: Optional[Dict[str, Any]] = None,
-) -> None:
+) -> Optional[int]:
     """
     Guarda una consulta en la tabla unificada de forma asíncrona
 
+    Con DB_WRITE_BEHIND_ENABLED la consulta se encola y se inserta junto con otras en
+    segundo plano: la llamada no espera al commit (sólo espera si la cola está llena).
+    Si ya existe una consulta igual (mismo chat, tarea y content_hash) no se inserta.
+
     Args:
         user_id: Identificador del usuario (puede ser string o int)
         tipo_tarea: Tipo de tarea ('resumir', 'clasificar', 'traducir', etc.)
         texto_original: Texto original procesado
         resultado: Resultado de la operación
         metadata: Metadatos adicionales (idioma, confianza, etc.)
+
+    Returns:
+        Optional[int]: ID de la consulta, o None si se ha encolado o ya existía
     """
+    hash_contenido = content_hash(texto_original, resultado)
+    if DB_WRITE_BEHIND_ENABLED:
+        await _consultas_queue.put(
+            {
+                "user_id": user_id,
+                "tipo_tarea": tipo_tarea,
+                "texto_original": texto_original,
+                "resultado": resultado,
+                "metadata": metadata,
+                "fecha": datetime.utcnow(),
+                "content_hash": hash_contenido,
+            }
+        )
+        logger.debug(f"Consulta encolada para usuario {user_id}, tipo: {tipo_tarea}")
+        return None
+
     try:
         # Convertir user_id a integer si es posible para compatibilidad con chat_id
         chat_id = int(user_id) if user_id.isdigit() else 0
@@ -140,27 +259,125 @@ async def guardar_consulta(
         metadata = metadata or {}
         idioma = metadata.get("idioma")
 
-        async with AsyncSessionLocal() as session:
-            async with session.begin():
-                # Crear la nueva consulta
-                nueva_consulta = ConsultaIA(
+        async with _sesion() as session:
+            # Crear la nueva consulta (ON CONFLICT DO NOTHING si ya existe)
+            result = await session.execute(
+                pg_insert(ConsultaIA)
+                .values(
                     chat_id=chat_id,
                     tipo_tarea=tipo_tarea,
                     texto_original=texto_original,
                     resultado=resultado,
                     idioma=idioma,
                     fecha=datetime.utcnow(),
+                    content_hash=hash_contenido,
                 )
-                session.add(nueva_consulta)
+                .on_conflict_do_nothing()
+                .returning(ConsultaIA.id)
+            )
+            consulta_id = result.scalar_one_or_none()
 
+        if consulta_id is None:
+            logger.info(f"Consulta duplicada para usuario {user_id}, tipo: {tipo_tarea}")
+        else:
             logger.info(f"Consulta guardada para usuario {user_id}, tipo: {tipo_tarea}")
-            return nueva_consulta.id
+        return consulta_id
 
     except Exception as e:
         logger.error(f"Error al guardar consulta: {str(e)}")
         raise
 
 
+# Guarda varias consultas IA en una sola sentencia
+async def guardar_consultas(registros: List[Dict[str, Any]]) -> int:
+    """
+    Guarda varias consultas en la tabla unificada con un único INSERT
+
+    Las filas que ya existen (mismo chat, tarea y content_hash) se ignoran.
+
+    Args:
+        registros: Diccionarios con user_id, tipo_tarea, texto_original, resultado,
+            metadata opcional (como los argumentos de guardar_consulta), fecha
+            opcional (por defecto la actual) y content_hash opcional (se calcula si
+            no viene)
+
+    Returns:
+        int: Número de consultas insertadas
+    """
+    if not registros:
+        return 0
+    try:
+        fecha = datetime.utcnow()
+        filas = [
+            {
+                "chat_id": int(r["user_id"]) if str(r["user_id"]).isdigit() else 0,
+                "tipo_tarea": r["tipo_tarea"],
+                "texto_original": r["texto_original"],
+                "resultado": r["resultado"],
+                "idioma": (r.get("metadata") or {}).get("idioma"),
+                "fecha": r.get("fecha") or fecha,
+                "content_hash": r.get("content_hash")
+                or content_hash(r["texto_original"], r["resultado"]),
+            }
+            for r in registros
+        ]
+
+        # Se llama desde la cola en segundo plano: siempre con su propia sesión
+        async with AsyncSessionLocal() as session:
+            async with session.begin():
+                result = await session.execute(
+                    pg_insert(ConsultaIA).values(filas).on_conflict_do_nothing()
+                )
+
+        logger.info(f"Guardadas {result.rowcount} de {len(filas)} consultas en lote")
+        return result.rowcount
+
+    except Exception as e:
+        logger.error(f"Error al guardar consultas en lote: {str(e)}")
+        raise
+
+
+# Cola de escritura diferida de consultas (un INSERT multi-fila por lote)
+_consultas_queue: WriteBehindQueue[Dict[str, Any]] = WriteBehindQueue(
+    "consultas_ia",
+    guardar_consultas,
+    max_batch_size=DB_WRITE_BATCH_SIZE,
+    flush_interval=DB_WRITE_FLUSH_MS / 1000,
+    max_queue_size=DB_WRITE_QUEUE_MAX,
+)
+
+
+# Escribe las consultas y estados pendientes de las colas al apagar la aplicación
+async def close_write_behind() -> None:
+    """Espera a que se escriban las consultas y estados encolados (hasta DB_WRITE_DRAIN_TIMEOUT)"""
+    await asyncio.gather(
+        _consultas_queue.close(timeout=DB_WRITE_DRAIN_TIMEOUT),
+        _estados_queue.close(timeout=DB_WRITE_DRAIN_TIMEOUT),
+    )
+
+
+# Estadísticas de la escritura diferida
+def get_write_behind_stats() -> Dict[str, Any]:
+    """
+    Devuelve los contadores de las colas de escritura diferida
+
+    Returns:
+        Dict: Por cola, elementos encolados, escritos, descartados, lotes y pendientes
+    """
+    return {
+        "consultas_ia": {
+            "enabled": DB_WRITE_BEHIND_ENABLED,
+            "pending": _consultas_queue.pending(),
+            **_consultas_queue.stats,
+        },
+        "estado_usuario": {
+            "enabled": ESTADO_REDIS_ENABLED and ESTADO_WRITE_THROUGH,
+            "pending": _estados_queue.pending(),
+            **_estados_queue.stats,
+        },
+    }
+
+
 # Funciones de compatibilidad simplificadas
 async def guardar_resumen(user_id: str, texto_original: str, resumen: str) -> None:
     """
@@ -247,63 +464,157 @@ async def startup_db_init():
     logger.info("Inicialización de base de datos y migraciones completadas")
 
 
+# Lee el modo del usuario en Postgres (opcionalmente sólo si es más reciente que max_age)
+async def _pg_obtener_modo(chat_id: int, max_age: Optional[int] = None) -> Optional[str]:
+    query = select(EstadoUsuario.modo_actual).where(EstadoUsuario.chat_id == chat_id)
+    if max_age:
+        query = query.where(EstadoUsuario.fecha >= datetime.utcnow() - timedelta(seconds=max_age))
+    async with _sesion() as session:
+        result = await session.execute(query)
+        return result.scalar_one_or_none()
+
+
+# UPSERT del modo de uno o varios usuarios
+def _upsert_estados(estados: List[Tuple[int, Optional[str], datetime]]):
+    # Si un usuario aparece varias veces en el lote, gana el último cambio
+    filas = {
+        chat_id: {"chat_id": chat_id, "modo_actual": modo, "fecha": fecha}
+        for chat_id, modo, fecha in estados
+    }
+    stmt = pg_insert(EstadoUsuario).values(list(filas.values()))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[EstadoUsuario.chat_id],
+        set_={"modo_actual": stmt.excluded.modo_actual, "fecha": stmt.excluded.fecha},
+        # Un lote reintentado o de otro worker no pisa un cambio más reciente
+        where=EstadoUsuario.fecha <= stmt.excluded.fecha,
+    )
+    return stmt
+
+
+# Guarda el modo de uno o varios usuarios en Postgres con un único UPSERT
+# (lo llama la cola en segundo plano: siempre con su propia sesión)
+async def _pg_guardar_estados(estados: List[Tuple[int, Optional[str], datetime]]) -> None:
+    async with AsyncSessionLocal() as session:
+        async with session.begin():
+            await session.execute(_upsert_estados(estados))
+
+
+# Lee y limpia el modo del usuario en Postgres con una sola sentencia (opcionalmente
+# sólo si es más reciente que max_age)
+async def _pg_consumir_modo(chat_id: int, max_age: Optional[int] = None) -> Optional[str]:
+    # UPDATE ... FROM (SELECT ... FOR UPDATE) ... RETURNING devuelve el valor anterior:
+    # dos peticiones concurrentes no pueden consumir el mismo modo
+    query = select(EstadoUsuario.chat_id, EstadoUsuario.modo_actual).where(
+        EstadoUsuario.chat_id == chat_id, EstadoUsuario.modo_actual.is_not(None)
+    )
+    if max_age:
+        query = query.where(EstadoUsuario.fecha >= datetime.utcnow() - timedelta(seconds=max_age))
+    anterior = query.with_for_update().subquery()
+    async with _sesion() as session:
+        result = await session.execute(
+            update(EstadoUsuario)
+            .where(EstadoUsuario.chat_id == anterior.c.chat_id)
+            .values(modo_actual=None, fecha=datetime.utcnow())
+            .returning(anterior.c.modo_actual)
+        )
+        return result.scalar_one_or_none()
+
+
+# Cola de escritura a Postgres de los cambios de modo hechos en Redis
+_estados_queue: WriteBehindQueue[Tuple[int, Optional[str], datetime]] = WriteBehindQueue(
+    "estado_usuario",
+    _pg_guardar_estados,
+    max_batch_size=DB_WRITE_BATCH_SIZE,
+    flush_interval=DB_WRITE_FLUSH_MS / 1000,
+    max_queue_size=DB_WRITE_QUEUE_MAX,
+)
+
+
+# Antigüedad máxima de un modo leído de Postgres (sólo caduca si se guarda en Redis)
+def _max_age_modo() -> Optional[int]:
+    return ESTADO_TTL if ESTADO_REDIS_ENABLED else None
+
+
+def _estado_key(chat_id: int) -> str:
+    return f"{ESTADO_KEY_PREFIX}:{chat_id}"
+
+
+# Guarda el modo en Redis y, con ESTADO_WRITE_THROUGH, lo encola para Postgres
+async def _guardar_estado(chat_id: int, modo: Optional[str]) -> None:
+    await get_async_redis().set(_estado_key(chat_id), modo or "", ex=ESTADO_TTL)
+    if ESTADO_WRITE_THROUGH:
+        await _estados_queue.put((chat_id, modo, datetime.utcnow()))
+
+
+# Lee el modo del usuario: de Redis (copiándolo desde Postgres si no está) o de Postgres
+async def _leer_modo(chat_id: int) -> Optional[str]:
+    if ESTADO_REDIS_ENABLED:
+        try:
+            redis_client = get_async_redis()
+            valor = await redis_client.get(_estado_key(chat_id))
+            if valor is not None:
+                return valor.decode("utf-8") or None
+            modo = await _pg_obtener_modo(chat_id, max_age=ESTADO_TTL)
+            # nx: no pisar un cambio hecho mientras se leía Postgres
+            await redis_client.set(_estado_key(chat_id), modo or "", ex=ESTADO_TTL, nx=True)
+            return modo
+        except redis.RedisError as e:
+            logger.error(f"Redis no disponible para el estado de usuario: {str(e)}")
+    return await _pg_obtener_modo(chat_id, max_age=_max_age_modo())
+
+
 # Obtiene el modo actual del usuario
 async def obtener_modo_usuario(chat_id: int) -> Optional[str]:
     """
     Obtiene el modo actual del usuario
 
+    Con ESTADO_REDIS_ENABLED se lee de Redis; si no está, se lee de Postgres (sólo si
+    se cambió hace menos de ESTADO_TTL) y se copia a Redis. Dentro de una unidad de
+    trabajo el modo se lee una sola vez por usuario.
+
     Args:
         chat_id: ID del chat/usuario
 
     Returns:
         Modo actual o None si no existe
     """
+    modos = _modos_peticion.get()
+    if modos is not None and chat_id in modos:
+        return modos[chat_id]
     try:
-        async with AsyncSessionLocal() as session:
-            result = await session.execute(
-                select(EstadoUsuario.modo_actual).where(
-                    EstadoUsuario.chat_id == chat_id
-                )
-            )
-            modo = result.scalar_one_or_none()
-            return modo
+        modo = await _leer_modo(chat_id)
     except Exception as e:
         logger.error(f"Error al obtener estado de usuario: {str(e)}")
         return None
+    _recordar_modo(chat_id, modo)
+    return modo
 
 
-async def establecer_modo_usuario(chat_id: int, modo: str) -> None:
+async def establecer_modo_usuario(chat_id: int, modo: Optional[str]) -> None:
     """
     Establece o actualiza el modo actual del usuario
 
+    Con ESTADO_REDIS_ENABLED se guarda en Redis (con caducidad ESTADO_TTL) y se
+    escribe en Postgres en segundo plano. Sin Redis usa una sola sentencia
+    INSERT ... ON CONFLICT (chat_id) DO UPDATE.
+
     Args:
         chat_id: ID del chat/usuario
         modo: Nuevo modo a establecer
     """
     try:
-        async with AsyncSessionLocal() as session:
-            async with session.begin():
-                # Buscar si ya existe un registro para este usuario
-                result = await session.execute(
-                    select(EstadoUsuario).where(EstadoUsuario.chat_id == chat_id)
-                )
-                estado = result.scalar_one_or_none()
-
-                if estado:
-                    # Actualizar registro existente
-                    await session.execute(
-                        update(EstadoUsuario)
-                        .where(EstadoUsuario.chat_id == chat_id)
-                        .values(modo_actual=modo, fecha=datetime.utcnow())
-                    )
-                else:
-                    # Crear nuevo registro
-                    nuevo_estado = EstadoUsuario(
-                        chat_id=chat_id, modo_actual=modo, fecha=datetime.utcnow()
-                    )
-                    session.add(nuevo_estado)
-
-            logger.info(f"Modo {modo} establecido para usuario {chat_id}")
+        if ESTADO_REDIS_ENABLED:
+            try:
+                await _guardar_estado(chat_id, modo)
+                _recordar_modo(chat_id, modo)
+                logger.info(f"Modo {modo} establecido para usuario {chat_id}")
+                return
+            except redis.RedisError as e:
+                logger.error(f"Redis no disponible para el estado de usuario: {str(e)}")
+        async with _sesion() as session:
+            await session.execute(_upsert_estados([(chat_id, modo, datetime.utcnow())]))
+        _recordar_modo(chat_id, modo)
+        logger.info(f"Modo {modo} establecido para usuario {chat_id}")
     except Exception as e:
         logger.error(f"Error al establecer modo de usuario: {str(e)}")
         raise
@@ -314,12 +625,70 @@ async def limpiar_modo_usuario(chat_id: int) -> None:
     """
     Limpia (establece a NULL) el modo actual del usuario
 
+    Dentro de una unidad de trabajo no hace nada si ya se sabe que no hay modo.
+
     Args:
         chat_id: ID del chat/usuario
     """
+    modos = _modos_peticion.get()
+    if modos is not None and chat_id in modos and modos[chat_id] is None:
+        return
     try:
-        await establecer_modo_usuario(chat_id, None)
+        if ESTADO_REDIS_ENABLED:
+            try:
+                await _guardar_estado(chat_id, None)
+                _recordar_modo(chat_id, None)
+                logger.info(f"Modo limpiado para usuario {chat_id}")
+                return
+            except redis.RedisError as e:
+                logger.error(f"Redis no disponible para el estado de usuario: {str(e)}")
+        # Un único UPDATE: si el usuario no tiene estado no hay nada que limpiar
+        async with _sesion() as session:
+            await session.execute(
+                update(EstadoUsuario)
+                .where(EstadoUsuario.chat_id == chat_id, EstadoUsuario.modo_actual.is_not(None))
+                .values(modo_actual=None, fecha=datetime.utcnow())
+            )
+        _recordar_modo(chat_id, None)
         logger.info(f"Modo limpiado para usuario {chat_id}")
     except Exception as e:
         logger.error(f"Error al limpiar modo de usuario: {str(e)}")
         raise
+
+
+# Lee y limpia el modo actual del usuario en una sola operación
+async def consumir_modo_usuario(chat_id: int) -> Optional[str]:
+    """
+    Devuelve el modo actual del usuario y lo deja a NULL
+
+    En Redis es un SET ... GET atómico; si el usuario no estaba en Redis (o Redis no
+    está disponible) se usa un único UPDATE ... RETURNING en Postgres. En ambos casos
+    dos peticiones concurrentes no pueden consumir el mismo modo.
+
+    Args:
+        chat_id: ID del chat/usuario
+
+    Returns:
+        Modo que tenía el usuario o None si no tenía ninguno
+    """
+    try:
+        if ESTADO_REDIS_ENABLED:
+            try:
+                anterior = await get_async_redis().set(
+                    _estado_key(chat_id), "", ex=ESTADO_TTL, get=True
+                )
+                if anterior is not None:
+                    modo = anterior.decode("utf-8") or None
+                    if modo and ESTADO_WRITE_THROUGH:
+                        await _estados_queue.put((chat_id, None, datetime.utcnow()))
+                    _recordar_modo(chat_id, None)
+                    return modo
+            except redis.RedisError as e:
+                logger.error(f"Redis no disponible para el estado de usuario: {str(e)}")
+        # Un modo más antiguo que ESTADO_TTL ha caducado, igual que al leerlo
+        modo = await _pg_consumir_modo(chat_id, max_age=_max_age_modo())
+        _recordar_modo(chat_id, None)
+        return modo
+    except Exception as e:
+        logger.error(f"Error al consumir modo de usuario: {str(e)}")
+        raise
@@ -0,0 +1,193 @@
+"""
+Este módulo proporciona el intérprete local de consultas sobre el historial.
+
+Reconoce las formas más habituales de pedir registros en lenguaje natural ("dame los 3
+últimos registros clasificados", "¿cuántos registros se han traducido?", "la fecha del
+penúltimo resumen") y devuelve la misma intención en JSON que produciría el modelo, sin
+llamar a OpenAI. Si la frase no encaja con ninguna regla devuelve None y el endpoint
+recurre al modelo.
+
+"""
+import re
+import unicodedata
+from typing import Any, Dict, Optional, Tuple
+from core.logging import setup_logger
+
+logger = setup_logger("services.intent_parser")
+
+# Límite de registros para "toda la tabla"
+LIMIT_ALL = 100
+# Límite por defecto al listar
+LIMIT_DEFAULT = 5
+
+_TASKS = (
+    (re.compile(r"\bresum"), "resumir"),
+    (re.compile(r"\btradu[cjz]"), "traducir"),
+    (re.compile(r"\bclasific"), "clasificar"),
+)
+
+# Palabras que indican que se habla del historial
+_SUBJECT = re.compile(r"\b(registros?|consultas?|tabla|historial|entradas?|interacciones?|mensajes?)\b")
+
+_COUNT = re.compile(r"\b(cuant[oa]s|numero de|total de|cuenta|contar|cantidad de)\b")
+
+_FIELDS = (
+    (re.compile(r"\b(fecha|cuando|dia)\b"), "fecha"),
+    (re.compile(r"\btexto( original)?\b"), "texto_original"),
+    (re.compile(r"\bresultado\b"), "resultado"),
+    (re.compile(r"\b(id|identificador)\b"), "id"),
+)
+
+_NUMBERS = {
+    "un": 1, "uno": 1, "una": 1, "dos": 2, "tres": 3, "cuatro": 4, "cinco": 5,
+    "seis": 6, "siete": 7, "ocho": 8, "nueve": 9, "diez": 10,
+}
+_NUMBER = r"(\d+|" + "|".join(_NUMBERS) + r")"
+
+# Posición contada desde el principio (orden ascendente)
+_ORDINALS = {
+    "primer": 1, "segund": 2, "tercer": 3, "cuart": 4, "quint": 5,
+    "sext": 6, "septim": 7, "setim": 7, "octav": 8, "noven": 9, "decim": 10,
+}
+_ORDINAL = re.compile(r"\b(" + "|".join(_ORDINALS) + r")(?:[oa])?\b")
+# Posición contada desde el final (orden descendente)
+_FROM_END = {"ultim": 1, "penultim": 2, "antepenultim": 3}
+_FROM_END_RE = re.compile(r"\b(antepenultim|penultim|ultim)[oa]\b")
+_RECORD_NUMBER = re.compile(r"\b(?:registro|consulta|entrada)\s+(?:(?:numero|num|n|no)\s+)?(\d+)\b")
+
+_LIST_LAST = re.compile(rf"\b(?:{_NUMBER}\s+ultim[oa]s|ultim[oa]s\s+{_NUMBER})\b")
+_LIST_FIRST = re.compile(rf"\b(?:{_NUMBER}\s+primer[oa]s|primer[oa]s\s+{_NUMBER})\b")
+# Un número seguido de lo que se pide ("3 registros", "2 resumenes"): los más recientes
+_LIST_COUNT = re.compile(
+    rf"\b{_NUMBER}\s+(?:registros|consultas|entradas|interacciones|mensajes|"
+    r"resumenes|traducciones|clasificaciones)\b"
+)
+_LIST_ALL = re.compile(r"\b(tod[oa]s?)\b")
+_LIST = re.compile(r"\b(dame|muestra|muestrame|ensename|lista|listar|ver|quiero|mis)\b")
+
+# Contadores de uso para medir la cobertura del intérprete local
+_stats: Dict[str, int] = {"local": 0, "fallback": 0}
+
+
+# Normaliza el texto: minúsculas, sin tildes (salvo la ñ) y sin signos de puntuación
+# (también es la clave de la caché de intenciones interpretadas por el modelo)
+def normalize_query(texto: str) -> str:
+    texto = unicodedata.normalize("NFD", texto.lower().replace("ñ", "\x00"))
+    texto = "".join(c for c in texto if unicodedata.category(c) != "Mn").replace("\x00", "ñ")
+    return " ".join(re.sub(r"[^\w#]+", " ", texto).split())
+
+
+def _number(value: str) -> int:
+    return int(value) if value.isdigit() else _NUMBERS[value]
+
+
+# Tipo de tarea mencionado (None si no hay ninguno; ValueError si hay varios)
+def _task(texto: str) -> Optional[str]:
+    tareas = {tarea for patron, tarea in _TASKS if patron.search(texto)}
+    if len(tareas) > 1:
+        raise ValueError("varios tipos de tarea")
+    return next(iter(tareas), None)
+
+
+def _field(texto: str) -> Optional[str]:
+    campos = {campo for patron, campo in _FIELDS if patron.search(texto)}
+    return campos.pop() if len(campos) == 1 else None
+
+
+# Posición pedida como (posición, orden), o None si no se pide un registro concreto
+def _position(texto: str) -> Optional[Tuple[int, str]]:
+    found = []
+    if match := _FROM_END_RE.search(texto):
+        found.append((_FROM_END[match.group(1)], "desc"))
+    if match := _ORDINAL.search(texto):
+        found.append((_ORDINALS[match.group(1)], "asc"))
+    if match := _RECORD_NUMBER.search(texto):
+        found.append((int(match.group(1)), "asc"))
+    return found[0] if len(found) == 1 else None
+
+
+def _parse(texto: str) -> Optional[Dict[str, Any]]:
+    try:
+        tipo_tarea = _task(texto)
+    except ValueError:
+        return None
+    if tipo_tarea is None and not _SUBJECT.search(texto):
+        return None
+
+    if _COUNT.search(texto):
+        return {"accion": "contar", "tipo_tarea": tipo_tarea, "respuesta_esperada": "numero"}
+
+    listas = [_LIST_LAST.search(texto), _LIST_FIRST.search(texto)]
+    cantidad = _LIST_COUNT.search(texto)
+    if not any(listas) and not cantidad:
+        position = _position(texto)
+        if position:
+            posicion, orden = position
+            campo = _field(texto)
+            return {
+                "accion": "campo_especifico" if campo else "listar",
+                "tipo_tarea": tipo_tarea,
+                "limit": posicion,
+                "orden": orden,
+                "campo": campo,
+                "posicion": posicion,
+                "respuesta_esperada": "valor",
+            }
+
+    if _field(texto):
+        return None  # Un campo de varios registros: mejor el modelo
+
+    last, first = listas
+    if last and first:
+        return None
+    if last or first:
+        match = last or first
+        limit = _number(next(g for g in match.groups() if g))
+        orden = "desc" if last else "asc"
+    elif cantidad:
+        limit, orden = _number(cantidad.group(1)), "desc"
+    elif _LIST_ALL.search(texto):
+        limit, orden = LIMIT_ALL, "desc"
+    elif _LIST.search(texto):
+        limit, orden = LIMIT_DEFAULT, "desc"
+    else:
+        return None
+    return {
+        "accion": "listar",
+        "tipo_tarea": tipo_tarea,
+        "limit": limit,
+        "orden": orden,
+        "respuesta_esperada": "lista",
+    }
+
+
+def parse_intent(texto: str) -> Optional[Dict[str, Any]]:
+    """
+    Interpreta localmente una consulta sobre el historial
+
+    Args:
+        texto: Mensaje del usuario
+
+    Returns:
+        Optional[Dict]: Intención con el mismo formato que la del modelo (accion,
+            tipo_tarea, limit, orden, campo, posicion, respuesta_esperada), o None si
+            la frase no se reconoce y hay que recurrir al modelo
+    """
+    data = _parse(normalize_query(texto))
+    if data is None:
+        _stats["fallback"] += 1
+        logger.debug(f"Consulta no reconocida localmente: {texto!r}")
+    else:
+        _stats["local"] += 1
+    return data
+
+
+def get_intent_stats() -> Dict[str, Any]:
+    """
+    Devuelve los contadores del intérprete local
+
+    Returns:
+        Dict: Consultas resueltas localmente, enviadas al modelo y cobertura (0-1)
+    """
+    total = _stats["local"] + _stats["fallback"]
+    return {**_stats, "coverage": round(_stats["local"] / total, 4) if total else None}
@@ -0,0 +1,131 @@
+"""
+Este módulo proporciona el cliente de OpenAI compartido por toda la aplicación.
+
+Todas las tareas usan un único `AsyncOpenAI` sobre un pool de conexiones httpx
+configurable (tamaño, keep-alive y HTTP/2), creado en el arranque y cerrado en el apagado,
+para reutilizar conexiones TLS en lugar de abrir un pool por módulo.
+
+"""
+import asyncio
+import os
+from typing import Optional
+import httpx
+import openai
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from core.errors import OpenAIError, OpenAIRateLimitError, OpenAITimeoutError
+from core.logging import setup_logger
+
+logger = setup_logger("services.llm_client")
+
+# Configuración desde variables de entorno
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "30.0"))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5.0"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20")
+)
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "30.0"))
+OPENAI_HTTP2 = os.getenv("OPENAI_HTTP2", "true").lower() == "true"
+
+# HTTP/2 necesita el paquete h2 (httpx[http2])
+try:
+    import h2  # noqa: F401
+
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Cliente compartido (se crea en init_llm_client o bajo demanda)
+_client: Optional[AsyncOpenAI] = None
+
+
+# Crea el cliente con su pool de conexiones httpx
+def _create_client() -> AsyncOpenAI:
+    http2 = OPENAI_HTTP2 and HTTP2_AVAILABLE
+    if OPENAI_HTTP2 and not HTTP2_AVAILABLE:
+        logger.warning("Paquete h2 no instalado, el cliente de OpenAI usará HTTP/1.1")
+
+    http_client = DefaultAsyncHttpxClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+    )
+    logger.info(
+        f"Cliente OpenAI creado (http2={http2}, max_connections={OPENAI_MAX_CONNECTIONS}, "
+        f"keepalive={OPENAI_MAX_KEEPALIVE_CONNECTIONS})"
+    )
+    return AsyncOpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        timeout=OPENAI_TIMEOUT,
+        max_retries=0,  # Usamos nuestro propio sistema de reintentos
+        http_client=http_client,
+    )
+
+
+def get_openai_client() -> AsyncOpenAI:
+    """
+    Devuelve el cliente de OpenAI compartido
+
+    Si la aplicación no lo ha inicializado (scripts, tests), se crea bajo demanda.
+
+    Returns:
+        AsyncOpenAI: Cliente asíncrono con el pool de conexiones compartido
+    """
+    global _client
+    if _client is None:
+        _client = _create_client()
+    return _client
+
+
+async def init_llm_client() -> None:
+    """Crea el cliente de OpenAI al arrancar la aplicación"""
+    if not os.getenv("OPENAI_API_KEY"):
+        logger.warning("OPENAI_API_KEY no configurada, el cliente se creará bajo demanda")
+        return
+    get_openai_client()
+
+
+async def close_llm_client() -> None:
+    """Cierra el cliente de OpenAI y su pool de conexiones"""
+    global _client
+    if _client is None:
+        return
+    try:
+        await _client.close()
+        logger.info("Cliente OpenAI cerrado")
+    except Exception as e:
+        logger.error(f"Error cerrando el cliente OpenAI: {str(e)}")
+    finally:
+        _client = None
+
+
+def to_api_error(e: Exception, action: str) -> OpenAIError:
+    """
+    Convierte una excepción de una llamada a OpenAI en el error de la API equivalente
+
+    Args:
+        e: Excepción producida
+        action: Operación en curso, para el mensaje (p. ej. 'generar resumen')
+
+    Returns:
+        OpenAIError: Error de la API (el mismo si ya lo era)
+    """
+    if isinstance(e, OpenAIError):
+        return e
+    if isinstance(e, asyncio.TimeoutError):
+        logger.error(f"Timeout al conectar con OpenAI: {str(e)}")
+        return OpenAITimeoutError(
+            timeout=OPENAI_TIMEOUT, details={"error_type": "asyncio.TimeoutError"}
+        )
+    if isinstance(e, openai.RateLimitError):
+        logger.error(f"Rate limit excedido en OpenAI: {str(e)}")
+        return OpenAIRateLimitError(details={"original_error": str(e)})
+    if isinstance(e, openai.APIError):
+        logger.error(f"Error de API de OpenAI: {str(e)}")
+        return OpenAIError(message=f"Error en la API de OpenAI: {str(e)}")
+    logger.error(f"Error inesperado al {action}: {str(e)}")
+    return OpenAIError(message=f"Error al {action}: {str(e)}")
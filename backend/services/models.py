@@ -5,7 +5,7 @@ Incluye modelos para consultas de IA y estado de usuario.
 
 """
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, Text, DateTime, BigInteger
+from sqlalchemy import Column, Integer, String, Text, DateTime, BigInteger, Index
 from sqlalchemy.sql import func
 
 Base = declarative_base()
@@ -24,6 +24,16 @@ class ConsultaIA(Base):
     resultado = Column(Text)
     idioma = Column(String(20), nullable=True)  # Solo para traducciones
     fecha = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+    # SHA-256 de texto_original y resultado (ver services.db.content_hash)
+    content_hash = Column(String(64), nullable=True)
+
+    # Índice único para evitar duplicados exactos: el hash ocupa 64 caracteres sea cual
+    # sea la longitud de los textos
+    __table_args__ = (
+        Index(
+            "idx_consultas_ia_content_hash", "chat_id", "tipo_tarea", "content_hash", unique=True
+        ),
+    )
 
     # Representación de la consulta
     def __repr__(self):
@@ -1,17 +1,23 @@
-from openai import AsyncOpenAI
 import os
+import re
+import json
+import math
 import logging
 import asyncio
 import openai
+from pydantic import BaseModel, ConfigDict
 from services.db import (
     guardar_consulta,
-    obtener_modo_usuario,
     limpiar_modo_usuario,
 )
-from typing import Dict, Any
+from services.llm_client import get_openai_client
+from typing import Dict, Any, List, Literal, Optional, Sequence, Tuple, Union
 from core.logging import setup_logger
-from core.cache import cache_response
-from core.retry import with_retry
+from core.cache import cache_response, normalize_text, is_background_refresh
+from core.retry import with_retry, get_circuit_breaker
+from core.batching import MicroBatcher
+from core.rate_limit import acquire_openai_capacity
+from core.tokens import estimate_request_tokens
 from core.errors import (
     OpenAIError,
     MissingParameterError,
@@ -22,18 +28,122 @@ from core.errors import (
 # Configure logging
 logger = setup_logger("services.tasks.classify")
 
-# Initialize AsyncOpenAI client
-client = AsyncOpenAI(
-    api_key=os.getenv("OPENAI_API_KEY"),
-    timeout=float(os.getenv("OPENAI_TIMEOUT", "30.0")),
-    max_retries=0,  # Usamos nuestro propio sistema de reintentos
-)
+# Modelo y versión del prompt: forman parte de la clave de caché
+MODEL = "gpt-4o-mini-2024-07-18"
+PROMPT_VERSION = "2"  # Incrementar al cambiar el prompt para invalidar la caché
+
+# Circuit breaker compartido por todas las llamadas a este modelo y endpoint
+openai_circuit = get_circuit_breaker(f"openai:{MODEL}:chat.completions")
+
+# Micro-batching: textos cortos que llegan juntos se clasifican en una sola completion
+CLASSIFY_BATCH_ENABLED = os.getenv("CLASSIFY_BATCH_ENABLED", "true").lower() == "true"
+CLASSIFY_BATCH_MAX_SIZE = int(os.getenv("CLASSIFY_BATCH_MAX_SIZE", "10"))
+CLASSIFY_BATCH_WINDOW_MS = float(os.getenv("CLASSIFY_BATCH_WINDOW_MS", "20"))
+CLASSIFY_BATCH_MAX_CHARS = int(os.getenv("CLASSIFY_BATCH_MAX_CHARS", "500"))
+
+# Tokens de respuesta por elemento en una clasificación por lotes
+BATCH_TOKENS_PER_ITEM = 40
+
+# Niveles de urgencia devueltos en la clasificación
+URGENCY_LEVELS = {"alta": "high", "media": "medium", "baja": "low"}
+
+
+class Clasificacion(BaseModel):
+    """Salida estructurada de la clasificación de un texto"""
+
+    model_config = ConfigDict(extra="forbid")
+
+    categoria: Literal["consulta", "solicitud", "informe", "queja", "urgencia", "otro"]
+    urgencia: Literal["alta", "media", "baja"]
+    tema: Literal["recursos humanos", "finanzas", "IT", "marketing", "ventas", "legal", "otro"]
+
+
+class ClasificacionLoteItem(Clasificacion):
+    """Clasificación de un texto dentro de un lote"""
+
+    id: int
+
+
+class ClasificacionLote(BaseModel):
+    """Salida estructurada de la clasificación por lotes"""
+
+    model_config = ConfigDict(extra="forbid")
+
+    items: List[ClasificacionLoteItem]
+
+
+# Formato de respuesta con esquema estricto (structured outputs) para un modelo
+def _response_format(model: type, name: str) -> Dict[str, Any]:
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": name, "strict": True, "schema": model.model_json_schema()},
+    }
+
+
+# Los esquemas se generan una sola vez; la validación usa el validador compilado de pydantic
+RESPONSE_FORMAT = _response_format(Clasificacion, "clasificacion")
+BATCH_RESPONSE_FORMAT = _response_format(ClasificacionLote, "clasificacion_lote")
+
+# Valores de los campos en la respuesta JSON, para localizar sus tokens
+_FIELD_VALUE = re.compile(r'"(categoria|urgencia|tema)"\s*:\s*"([^"]*)"')
+_ITEM_OBJECT = re.compile(r"\{[^{}]*\}")
+_ITEM_ID = re.compile(r'"id"\s*:\s*(\d+)')
+
+
+# Clave de caché por contenido: el mismo texto comparte clasificación entre usuarios
+def _content_cache_key(input: Dict[str, Any], context: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "text": normalize_text(input.get("text", "")),
+        "model": MODEL,
+        "prompt": PROMPT_VERSION,
+    }
+
+
+# Registro del historial para una clasificación (también usado por el procesamiento por lotes)
+def history_record(result: Dict[str, Any], input: Dict[str, Any]) -> Dict[str, Any]:
+    clasificacion = result["classification"]
+    return {
+        "tipo_tarea": "clasificar",
+        "texto_original": input.get("text", ""),
+        "resultado": result["raw_classification"],
+        "metadata": {
+            "category": clasificacion.get("category", ""),
+            "urgency": clasificacion.get("urgency", ""),
+            "confidence": clasificacion.get("confidence", 0.0),
+            "model": result["model_used"],
+        },
+    }
+
+
+# Limpia el modo del usuario y guarda la clasificación en su historial
+# (también en aciertos de caché)
+async def _save_history(
+    result: Dict[str, Any], input: Dict[str, Any], context: Dict[str, Any]
+) -> None:
+    # Un refresco en segundo plano no es una consulta nueva del usuario, y con
+    # persist=False el llamante guarda el historial por su cuenta
+    if is_background_refresh() or not context.get("persist", True):
+        return
+    user_id = context.get("user_id", "desconocido")
+    chat_id = int(user_id) if user_id.isdigit() else 0
+    try:
+        if chat_id > 0:
+            await limpiar_modo_usuario(chat_id)
+
+        await guardar_consulta(user_id=user_id, **history_record(result, input))
+        logger.info("Clasificación guardada en base de datos")
+    except Exception as e:
+        logger.error(f"Error al guardar en base de datos: {str(e)}")
+        # Continuamos aunque falle la persistencia
 
 
 # Caché de clasificación
 @cache_response(
-    ttl=int(os.getenv("CLASSIFICATION_CACHE_TTL", "86400"))
-)  # 24 horas por defecto
+    ttl=int(os.getenv("CLASSIFICATION_CACHE_TTL", "86400")),  # 24 horas por defecto
+    local_max_bytes=int(os.getenv("CLASSIFICATION_LOCAL_CACHE_MAX_BYTES", str(8 * 1024 * 1024))),
+    key_builder=_content_cache_key,
+    on_hit=_save_history,
+)
 async def run(input: Dict[str, Any], context: Dict[str, Any]) -> Dict[str, Any]:
     """
     Classify text using OpenAI's GPT model asynchronously
@@ -53,19 +163,6 @@ async def run(input: Dict[str, Any], context: Dict[str, Any]) -> Dict[str, Any]:
     """
     text = input.get("text", "")
     user_id = context.get("user_id", "desconocido")
-    chat_id = int(user_id) if user_id.isdigit() else 0
-
-    # Verificar si el usuario está en modo clasificación
-    if chat_id > 0:
-        modo_actual = await obtener_modo_usuario(chat_id)
-        if modo_actual != "/clasificar":
-            logger.info(
-                f"Usuario {chat_id} no está en modo clasificación, está en: {modo_actual}"
-            )
-            # Si no está en modo clasificación, verificamos su modo actual
-            if modo_actual:
-                # Aquí se podría redirigir a otro servicio según el modo
-                pass
 
     # Validate input
     if not text.strip():
@@ -76,45 +173,26 @@ async def run(input: Dict[str, Any], context: Dict[str, Any]) -> Dict[str, Any]:
 
     try:
         logger.info(f"Clasificando texto para usuario {user_id}")
-        # Llamar a la función protegida con reintentos
-        response = await call_openai_with_retry(text)
-
-        # Procesamiento de la respuesta
-        clasificacion_raw = response.choices[0].message.content.strip()
+        # Llamar a OpenAI (agrupando textos cortos) con reintentos
+        clasificacion = await _classify(text)
 
-        # Parsear la clasificación JSON-like
-        clasificacion = parse_classification(clasificacion_raw)
-
-        # Guardar en base de datos unificada
-        try:
-            if chat_id > 0:
-                await limpiar_modo_usuario(chat_id)
-
-            await guardar_consulta(
-                user_id=user_id,
-                tipo_tarea="clasificar",
-                texto_original=text,
-                resultado=clasificacion_raw,
-                metadata={
-                    "category": clasificacion.get("category", ""),
-                    "urgency": clasificacion.get("urgency", ""),
-                    "confidence": clasificacion.get("confidence", 0.0),
-                    "model": "gpt-4o-mini-2024-07-18",
-                },
-            )
-            logger.info("Clasificación guardada en base de datos")
-        except Exception as e:
-            logger.error(f"Error al guardar en base de datos: {str(e)}")
-            # Continuamos aunque falle la persistencia
-
-        return {
+        result = {
             "classification": clasificacion,
+            "raw_classification": format_classification(clasificacion),
             "text_length": len(text),
-            "model_used": "gpt-4o-mini-2024-07-18",
+            "model_used": MODEL,
             "cached": False,
         }
 
+        # Guardar en base de datos unificada
+        await _save_history(result, input, context)
+
+        return result
+
     # Manejo de excepciones
+    except OpenAIError:
+        # Rechazos del limitador o del circuit breaker: ya son errores de la API
+        raise
     except asyncio.TimeoutError as e:
         logger.error(f"Timeout al conectar con OpenAI: {str(e)}")
         timeout_value = float(os.getenv("OPENAI_TIMEOUT", "30.0"))
@@ -132,48 +210,74 @@ async def run(input: Dict[str, Any], context: Dict[str, Any]) -> Dict[str, Any]:
         raise OpenAIError(message=f"Error al clasificar texto: {str(e)}")
 
 
-# Parsea la respuesta de clasificación de OpenAI
-def parse_classification(text: str) -> Dict[str, Any]:
+# Posiciones (inicio, fin, logprob) de cada token dentro del contenido de la respuesta
+def _token_spans(logprobs: Any) -> List[Tuple[int, int, float]]:
+    spans = []
+    position = 0
+    for token in getattr(logprobs, "content", None) or []:
+        spans.append((position, position + len(token.token), token.logprob))
+        position += len(token.token)
+    return spans
+
+
+# Probabilidad conjunta de los tokens que forman el texto entre start y end
+def _span_confidence(spans: Sequence[Tuple[int, int, float]], start: int, end: int) -> float:
+    logprob = sum(lp for token_start, token_end, lp in spans if token_start < end and token_end > start)
+    return round(math.exp(logprob), 4)
+
+
+# Convierte la salida validada al formato de resultado, con la confianza de cada campo
+def _to_result(
+    clasificacion: Clasificacion,
+    content: str,
+    spans: Sequence[Tuple[int, int, float]],
+    start: int = 0,
+    end: Optional[int] = None,
+) -> Dict[str, Any]:
+    result: Dict[str, Any] = {
+        "category": clasificacion.categoria,
+        "urgency": URGENCY_LEVELS[clasificacion.urgencia],
+        "theme": clasificacion.tema.lower(),
+        "confidence": None,
+    }
+    if spans:
+        fields = {
+            match.group(1): _span_confidence(spans, match.start(2), match.end(2))
+            for match in _FIELD_VALUE.finditer(content, start, len(content) if end is None else end)
+        }
+        if fields:
+            # La confianza global es la del campo menos seguro
+            result["field_confidence"] = fields
+            result["confidence"] = min(fields.values())
+    return result
+
+
+def parse_classification(content: str, logprobs: Any = None) -> Dict[str, Any]:
     """
-    Parsea la respuesta de clasificación de OpenAI
+    Valida y convierte la respuesta estructurada de clasificación de OpenAI
 
     Args:
-        text: Respuesta textual de OpenAI
+        content: Contenido JSON de la respuesta (esquema de `Clasificacion`)
+        logprobs: Logprobs de la respuesta; sin ellos la confianza es None
 
     Returns:
-        Dict: Categoría y confianza
+        Dict: Categoría, urgencia, tema y confianza (probabilidad del campo menos seguro)
+
+    Raises:
+        pydantic.ValidationError: Si la respuesta no cumple el esquema
     """
-    # Implementación simple - un parseo completo requeriría JSON.parse y manejo de errores
-    result = {}
-
-    # Extraer categoría
-    if "categoría:" in text.lower():
-        category_parts = text.lower().split("categoría:", 1)[1].split("\n", 1)
-        if category_parts:
-            result["category"] = category_parts[0].strip()
-
-    # Intentar extraer nivel de urgencia
-    if "urgencia:" in text.lower():
-        urgency_parts = text.lower().split("urgencia:", 1)[1].split("\n", 1)
-        if urgency_parts:
-            urgency_text = urgency_parts[0].strip()
-            if "alta" in urgency_text:
-                result["urgency"] = "high"
-            elif "media" in urgency_text:
-                result["urgency"] = "medium"
-            else:
-                result["urgency"] = "low"
-
-    # Extraer tema si existe
-    if "tema:" in text.lower():
-        theme_parts = text.lower().split("tema:", 1)[1].split("\n", 1)
-        if theme_parts:
-            result["theme"] = theme_parts[0].strip()
-
-    # Confianza (default)
-    result["confidence"] = 0.9
+    clasificacion = Clasificacion.model_validate_json(content)
+    return _to_result(clasificacion, content, _token_spans(logprobs))
 
-    return result
+
+# Texto legible de una clasificación (se guarda como resultado en el historial)
+def format_classification(clasificacion: Dict[str, Any]) -> str:
+    urgencias = {level: urgencia for urgencia, level in URGENCY_LEVELS.items()}
+    return (
+        f"Categoría: {clasificacion['category']}\n"
+        f"Urgencia: {urgencias.get(clasificacion['urgency'], clasificacion['urgency'])}\n"
+        f"Tema: {clasificacion['theme']}"
+    )
 
 
 # Llama a la API de OpenAI con reintentos
@@ -190,27 +294,145 @@ async def call_openai_with_retry(text: str):
     """
     logger.debug("Llamando a OpenAI API para clasificar texto...")
 
-    response = await client.chat.completions.create(
-        model="gpt-4o-mini-2024-07-18",
-        messages=[
-            {
-                "role": "system",
-                "content": """Clasifica el siguiente texto según:
+    messages = [
+        {
+            "role": "system",
+            "content": """Clasifica el siguiente texto según:
                 - Categoría: consulta/solicitud/informe/queja/urgencia/otro
                 - Urgencia: alta/media/baja
                 - Tema: recursos humanos/finanzas/IT/marketing/ventas/legal/otro
 
-                Responde usando exactamente el formato:
-                Categoría: [categoria]
-                Urgencia: [urgencia]
-                Tema: [tema]
+                Responde con un JSON con los campos categoria, urgencia y tema.
                 """,
-            },
-            {"role": "user", "content": text},
-        ],
+        },
+        {"role": "user", "content": text},
+    ]
+    max_tokens = 100
+
+    # Esperar capacidad en el limitador de RPM/TPM antes de llamar
+    await acquire_openai_capacity(estimate_request_tokens(messages, max_tokens))
+
+    response = await openai_circuit.call(
+        get_openai_client().chat.completions.create,
+        model=MODEL,
+        messages=messages,
         temperature=0.3,
-        max_tokens=100,
+        max_tokens=max_tokens,
+        response_format=RESPONSE_FORMAT,
+        logprobs=True,
     )
 
     logger.debug("Respuesta recibida de OpenAI API")
     return response
+
+
+# Instrucciones para clasificar varios textos en una sola llamada
+BATCH_SYSTEM_PROMPT = """Clasifica cada uno de los textos según:
+- categoria: consulta/solicitud/informe/queja/urgencia/otro
+- urgencia: alta/media/baja
+- tema: recursos humanos/finanzas/IT/marketing/ventas/legal/otro
+
+Recibirás una lista JSON de objetos {"id": n, "texto": "..."}.
+Responde SOLO con un JSON de la forma:
+{"items": [{"id": n, "categoria": "...", "urgencia": "...", "tema": "..."}]}
+con un elemento por cada texto recibido."""
+
+
+# Llama a la API de OpenAI con reintentos para clasificar varios textos
+@with_retry
+async def call_openai_batch_with_retry(texts: List[str]):
+    """
+    Función protegida con reintentos para clasificar varios textos en una llamada
+
+    Args:
+        texts: Textos a clasificar (se numeran desde 1)
+
+    Returns:
+        Respuesta de OpenAI
+    """
+    logger.debug(f"Llamando a OpenAI API para clasificar {len(texts)} textos...")
+
+    items = [{"id": i, "texto": text} for i, text in enumerate(texts, start=1)]
+    messages = [
+        {"role": "system", "content": BATCH_SYSTEM_PROMPT},
+        {"role": "user", "content": json.dumps(items, ensure_ascii=False)},
+    ]
+    max_tokens = BATCH_TOKENS_PER_ITEM * len(texts) + 20
+
+    # Esperar capacidad en el limitador de RPM/TPM antes de llamar
+    await acquire_openai_capacity(estimate_request_tokens(messages, max_tokens))
+
+    response = await openai_circuit.call(
+        get_openai_client().chat.completions.create,
+        model=MODEL,
+        messages=messages,
+        temperature=0.3,
+        max_tokens=max_tokens,
+        response_format=BATCH_RESPONSE_FORMAT,
+        logprobs=True,
+    )
+
+    logger.debug("Respuesta recibida de OpenAI API")
+    return response
+
+
+# Clasifica un texto con una llamada propia
+async def _classify_single(text: str) -> Dict[str, Any]:
+    response = await call_openai_with_retry(text)
+    choice = response.choices[0]
+    return parse_classification(choice.message.content, choice.logprobs)
+
+
+# Procesa un lote del agrupador: una llamada para todos y, si falta algún
+# elemento en la respuesta, una llamada individual para ese texto
+async def _classify_batch(texts: List[str]) -> List[Union[Dict[str, Any], Exception]]:
+    if len(texts) == 1:
+        return [await _classify_single(texts[0])]
+
+    response = await call_openai_batch_with_retry(texts)
+    choice = response.choices[0]
+    content = choice.message.content or ""
+    spans = _token_spans(choice.logprobs)
+    items: Dict[int, Dict[str, Any]] = {}
+    try:
+        lote = ClasificacionLote.model_validate_json(content)
+        # Posición de cada objeto del lote, para medir la confianza de sus campos
+        objects: Dict[int, Tuple[int, int]] = {}
+        for obj in _ITEM_OBJECT.finditer(content):
+            match = _ITEM_ID.search(obj.group())
+            if match:
+                objects[int(match.group(1))] = (obj.start(), obj.end())
+        for item in lote.items:
+            start, end = objects.get(item.id, (0, 0))
+            items[item.id] = _to_result(item, content, spans, start, end)
+    except ValueError as e:  # pydantic.ValidationError es un ValueError
+        logger.warning(f"Respuesta de clasificación por lotes no válida: {str(e)}")
+
+    async def result_for(position: int, text: str) -> Union[Dict[str, Any], Exception]:
+        if position in items:
+            return items[position]
+        try:
+            return await _classify_single(text)
+        except Exception as e:
+            return e
+
+    return list(
+        await asyncio.gather(
+            *(result_for(i, text) for i, text in enumerate(texts, start=1))
+        )
+    )
+
+
+_batcher: MicroBatcher[str, Dict[str, Any]] = MicroBatcher(
+    "classify",
+    _classify_batch,
+    max_batch_size=CLASSIFY_BATCH_MAX_SIZE,
+    max_wait=CLASSIFY_BATCH_WINDOW_MS / 1000,
+)
+
+
+# Clasifica el texto agrupándolo con otros si es corto
+async def _classify(text: str) -> Dict[str, Any]:
+    if CLASSIFY_BATCH_ENABLED and len(text) <= CLASSIFY_BATCH_MAX_CHARS:
+        return await _batcher.submit(text)
+    return await _classify_single(text)
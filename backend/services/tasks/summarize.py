@@ -1,10 +1,14 @@
-from openai import AsyncOpenAI
 import os
+import hashlib
 from services.db import guardar_consulta
-from typing import Dict, Any
+from services.llm_client import get_openai_client, to_api_error
+from typing import Dict, Any, AsyncIterator, List, Tuple
 from core.logging import setup_logger
-from core.cache import cache_response
-from core.retry import with_retry
+from core.cache import cache_response, normalize_text, is_background_refresh
+from core.retry import with_retry, get_circuit_breaker
+from core.rate_limit import acquire_openai_capacity
+from core.tokens import count_tokens, estimate_request_tokens
+from core.chunking import split_text
 from core.errors import (
     OpenAIError,
     MissingParameterError,
@@ -17,18 +21,79 @@ import openai
 # Configure logging
 logger = setup_logger("services.tasks.summarize")
 
-# Initialize AsyncOpenAI client
-client = AsyncOpenAI(
-    api_key=os.getenv("OPENAI_API_KEY"),
-    timeout=float(os.getenv("OPENAI_TIMEOUT", "30.0")),
-    max_retries=0,  # Usamos nuestro propio sistema de reintentos
+# Modelo y versión del prompt: forman parte de la clave de caché
+MODEL = "gpt-4o-mini-2024-07-18"
+PROMPT_VERSION = "1"  # Incrementar al cambiar el prompt para invalidar la caché
+
+# Circuit breaker compartido por todas las llamadas a este modelo y endpoint
+openai_circuit = get_circuit_breaker(f"openai:{MODEL}:chat.completions")
+
+# Resumen por fragmentos (map-reduce) para documentos largos
+SUMMARY_MAP_REDUCE_THRESHOLD = int(os.getenv("SUMMARY_MAP_REDUCE_THRESHOLD", "3000"))  # tokens
+SUMMARY_CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", "2000"))
+SUMMARY_CHUNK_SUMMARY_TOKENS = int(os.getenv("SUMMARY_CHUNK_SUMMARY_TOKENS", "300"))
+SUMMARY_MAP_CONCURRENCY = int(os.getenv("SUMMARY_MAP_CONCURRENCY", "4"))
+
+# Prompts del resumen
+SYSTEM_PROMPT = "Resume el texto de forma clara y concisa y termina siempre en un punto y nunca abruptamente."
+CHUNK_SYSTEM_PROMPT = (
+    "Resume este fragmento de un documento más largo conservando los hechos, nombres "
+    "y cifras importantes. Termina siempre en un punto y nunca abruptamente."
 )
+REDUCE_SYSTEM_PROMPT = (
+    "Los siguientes textos son resúmenes de partes consecutivas de un mismo documento. "
+    "Combínalos en un único resumen claro y conciso del documento completo y termina "
+    "siempre en un punto y nunca abruptamente."
+)
+
+
+# Clave de caché por contenido: el mismo texto comparte resumen entre usuarios
+def _content_cache_key(input: Dict[str, Any], context: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "text": normalize_text(input.get("text", "")),
+        "model": MODEL,
+        "prompt": PROMPT_VERSION,
+    }
+
+
+# Registro del historial para un resumen (también usado por el procesamiento por lotes)
+def history_record(result: Dict[str, Any], input: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "tipo_tarea": "resumir",
+        "texto_original": input.get("text", ""),
+        "resultado": result["summary"],
+        "metadata": {
+            "model": result["model_used"],
+            "original_length": result["original_length"],
+            "summary_length": result["summary_length"],
+        },
+    }
+
+
+# Guarda el resumen en el historial del usuario (también en aciertos de caché)
+async def _save_history(
+    result: Dict[str, Any], input: Dict[str, Any], context: Dict[str, Any]
+) -> None:
+    # Un refresco en segundo plano no es una consulta nueva del usuario, y con
+    # persist=False el llamante guarda el historial por su cuenta
+    if is_background_refresh() or not context.get("persist", True):
+        return
+    user_id = context.get("user_id", "desconocido")
+    try:
+        await guardar_consulta(user_id=user_id, **history_record(result, input))
+        logger.info("Resumen guardado en base de datos")
+    except Exception as e:
+        logger.error(f"Error al guardar en base de datos: {str(e)}")
+        # Continuamos aunque falle la persistencia
 
 
 # Caché de resumen
 @cache_response(
-    ttl=int(os.getenv("SUMMARY_CACHE_TTL", "86400"))
-)  # 24 horas por defecto
+    ttl=int(os.getenv("SUMMARY_CACHE_TTL", "86400")),  # 24 horas por defecto
+    local_max_bytes=int(os.getenv("SUMMARY_LOCAL_CACHE_MAX_BYTES", str(8 * 1024 * 1024))),
+    key_builder=_content_cache_key,
+    on_hit=_save_history,
+)
 async def run(input: Dict[str, Any], context: Dict[str, Any]) -> Dict[str, Any]:
     """
     Summarize text using OpenAI's GPT model asynchronously
@@ -58,38 +123,33 @@ async def run(input: Dict[str, Any], context: Dict[str, Any]) -> Dict[str, Any]:
 
     try:
         logger.info(f"Generando resumen para usuario {user_id}")
-        # Llamar a la función protegida con reintentos
-        response = await call_openai_with_retry(text)
-
-        resumen = response.choices[0].message.content.strip()
+        # Documentos largos: resumen por fragmentos (map-reduce)
+        if count_tokens(text) > SUMMARY_MAP_REDUCE_THRESHOLD:
+            resumen, chunks = await _summarize_long(text)
+        else:
+            # Llamar a la función protegida con reintentos
+            response = await call_openai_with_retry(text)
+            resumen = response.choices[0].message.content.strip()
+            chunks = 1
 
-        # Persistencia en la tabla unificada
-        try:
-            await guardar_consulta(
-                user_id=user_id,
-                tipo_tarea="resumir",
-                texto_original=text,
-                resultado=resumen,
-                metadata={
-                    "model": "gpt-4o-mini-2024-07-18",
-                    "original_length": len(text),
-                    "summary_length": len(resumen),
-                },
-            )
-            logger.info("Resumen guardado en base de datos")
-        except Exception as e:
-            logger.error(f"Error al guardar en base de datos: {str(e)}")
-            # Continuamos aunque falle la persistencia
-
-        return {
+        result = {
             "summary": resumen,
             "original_length": len(text),
             "summary_length": len(resumen),
-            "model_used": "gpt-4o-mini-2024-07-18",
+            "chunks": chunks,
+            "model_used": MODEL,
             "cached": False,
         }
 
+        # Persistencia en la tabla unificada
+        await _save_history(result, input, context)
+
+        return result
+
     # Manejo de excepciones
+    except OpenAIError:
+        # Rechazos del limitador o del circuit breaker: ya son errores de la API
+        raise
     except asyncio.TimeoutError as e:
         logger.error(f"Timeout al conectar con OpenAI: {str(e)}")
         timeout_value = float(os.getenv("OPENAI_TIMEOUT", "30.0"))
@@ -107,31 +167,157 @@ async def run(input: Dict[str, Any], context: Dict[str, Any]) -> Dict[str, Any]:
         raise OpenAIError(message=f"Error al generar resumen: {str(e)}")
 
 
+async def run_stream(input: Dict[str, Any], context: Dict[str, Any]) -> AsyncIterator[str]:
+    """
+    Resume el texto enviando el resumen por partes a medida que lo genera OpenAI
+
+    Al terminar guarda el resultado en la caché de `run` y en el historial.
+
+    Args:
+        input: Dictionary containing the text to summarize
+        context: Dictionary containing user context information
+
+    Yields:
+        str: Partes del resumen
+
+    Raises:
+        MissingParameterError: If text is empty
+        OpenAIError: For OpenAI API related errors
+    """
+    text = input.get("text", "")
+    user_id = context.get("user_id", "desconocido")
+
+    if not text.strip():
+        raise MissingParameterError("text")
+
+    if not os.getenv("OPENAI_API_KEY"):
+        raise OpenAIError(message="API key de OpenAI no configurada")
+
+    cached = await run.cache_get(input, context)
+    if cached is not None:
+        await _save_history(cached, input, context)
+        yield cached["summary"]
+        return
+
+    # Los documentos largos se resumen por fragmentos: se envía el resumen completo
+    if count_tokens(text) > SUMMARY_MAP_REDUCE_THRESHOLD:
+        yield (await run(input, context))["summary"]
+        return
+
+    logger.info(f"Generando resumen en streaming para usuario {user_id}")
+    parts: List[str] = []
+    try:
+        response = await call_openai_with_retry(text, stream=True)
+        async for chunk in response:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                parts.append(delta)
+                yield delta
+    except Exception as e:
+        raise to_api_error(e, "generar resumen")
+
+    resumen = "".join(parts).strip()
+    result = {
+        "summary": resumen,
+        "original_length": len(text),
+        "summary_length": len(resumen),
+        "chunks": 1,
+        "model_used": MODEL,
+        "cached": False,
+    }
+    await run.cache_set(result, input, context)
+    await _save_history(result, input, context)
+
+
 @with_retry
-async def call_openai_with_retry(text: str):
+async def call_openai_with_retry(
+    text: str, system_prompt: str = SYSTEM_PROMPT, max_tokens: int = 200, stream: bool = False
+):
     """
     Función protegida con reintentos para llamar a la API de OpenAI
 
+    Con stream=True los reintentos cubren sólo el inicio de la respuesta.
+
     Args:
         text: Texto a resumir
+        system_prompt: Instrucciones del resumen (texto completo, fragmento o combinación)
+        max_tokens: Máximo de tokens del resumen
+        stream: Devuelve la respuesta por partes según se genera
 
     Returns:
-        Respuesta de OpenAI
+        Respuesta de OpenAI (o el stream de partes)
     """
     logger.debug("Llamando a OpenAI API para resumir texto...")
 
-    response = await client.chat.completions.create(
-        model="gpt-4o-mini-2024-07-18",
-        messages=[
-            {
-                "role": "system",
-                "content": "Resume el texto de forma clara y concisa y termina siempre en un punto y nunca abruptamente.",
-            },
-            {"role": "user", "content": text},
-        ],
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": text},
+    ]
+
+    # Esperar capacidad en el limitador de RPM/TPM antes de llamar
+    await acquire_openai_capacity(estimate_request_tokens(messages, max_tokens))
+
+    response = await openai_circuit.call(
+        get_openai_client().chat.completions.create,
+        model=MODEL,
+        messages=messages,
         temperature=0.3,
-        max_tokens=200,
+        max_tokens=max_tokens,
+        stream=stream,
     )
 
     logger.debug("Respuesta recibida de OpenAI API")
     return response
+
+
+# Clave de caché de un fragmento: hash de su contenido normalizado
+def _chunk_cache_key(chunk: str) -> Dict[str, Any]:
+    return {
+        "chunk": hashlib.sha256(normalize_text(chunk).encode("utf-8")).hexdigest(),
+        "model": MODEL,
+        "prompt": PROMPT_VERSION,
+    }
+
+
+# Resumen de un fragmento, cacheado por contenido: al reenviar un documento editado
+# sólo se vuelven a resumir los fragmentos que han cambiado
+@cache_response(
+    ttl=int(os.getenv("SUMMARY_CHUNK_CACHE_TTL", "604800")),  # 7 días por defecto
+    namespace="summarize.chunk",
+    key_builder=_chunk_cache_key,
+)
+async def _summarize_chunk(chunk: str) -> str:
+    response = await call_openai_with_retry(
+        chunk, system_prompt=CHUNK_SYSTEM_PROMPT, max_tokens=SUMMARY_CHUNK_SUMMARY_TOKENS
+    )
+    return response.choices[0].message.content.strip()
+
+
+# Resume varios fragmentos en paralelo con concurrencia limitada
+async def _summarize_chunks(chunks: List[str]) -> List[str]:
+    semaphore = asyncio.Semaphore(SUMMARY_MAP_CONCURRENCY)
+
+    async def summarize_one(chunk: str) -> str:
+        async with semaphore:
+            return await _summarize_chunk(chunk)
+
+    return list(await asyncio.gather(*(summarize_one(chunk) for chunk in chunks)))
+
+
+# Resume un documento largo: fragmentos (map), resúmenes de resúmenes si no caben
+# juntos y un resumen final (reduce)
+async def _summarize_long(text: str) -> Tuple[str, int]:
+    chunks = split_text(text, SUMMARY_CHUNK_TOKENS)
+    logger.info(f"Resumen por fragmentos: {len(chunks)} fragmentos")
+    summaries = await _summarize_chunks(chunks)
+
+    combined = "\n\n".join(summaries)
+    while count_tokens(combined) > SUMMARY_CHUNK_TOKENS and len(summaries) > 1:
+        groups = split_text(combined, SUMMARY_CHUNK_TOKENS)
+        if len(groups) >= len(summaries):
+            break  # No se reduce más: se combina lo que hay
+        summaries = await _summarize_chunks(groups)
+        combined = "\n\n".join(summaries)
+
+    response = await call_openai_with_retry(combined, system_prompt=REDUCE_SYSTEM_PROMPT)
+    return response.choices[0].message.content.strip(), len(chunks)
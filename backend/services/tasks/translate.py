@@ -1,13 +1,19 @@
-from openai import AsyncOpenAI
 import os
+import re
 import logging
 import asyncio
+import hashlib
 import openai
 from services.db import guardar_consulta
-from typing import Dict, Any
+from services.llm_client import get_openai_client, to_api_error
+from typing import Dict, Any, AsyncIterator, List, Tuple
 from core.logging import setup_logger
-from core.cache import cache_response
-from core.retry import with_retry
+from core.cache import cache_response, normalize_text, is_background_refresh
+from core.retry import with_retry, get_circuit_breaker
+from core.rate_limit import acquire_openai_capacity
+from core.chunking import split_text
+from core.language import detect_language as detect_text_language
+from core.tokens import count_tokens, estimate_request_tokens
 from core.errors import (
     OpenAIError,
     MissingParameterError,
@@ -18,18 +24,86 @@ from core.errors import (
 # Configure logging
 logger = setup_logger("services.tasks.translate")
 
-# Initialize AsyncOpenAI client
-client = AsyncOpenAI(
-    api_key=os.getenv("OPENAI_API_KEY"),
-    timeout=float(os.getenv("OPENAI_TIMEOUT", "30.0")),
-    max_retries=0,  # Usamos nuestro propio sistema de reintentos
-)
+# Modelo y versión del prompt: forman parte de la clave de caché
+MODEL = "gpt-4o-mini-2024-07-18"
+PROMPT_VERSION = "2"  # Incrementar al cambiar el prompt para invalidar la caché
+
+# Circuit breaker compartido por todas las llamadas a este modelo y endpoint
+openai_circuit = get_circuit_breaker(f"openai:{MODEL}:chat.completions")
+
+# Nombres de los idiomas detectables para el prompt
+LANGUAGE_NAMES_ES = {
+    "es": "español", "en": "inglés", "pt": "portugués", "fr": "francés", "it": "italiano", "de": "alemán"
+}
+LANGUAGE_NAMES_EN = {
+    "es": "Spanish", "en": "English", "pt": "Portuguese", "fr": "French", "it": "Italian", "de": "German"
+}
+
+# Traducción por segmentos de textos largos
+TRANSLATION_SEGMENT_TOKENS = int(os.getenv("TRANSLATION_SEGMENT_TOKENS", "800"))
+TRANSLATION_CONCURRENCY = int(os.getenv("TRANSLATION_CONCURRENCY", "4"))
+# La salida se dimensiona según la entrada: el texto traducido ocupa más o menos lo mismo
+TRANSLATION_MIN_OUTPUT_TOKENS = 300
+TRANSLATION_MAX_OUTPUT_TOKENS = int(os.getenv("TRANSLATION_MAX_OUTPUT_TOKENS", "4096"))
+
+# Separadores que se conservan tal cual al reensamblar la traducción
+_PARAGRAPH_BREAK = re.compile(r"(\n\s*\n)")
+_LINE_BREAK = re.compile(r"(\n)")
+_SURROUNDING_SPACE = re.compile(r"^(\s*)(.*?)(\s*)$", re.DOTALL)
+
+
+# Clave de caché por contenido: el mismo texto e idioma comparten traducción
+def _content_cache_key(input: Dict[str, Any], context: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "text": normalize_text(input.get("text", "")),
+        "lang": input.get("lang", "en"),
+        "model": MODEL,
+        "prompt": PROMPT_VERSION,
+    }
+
+
+# Registro del historial para una traducción (también usado por el procesamiento por lotes)
+def history_record(result: Dict[str, Any], input: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "tipo_tarea": "traducir",
+        "texto_original": input.get("text", ""),
+        "resultado": result["translation"],
+        "metadata": {
+            "idioma": result["target_language"],
+            "idioma_origen": result["source_language"],
+            "model": result["model_used"],
+        },
+    }
+
+
+# Guarda la traducción en el historial del usuario (también en aciertos de caché)
+async def _save_history(
+    result: Dict[str, Any], input: Dict[str, Any], context: Dict[str, Any]
+) -> None:
+    # Un refresco en segundo plano no es una consulta nueva del usuario, y con
+    # persist=False el llamante guarda el historial por su cuenta
+    if is_background_refresh() or not context.get("persist", True):
+        return
+    user_id = context.get("user_id", "desconocido")
+    source_lang = result["source_language"]
+    target_lang = result["target_language"]
+    try:
+        await guardar_consulta(user_id=user_id, **history_record(result, input))
+        logger.info(
+            f"Traducción guardada en base de datos ({source_lang} -> {target_lang})"
+        )
+    except Exception as e:
+        logger.error(f"Error al guardar traducción en base de datos: {str(e)}")
+        # Continuamos aunque falle la persistencia
 
 
 # Caché de traducción
 @cache_response(
-    ttl=int(os.getenv("TRANSLATION_CACHE_TTL", "86400"))
-)  # 24 horas por defecto
+    ttl=int(os.getenv("TRANSLATION_CACHE_TTL", "86400")),  # 24 horas por defecto
+    local_max_bytes=int(os.getenv("TRANSLATION_LOCAL_CACHE_MAX_BYTES", str(8 * 1024 * 1024))),
+    key_builder=_content_cache_key,
+    on_hit=_save_history,
+)
 async def run(input: Dict[str, Any], context: Dict[str, Any]) -> Dict[str, Any]:
     """
     Translate text using OpenAI's GPT model asynchronously
@@ -61,48 +135,35 @@ async def run(input: Dict[str, Any], context: Dict[str, Any]) -> Dict[str, Any]:
     try:
         logger.info(f"Traduciendo texto para usuario {user_id}")
 
-        # Detectar idioma origen (simplificado)
-        source_lang = detect_language(text)
+        source_lang, target_lang = _resolve_languages(text, lang)
 
-        # Determinar idioma destino (si el origen es español, traducir a inglés y viceversa)
-        target_lang = "en" if source_lang == "es" else "es"
-        if lang and lang != source_lang:
-            target_lang = lang
+        if count_tokens(text) > TRANSLATION_SEGMENT_TOKENS:
+            # Textos largos: segmentos traducidos en paralelo y reensamblados en orden
+            traduccion = "".join(
+                [part async for part in _translate_segments(text, source_lang, target_lang)]
+            ).strip()
+        else:
+            # Llamar a OpenAI con retry
+            response = await call_openai_with_retry(text, source_lang, target_lang)
+            traduccion = response.choices[0].message.content.strip()
 
-        # Llamar a OpenAI con retry
-        response = await call_openai_with_retry(text, source_lang, target_lang)
-
-        traduccion = response.choices[0].message.content.strip()
-
-        # Guardar en BD unificada
-        try:
-            await guardar_consulta(
-                user_id=user_id,
-                tipo_tarea="traducir",
-                texto_original=text,
-                resultado=traduccion,
-                metadata={
-                    "idioma": target_lang,
-                    "idioma_origen": source_lang,
-                    "model": "gpt-4o-mini-2024-07-18",
-                },
-            )
-            logger.info(
-                f"Traducción guardada en base de datos ({source_lang} -> {target_lang})"
-            )
-        except Exception as e:
-            logger.error(f"Error al guardar traducción en base de datos: {str(e)}")
-            # Continuamos aunque falle la persistencia
-
-        return {
+        result = {
             "translation": traduccion,
             "source_language": source_lang,
             "target_language": target_lang,
-            "model_used": "gpt-4o-mini-2024-07-18",
+            "model_used": MODEL,
             "cached": False,
         }
 
+        # Guardar en BD unificada
+        await _save_history(result, input, context)
+
+        return result
+
     # Manejo de excepciones
+    except OpenAIError:
+        # Rechazos del limitador o del circuit breaker: ya son errores de la API
+        raise
     except asyncio.TimeoutError as e:
         logger.error(f"Timeout al conectar con OpenAI: {str(e)}")
         timeout_value = float(os.getenv("OPENAI_TIMEOUT", "30.0"))
@@ -120,68 +181,235 @@ async def run(input: Dict[str, Any], context: Dict[str, Any]) -> Dict[str, Any]:
         raise OpenAIError(message=f"Error al traducir texto: {str(e)}")
 
 
-# Detecta el idioma del texto (implementación simplificada)
+async def run_stream(input: Dict[str, Any], context: Dict[str, Any]) -> AsyncIterator[str]:
+    """
+    Traduce el texto enviando la traducción por partes a medida que la genera OpenAI
+
+    Al terminar guarda el resultado en la caché de `run` y en el historial.
+
+    Args:
+        input: Dictionary containing the text to translate and target language
+        context: Dictionary containing user context information
+
+    Yields:
+        str: Partes de la traducción
+
+    Raises:
+        MissingParameterError: If text is empty
+        OpenAIError: For OpenAI API related errors
+    """
+    text = input.get("text", "")
+    user_id = context.get("user_id", "desconocido")
+
+    if not text.strip():
+        raise MissingParameterError("text")
+
+    if not os.getenv("OPENAI_API_KEY"):
+        raise OpenAIError(message="API key de OpenAI no configurada")
+
+    cached = await run.cache_get(input, context)
+    if cached is not None:
+        await _save_history(cached, input, context)
+        yield cached["translation"]
+        return
+
+    logger.info(f"Traduciendo texto en streaming para usuario {user_id}")
+    source_lang, target_lang = _resolve_languages(text, input.get("lang", "en"))
+    parts: List[str] = []
+    try:
+        if count_tokens(text) > TRANSLATION_SEGMENT_TOKENS:
+            # Textos largos: se envía cada segmento en orden según está listo
+            async for part in _translate_segments(text, source_lang, target_lang):
+                parts.append(part)
+                yield part
+        else:
+            response = await call_openai_with_retry(text, source_lang, target_lang, stream=True)
+            async for chunk in response:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    yield delta
+    except Exception as e:
+        raise to_api_error(e, "traducir texto")
+
+    result = {
+        "translation": "".join(parts).strip(),
+        "source_language": source_lang,
+        "target_language": target_lang,
+        "model_used": MODEL,
+        "cached": False,
+    }
+    await run.cache_set(result, input, context)
+    await _save_history(result, input, context)
+
+
+# Determina los idiomas origen y destino de la traducción
+def _resolve_languages(text: str, lang: str) -> Tuple[str, str]:
+    # Detectar idioma origen
+    source_lang = detect_language(text)
+
+    # Determinar idioma destino (si el origen es español, traducir a inglés y viceversa)
+    target_lang = "en" if source_lang == "es" else "es"
+    if lang and lang != source_lang:
+        target_lang = lang
+    return source_lang, target_lang
+
+
+# Detecta el idioma del texto
 def detect_language(text: str) -> str:
     """
-    Detecta el idioma del texto (implementación simplificada)
+    Detecta el idioma del texto con perfiles de trigramas locales (ver core.language)
 
     Args:
         text: Texto a analizar
 
     Returns:
-        str: Código de idioma detectado ('es' o 'en')
+        str: Código de idioma detectado ('es', 'en', 'pt', 'fr', 'it' o 'de'); 'en' si
+            el texto es demasiado corto para decidir
     """
-    # Implementación básica que asume que los textos con más caracteres
-    # españoles que ingleses están en español
-    spanish_chars = set("áéíóúüñ¿¡")
-    english_specific = set("wk")
-    # Contar caracteres específicos de español y inglés
-    spanish_count = sum(1 for c in text.lower() if c in spanish_chars)
-    english_count = sum(1 for c in text.lower() if c in english_specific)
-
-    # Si tiene caracteres específicos de español, asumimos español
-    if spanish_count > 0:
-        return "es"
-    # Si tiene muchos caracteres específicos de inglés, asumimos inglés
-    elif english_count > 1:
-        return "en"
-    # Por defecto, asumimos inglés (la mayoría de los textos)
-    else:
-        return "en"
+    return detect_text_language(text, default="en")
+
+
+# Construye el prompt de sistema para un par de idiomas
+def _system_prompt(source_lang: str, target_lang: str) -> str:
+    if target_lang == "es":
+        source = LANGUAGE_NAMES_ES.get(source_lang, "idioma original")
+        return f"Traduce el siguiente texto del {source} al español, manteniendo el tono y formato original."
+    source = LANGUAGE_NAMES_EN.get(source_lang, "original language")
+    target = LANGUAGE_NAMES_EN.get(target_lang, target_lang)
+    return f"Translate the following text from {source} to {target}, maintaining the original tone and format."
 
 
 @with_retry
-async def call_openai_with_retry(text: str, source_lang: str, target_lang: str):
+async def call_openai_with_retry(
+    text: str, source_lang: str, target_lang: str, stream: bool = False
+):
     """
     Función protegida con reintentos para llamar a la API de OpenAI
 
+    Con stream=True los reintentos cubren sólo el inicio de la respuesta.
+
     Args:
         text: Texto a traducir
         source_lang: Idioma origen
         target_lang: Idioma destino
+        stream: Devuelve la respuesta por partes según se genera
 
     Returns:
-        Respuesta de OpenAI
+        Respuesta de OpenAI (o el stream de partes)
     """
     logger.debug(
         f"Llamando a OpenAI API para traducir texto de {source_lang} a {target_lang}..."
     )
 
-    # Construir el prompt según el idioma destino
-    if target_lang == "es":
-        system_prompt = "Traduce el siguiente texto del inglés al español, manteniendo el tono y formato original."
-    else:
-        system_prompt = "Translate the following text from Spanish to English, maintaining the original tone and format."
-
-    response = await client.chat.completions.create(
-        model="gpt-4o-mini-2024-07-18",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": text},
-        ],
+    messages = [
+        {"role": "system", "content": _system_prompt(source_lang, target_lang)},
+        {"role": "user", "content": text},
+    ]
+    max_tokens = min(
+        max(TRANSLATION_MIN_OUTPUT_TOKENS, 2 * count_tokens(text)), TRANSLATION_MAX_OUTPUT_TOKENS
+    )
+
+    # Esperar capacidad en el limitador de RPM/TPM antes de llamar
+    await acquire_openai_capacity(estimate_request_tokens(messages, max_tokens))
+
+    response = await openai_circuit.call(
+        get_openai_client().chat.completions.create,
+        model=MODEL,
+        messages=messages,
         temperature=0.3,
-        max_tokens=300,
+        max_tokens=max_tokens,
+        stream=stream,
     )
 
     logger.debug("Respuesta recibida de OpenAI API")
     return response
+
+
+# Clave de caché de un segmento: se reutiliza entre documentos (p. ej. textos legales repetidos)
+def _segment_cache_key(segment: str, source_lang: str, target_lang: str) -> Dict[str, Any]:
+    return {
+        "segment": hashlib.sha256(normalize_text(segment).encode("utf-8")).hexdigest(),
+        "source": source_lang,
+        "target": target_lang,
+        "model": MODEL,
+        "prompt": PROMPT_VERSION,
+    }
+
+
+# Traduce un segmento de un texto largo
+@cache_response(
+    ttl=int(os.getenv("TRANSLATION_SEGMENT_CACHE_TTL", "604800")),  # 7 días por defecto
+    namespace="translate.segment",
+    key_builder=_segment_cache_key,
+)
+async def _translate_segment(segment: str, source_lang: str, target_lang: str) -> str:
+    response = await call_openai_with_retry(segment, source_lang, target_lang)
+    return response.choices[0].message.content.strip()
+
+
+# Divide el texto en partes (texto, traducir): los separadores y espacios se conservan sin traducir
+def split_segments(text: str) -> List[Tuple[str, bool]]:
+    """
+    Divide un texto en segmentos traducibles separados por párrafos
+
+    Un párrafo que supera TRANSLATION_SEGMENT_TOKENS se divide por líneas y, si una
+    línea sigue sin caber, por frases. Concatenar todas las partes devuelve el texto
+    original.
+
+    Args:
+        text: Texto a dividir
+
+    Returns:
+        List[Tuple[str, bool]]: Partes en orden e indicación de si se traducen
+    """
+    pieces: List[Tuple[str, bool]] = []
+    for i, block in enumerate(_PARAGRAPH_BREAK.split(text)):
+        if i % 2:  # Separador entre párrafos
+            pieces.append((block, False))
+            continue
+        before, paragraph, after = _SURROUNDING_SPACE.match(block).groups()
+        if before:
+            pieces.append((before, False))
+        if paragraph and count_tokens(paragraph) <= TRANSLATION_SEGMENT_TOKENS:
+            pieces.append((paragraph, True))
+        elif paragraph:
+            for j, line in enumerate(_LINE_BREAK.split(paragraph)):
+                if j % 2 or not line.strip():
+                    pieces.append((line, False))
+                    continue
+                for k, part in enumerate(split_text(line, TRANSLATION_SEGMENT_TOKENS)):
+                    if k:
+                        pieces.append((" ", False))
+                    pieces.append((part, True))
+        if after:
+            pieces.append((after, False))
+    return pieces
+
+
+# Traduce los segmentos en paralelo (con límite) y los devuelve en el orden original
+async def _translate_segments(
+    text: str, source_lang: str, target_lang: str
+) -> AsyncIterator[str]:
+    pieces = split_segments(text)
+    semaphore = asyncio.Semaphore(TRANSLATION_CONCURRENCY)
+
+    async def translate_one(segment: str) -> str:
+        async with semaphore:
+            return await _translate_segment(segment, source_lang, target_lang)
+
+    # Los segmentos repetidos dentro del documento se traducen una sola vez
+    tasks: Dict[str, asyncio.Future] = {}
+    for piece, translatable in pieces:
+        if translatable and piece not in tasks:
+            tasks[piece] = asyncio.ensure_future(translate_one(piece))
+    logger.info(f"Traducción por segmentos: {len(tasks)} segmentos distintos")
+
+    try:
+        for piece, translatable in pieces:
+            yield (await tasks[piece]) if translatable else piece
+    finally:
+        for task in tasks.values():
+            task.cancel()
+        # Recoge los errores de los demás segmentos (evita "Task exception was never retrieved")
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
@@ -0,0 +1,63 @@
+import pytest
+from unittest.mock import AsyncMock, patch
+
+from api import workflow_endpoints
+from api.schemas import ProcesarBatchRequest, ProcesarRequest
+
+
+@pytest.mark.asyncio
+async def test_batch_dedups_texts_and_bulk_inserts():
+    summarize_run = AsyncMock(
+        return_value={
+            "summary": "resumen",
+            "original_length": 5,
+            "summary_length": 7,
+            "model_used": "test",
+        }
+    )
+    request = ProcesarBatchRequest(
+        items=[
+            ProcesarRequest(chat_id=1, texto="Hola  mundo", tipo_tarea="resumir"),
+            ProcesarRequest(chat_id=2, texto="Hola mundo", tipo_tarea="resumir"),
+            ProcesarRequest(chat_id=3, texto="   ", tipo_tarea="resumir"),
+            ProcesarRequest(chat_id=4, texto="texto", tipo_tarea="desconocida"),
+        ]
+    )
+
+    with patch.object(workflow_endpoints.summarize, "run", summarize_run), patch.object(
+        workflow_endpoints, "guardar_consultas", AsyncMock(return_value=2)
+    ) as guardar, patch.object(workflow_endpoints, "obtener_modo_usuario", AsyncMock()):
+        response = await workflow_endpoints.procesar_lote(request)
+
+    assert summarize_run.await_count == 1
+    assert summarize_run.await_args[0][1]["persist"] is False
+    assert [r.success for r in response.resultados] == [True, True, False, False]
+    assert response.resultados[1].resultado == "resumen"
+    assert response.resultados[3].error["code"] == "E202"
+
+    registros = guardar.await_args[0][0]
+    assert [(r["user_id"], r["texto_original"]) for r in registros] == [
+        ("1", "Hola  mundo"),
+        ("2", "Hola mundo"),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_procesar_consumes_mode_and_restores_it_on_failure():
+    request = ProcesarRequest(chat_id=5, texto="Hola mundo")
+    consumir = AsyncMock(return_value="/resumir")
+    with patch.object(workflow_endpoints, "consumir_modo_usuario", consumir), patch.object(
+        workflow_endpoints, "limpiar_modo_usuario", AsyncMock()
+    ) as limpiar, patch.object(
+        workflow_endpoints, "establecer_modo_usuario", AsyncMock()
+    ) as establecer, patch.object(
+        workflow_endpoints.summarize, "run", AsyncMock(return_value={"summary": "resumen"})
+    ) as run:
+        response = await workflow_endpoints.procesar_texto(request)
+        assert response.tipo_tarea == "resumir"
+        limpiar.assert_not_awaited()  # Ya se limpió al leerlo
+
+        run.side_effect = RuntimeError("fallo")
+        with pytest.raises(Exception):
+            await workflow_endpoints.procesar_texto(request)
+        establecer.assert_awaited_once_with(5, "/resumir")
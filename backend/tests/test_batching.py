@@ -0,0 +1,101 @@
+import asyncio
+import json
+import pytest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+from core.batching import MicroBatcher
+from core.retry import deadline_scope, remaining_time
+from services.tasks import classify
+
+
+@pytest.mark.asyncio
+async def test_micro_batcher_groups_concurrent_items():
+    batches = []
+
+    async def process(items):
+        batches.append(items)
+        return [ValueError(item) if item == "mal" else item.upper() for item in items]
+
+    batcher = MicroBatcher("test", process, max_batch_size=3, max_wait=0.01)
+    results = await asyncio.gather(
+        *(batcher.submit(item) for item in ["a", "b", "c", "d", "mal"]),
+        return_exceptions=True,
+    )
+
+    assert batches == [["a", "b", "c"], ["d", "mal"]]
+    assert results[:4] == ["A", "B", "C", "D"]
+    assert isinstance(results[4], ValueError)
+
+
+@pytest.mark.asyncio
+async def test_micro_batcher_ignores_the_deadline_of_the_caller_that_filled_it():
+    seen = []
+
+    async def process(items):
+        seen.append(remaining_time())
+        await asyncio.sleep(0.05)
+        return [item.upper() for item in items]
+
+    batcher = MicroBatcher("test", process, max_batch_size=2, max_wait=1)
+
+    async def impatient():
+        with deadline_scope(0.01):
+            return await batcher.submit("a")
+
+    # El segundo llamante completa el lote con un presupuesto de 10 ms
+    results = await asyncio.gather(batcher.submit("b"), impatient(), return_exceptions=True)
+
+    assert seen == [None]  # El lote no hereda el presupuesto de quien lo completó
+    assert results[0] == "B"
+    assert isinstance(results[1], asyncio.TimeoutError)
+
+
+def logprob_tokens(content, logprob=-0.01):
+    # Un token por carácter, todos con la misma logprob
+    return SimpleNamespace(content=[SimpleNamespace(token=c, logprob=logprob) for c in content])
+
+
+def completion(content, logprobs=None):
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=content), logprobs=logprobs)]
+    )
+
+
+def test_parse_classification_uses_logprobs():
+    content = json.dumps({"categoria": "queja", "urgencia": "alta", "tema": "IT"})
+    result = classify.parse_classification(content, logprob_tokens(content))
+
+    assert result["category"] == "queja"
+    assert result["urgency"] == "high"
+    assert result["theme"] == "it"
+    # "queja" son 5 tokens de -0.01: la confianza es la del campo más largo
+    assert result["field_confidence"]["categoria"] == pytest.approx(0.9512, abs=1e-4)
+    assert result["confidence"] == min(result["field_confidence"].values())
+    assert classify.parse_classification(content)["confidence"] is None
+
+    with pytest.raises(ValueError):
+        classify.parse_classification('{"categoria": "spam", "urgencia": "alta", "tema": "IT"}')
+
+
+@pytest.mark.asyncio
+async def test_classify_batch_fans_out_and_falls_back():
+    content = json.dumps(
+        {"items": [{"id": 1, "categoria": "queja", "urgencia": "alta", "tema": "IT"}]}
+    )
+    batch_response = completion(content, logprob_tokens(content))
+    single_content = json.dumps({"categoria": "otro", "urgencia": "baja", "tema": "otro"})
+    single = AsyncMock(return_value=completion(single_content))
+
+    with patch.object(
+        classify, "call_openai_batch_with_retry", AsyncMock(return_value=batch_response)
+    ), patch.object(classify, "call_openai_with_retry", single):
+        results = await classify._classify_batch(["uno", "dos"])
+
+    assert results[0]["category"] == "queja"
+    assert results[0]["urgency"] == "high"
+    assert 0 < results[0]["confidence"] < 1
+    assert classify.format_classification(results[0]) == "Categoría: queja\nUrgencia: alta\nTema: it"
+    # El segundo texto no venía en la respuesta: se clasifica por separado
+    assert results[1]["category"] == "otro"
+    single.assert_awaited_once_with("dos")
@@ -0,0 +1,241 @@
+import asyncio
+import json
+import time
+import pytest
+from unittest.mock import patch
+
+from core import cache
+from core.cache import (
+    LocalCache,
+    cache_response,
+    generate_cache_key,
+    get_cache_stats,
+    normalize_text,
+    _freshness,
+)
+from core.singleflight import SingleFlight
+from core.retry import deadline_scope, remaining_time
+from core.serializers import default_codec
+
+
+class FakeAsyncRedis:
+    """Redis asíncrono en memoria para los tests de caché"""
+
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        value = self.data.get(key)
+        if value is None:
+            return None
+        payload, expires_at = value
+        return payload if expires_at > time.time() else None
+
+    async def setex(self, key, ttl, payload):
+        self.data[key] = (payload, time.time() + ttl)
+
+    async def set(self, key, payload, nx=False, px=None):
+        if nx and await self.get(key) is not None:
+            return None
+        self.data[key] = (payload, time.time() + (px or 0) / 1000)
+        return True
+
+    async def exists(self, key):
+        return int(await self.get(key) is not None)
+
+    async def eval(self, script, numkeys, key, token):
+        if await self.get(key) == token:
+            del self.data[key]
+            return 1
+        return 0
+
+    async def ping(self):
+        return True
+
+
+@pytest.fixture
+def fake_redis():
+    fake = FakeAsyncRedis()
+    with patch("core.cache.get_async_redis", return_value=fake):
+        yield fake
+
+
+# La caché local expulsa por tamaño en bytes (LRU)
+def test_local_cache_evicts_by_bytes():
+    local = LocalCache(max_bytes=100, ttl=60, max_item_bytes=100)
+    local.set("a", {"v": 1}, 40)
+    local.set("b", {"v": 2}, 40)
+    assert local.get("a") == {"v": 1}  # 'a' pasa a ser el más reciente
+    local.set("c", {"v": 3}, 40)
+    assert local.get("b") is None
+    assert local.get("a") == {"v": 1}
+    assert local.stats()["bytes"] == 80
+
+
+def test_local_cache_skips_large_items():
+    local = LocalCache(max_bytes=1000, ttl=60, max_item_bytes=10)
+    local.set("big", {"v": "x" * 50}, 50)
+    assert local.get("big") is None
+
+
+# Los aciertos repetidos se sirven desde memoria sin ir a Redis
+@pytest.mark.asyncio
+async def test_two_tier_cache_serves_from_memory(fake_redis):
+    calls = []
+
+    @cache_response(ttl=60, namespace="test.two_tier")
+    async def task(input, context):
+        calls.append(input)
+        return {"result": input["text"].upper()}
+
+    first = await task({"text": "hola"}, {"user_id": "1"})
+    second = await task({"text": "hola"}, {"user_id": "1"})
+
+    assert first == second == {"result": "HOLA"}
+    assert len(calls) == 1
+    stats = get_cache_stats()["test.two_tier"]
+    assert stats["local_hits"] == 1
+    assert stats["redis_hits"] == 0
+
+
+# Un proceso sin la entrada en memoria la recupera de Redis y la promociona
+@pytest.mark.asyncio
+async def test_two_tier_cache_promotes_redis_hits(fake_redis):
+    @cache_response(ttl=60, namespace="test.promote")
+    async def task(input, context):
+        return {"result": input["text"]}
+
+    await task({"text": "hola"}, {"user_id": "1"})
+    cache._local_caches["test.promote"].clear()
+
+    await task({"text": "hola"}, {"user_id": "1"})
+    await task({"text": "hola"}, {"user_id": "1"})
+
+    stats = get_cache_stats()["test.promote"]
+    assert stats["redis_hits"] == 1
+    assert stats["local_hits"] == 1
+
+
+# Las llamadas concurrentes idénticas comparten una única ejecución
+@pytest.mark.asyncio
+async def test_concurrent_misses_are_coalesced(fake_redis):
+    calls = []
+
+    @cache_response(ttl=60, namespace="test.single_flight")
+    async def task(input, context):
+        calls.append(input)
+        await asyncio.sleep(0.05)
+        return {"result": input["text"]}
+
+    with patch("core.cache.SINGLE_FLIGHT_DISTRIBUTED", False):
+        results = await asyncio.gather(
+            *[task({"text": "viral"}, {"user_id": "1"}) for _ in range(5)]
+        )
+
+    assert all(r == {"result": "viral"} for r in results)
+    assert len(calls) == 1
+    assert get_cache_stats()["test.single_flight"]["coalesced"] == 4
+
+
+# Los errores se propagan a todas las llamadas agrupadas
+@pytest.mark.asyncio
+async def test_single_flight_propagates_errors():
+    flights = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("fallo")
+
+    results = await asyncio.gather(
+        flights.do("k", fail), flights.do("k", fail), return_exceptions=True
+    )
+
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert "k" not in flights
+
+
+# La ejecución compartida no hereda el presupuesto del líder; cada llamante usa el suyo
+@pytest.mark.asyncio
+async def test_single_flight_runs_outside_the_leader_deadline():
+    flights = SingleFlight()
+    seen = []
+
+    async def slow():
+        seen.append(remaining_time())
+        await asyncio.sleep(0.05)
+        return "ok"
+
+    async def leader():
+        with deadline_scope(0.01):
+            return await flights.do("k", slow)
+
+    results = await asyncio.gather(leader(), flights.do("k", slow), return_exceptions=True)
+
+    assert seen == [None]
+    assert isinstance(results[0], asyncio.TimeoutError)
+    assert results[1] == "ok"
+
+
+# Con clave por contenido, otro usuario reutiliza el resultado y ejecuta on_hit
+@pytest.mark.asyncio
+async def test_content_key_shares_result_and_runs_on_hit(fake_redis):
+    calls = []
+    hits = []
+
+    async def on_hit(result, input, context):
+        hits.append(context["user_id"])
+
+    @cache_response(
+        ttl=60,
+        namespace="test.content_key",
+        key_builder=lambda input, context: {"text": normalize_text(input["text"])},
+        on_hit=on_hit,
+    )
+    async def task(input, context):
+        calls.append(context["user_id"])
+        return {"result": input["text"].strip()}
+
+    await task({"text": "Mismo  texto"}, {"user_id": "1"})
+    await task({"text": "Mismo texto "}, {"user_id": "2"})
+
+    assert calls == ["1"]
+    assert hits == ["2"]
+
+
+def test_normalize_text_keeps_line_breaks():
+    assert normalize_text("  Hola\r\n  mundo \t cruel ") == "Hola\nmundo cruel"
+
+
+# Una entrada caducada hace poco se sirve y se refresca en segundo plano
+@pytest.mark.asyncio
+async def test_stale_entry_is_served_while_revalidating(fake_redis):
+    calls = []
+
+    @cache_response(
+        ttl=60, stale_ttl=60, early_refresh_beta=0, namespace="test.swr", local_max_bytes=0
+    )
+    async def task(input, context):
+        calls.append(input)
+        return {"result": "nuevo"}
+
+    key = generate_cache_key("test.swr", {"text": "hola"}, {"user_id": "1"})
+    stale = {"_e": 1, "v": {"result": "viejo"}, "t": time.time() - 90, "d": 0.5}
+    await fake_redis.setex(key, 120, json.dumps(stale))
+
+    with patch("core.cache.SINGLE_FLIGHT_DISTRIBUTED", False):
+        result = await task({"text": "hola"}, {"user_id": "1"})
+        assert result == {"result": "viejo"}
+        await asyncio.sleep(0.01)
+
+    assert len(calls) == 1
+    refreshed = default_codec.decode(await fake_redis.get(key))
+    assert refreshed["v"] == {"result": "nuevo"}
+    assert get_cache_stats()["test.swr"]["stale_served"] == 1
+
+
+# XFetch: una entrada que tarda en calcularse se refresca antes de caducar
+def test_xfetch_refreshes_expensive_entries_early():
+    entry = {"_e": 1, "v": {}, "t": time.time() - 55, "d": 30.0}
+    with patch("core.cache.random.random", return_value=0.9):
+        assert _freshness(entry, ttl=60, stale_ttl=0, beta=1.0) == "refresh"
+        assert _freshness(entry, ttl=60, stale_ttl=0, beta=0) == "fresh"
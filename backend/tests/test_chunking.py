@@ -0,0 +1,97 @@
+import asyncio
+import pytest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+from core.chunking import split_text
+from core.tokens import count_tokens
+from services.tasks import summarize, translate
+
+
+def test_split_text_respects_limit_and_paragraphs():
+    paragraphs = [f"Párrafo {i}. " + "palabra " * 40 for i in range(10)]
+    text = "\n\n".join(paragraphs)
+    chunks = split_text(text, 120)
+
+    assert len(chunks) > 1
+    assert all(count_tokens(chunk) <= 120 for chunk in chunks)
+    # Sin cortes a mitad de párrafo cuando cada párrafo cabe entero
+    assert all(chunk.startswith("Párrafo") for chunk in chunks)
+    assert "\n\n".join(chunks).split() == text.split()
+
+
+def test_split_text_breaks_long_sentences():
+    text = "palabra " * 1000
+    chunks = split_text(text, 100)
+    assert all(count_tokens(chunk) <= 100 for chunk in chunks)
+    assert " ".join(chunks).split() == text.split()
+
+
+def test_edit_only_changes_its_chunk():
+    paragraphs = [f"Párrafo {i}. " + "palabra " * 40 for i in range(10)]
+    original = split_text("\n\n".join(paragraphs), 120)
+    paragraphs[7] = paragraphs[7].replace("Párrafo 7.", "Párrafo siete.")
+    edited = split_text("\n\n".join(paragraphs), 120)
+
+    assert len(original) == len(edited)
+    assert sum(a != b for a, b in zip(original, edited)) == 1
+
+
+@pytest.mark.asyncio
+async def test_summarize_long_maps_and_reduces():
+    text = "\n\n".join(f"Párrafo {i}. " + "palabra " * 40 for i in range(10))
+    chunk_summary = AsyncMock(side_effect=lambda chunk: f"resumen de {chunk[:10]}")
+    final = SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content="Resumen final."))]
+    )
+
+    with patch.object(summarize, "SUMMARY_CHUNK_TOKENS", 120), patch.object(
+        summarize, "_summarize_chunk", chunk_summary
+    ), patch.object(
+        summarize, "call_openai_with_retry", AsyncMock(return_value=final)
+    ) as reduce:
+        summary, chunks = await summarize._summarize_long(text)
+
+    assert summary == "Resumen final."
+    assert chunk_summary.await_count == chunks > 1
+    assert reduce.await_args.kwargs["system_prompt"] == summarize.REDUCE_SYSTEM_PROMPT
+
+
+@pytest.mark.asyncio
+async def test_translate_segments_preserves_structure():
+    boilerplate = "Aviso legal. " + "texto " * 30
+    text = "\n\n".join(
+        [f"Párrafo {i}. " + "palabra " * 40 for i in range(3)] + [boilerplate, boilerplate]
+    ) + "\n"
+    segment = AsyncMock(side_effect=lambda segment, source, target: segment.upper())
+
+    with patch.object(translate, "TRANSLATION_SEGMENT_TOKENS", 120), patch.object(
+        translate, "_translate_segment", segment
+    ):
+        parts = [part async for part in translate._translate_segments(text, "es", "en")]
+
+    assert "".join(parts) == text.upper()
+    # El párrafo repetido se traduce una sola vez
+    assert segment.await_count == 4
+
+
+@pytest.mark.asyncio
+async def test_translate_segments_settles_every_task_on_error():
+    text = "\n\n".join(f"Párrafo {i}. " + "palabra " * 40 for i in range(3))
+    tasks = []
+
+    async def segment(segment, source, target):
+        tasks.append(asyncio.current_task())
+        if segment.startswith("Párrafo 0"):
+            raise RuntimeError("circuito abierto")
+        await asyncio.sleep(10)
+
+    with patch.object(translate, "TRANSLATION_SEGMENT_TOKENS", 120), patch.object(
+        translate, "_translate_segment", segment
+    ):
+        with pytest.raises(RuntimeError):
+            _ = [part async for part in translate._translate_segments(text, "es", "en")]
+
+    # Al salir, los demás segmentos ya han terminado y sus errores se han recogido
+    assert len(tasks) == 3
+    assert all(task.done() for task in tasks)
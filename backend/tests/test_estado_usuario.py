@@ -0,0 +1,119 @@
+import pytest
+from datetime import datetime
+from types import SimpleNamespace
+from sqlalchemy.dialects import postgresql
+from unittest.mock import AsyncMock, patch
+
+from services import db
+from core.write_behind import WriteBehindQueue
+
+
+class FakeRedis:
+    """Redis en memoria con SET ... GET para el estado de usuario"""
+
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None, nx=False, get=False):
+        previous = self.data.get(key)
+        if nx and previous is not None:
+            return None
+        self.data[key] = value.encode("utf-8")
+        return previous if get else True
+
+
+@pytest.mark.asyncio
+async def test_mode_lives_in_redis_and_is_written_through():
+    redis_client, written = FakeRedis(), []
+
+    async def flush(batch):
+        written.extend(batch)
+
+    queue = WriteBehindQueue("test", flush, flush_interval=0.01)
+    with patch.object(db, "get_async_redis", return_value=redis_client), patch.object(
+        db, "_estados_queue", queue
+    ), patch.object(db, "_pg_obtener_modo", AsyncMock(return_value="/resumir")) as pg_read, patch.object(
+        db, "_pg_consumir_modo", AsyncMock()
+    ) as pg_consume:
+        # Sin entrada en Redis: se lee de Postgres una vez y se copia a Redis
+        assert await db.obtener_modo_usuario(1) == "/resumir"
+        assert await db.obtener_modo_usuario(1) == "/resumir"
+        assert pg_read.await_count == 1
+
+        await db.establecer_modo_usuario(1, "/traducir")
+        assert await db.consumir_modo_usuario(1) == "/traducir"
+        assert await db.consumir_modo_usuario(1) is None
+        assert await db.obtener_modo_usuario(1) is None
+        pg_consume.assert_not_awaited()
+        await queue.close(timeout=1)
+
+    assert [(chat_id, modo) for chat_id, modo, _ in written] == [(1, "/traducir"), (1, None)]
+
+
+class FakeSession:
+    """Sesión que cuenta sentencias y commits"""
+
+    def __init__(self):
+        self.statements, self.commits = [], 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, statement):
+        self.statements.append(statement)
+        return SimpleNamespace(scalar_one_or_none=lambda: "/resumir")
+
+    async def commit(self):
+        self.commits += 1
+
+    async def rollback(self):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_unit_of_work_shares_one_session_and_memoizes_mode(monkeypatch):
+    monkeypatch.setattr(db, "ESTADO_REDIS_ENABLED", False)
+    sessions = []
+
+    def session_factory():
+        sessions.append(FakeSession())
+        return sessions[-1]
+
+    monkeypatch.setattr(db, "AsyncSessionLocal", session_factory)
+    async with db.unidad_de_trabajo():
+        assert await db.obtener_modo_usuario(1) == "/resumir"
+        assert await db.obtener_modo_usuario(1) == "/resumir"
+        assert await db.consumir_modo_usuario(1) == "/resumir"
+        await db.limpiar_modo_usuario(1)  # ya se sabe que no hay modo: no hace nada
+        assert await db.obtener_modo_usuario(1) is None
+
+    assert len(sessions) == 1
+    assert len(sessions[0].statements) == 2  # SELECT del modo y UPDATE ... RETURNING
+    assert sessions[0].commits == 2
+    assert db._modos_peticion.get() is None
+
+
+@pytest.mark.asyncio
+async def test_consuming_from_postgres_ignores_expired_modes(monkeypatch):
+    session = FakeSession()
+    monkeypatch.setattr(db, "AsyncSessionLocal", lambda: session)
+    with patch.object(db, "get_async_redis", return_value=FakeRedis()):
+        async with db.unidad_de_trabajo():
+            await db.consumir_modo_usuario(1)  # No está en Redis: se consume en Postgres
+
+    sql = str(session.statements[0].compile(dialect=postgresql.dialect()))
+    assert "estado_usuario.fecha >=" in sql and "FOR UPDATE" in sql
+
+
+def test_write_through_upsert_keeps_newer_modes():
+    ahora = datetime.utcnow()
+    stmt = db._upsert_estados([(1, "/resumir", ahora), (1, None, ahora)])
+    sql = str(stmt.compile(dialect=postgresql.dialect()))
+    assert "WHERE estado_usuario.fecha <= excluded.fecha" in sql
+    assert stmt.compile(dialect=postgresql.dialect()).params["modo_actual_m0"] is None
@@ -0,0 +1,136 @@
+import pytest
+from datetime import datetime
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+from sqlalchemy.dialects import postgresql
+
+from api import workflow_endpoints
+from services import intent_parser
+from services.intent_parser import get_intent_stats, parse_intent
+from test_cache import FakeAsyncRedis
+
+
+@pytest.mark.parametrize(
+    "texto, esperado",
+    [
+        (
+            "dame los 3 últimos registros clasificados",
+            {"accion": "listar", "tipo_tarea": "clasificar", "limit": 3, "orden": "desc"},
+        ),
+        ("¿Cuántos registros se han traducido?", {"accion": "contar", "tipo_tarea": "traducir"}),
+        (
+            "Quiero la fecha del primer registro traducido",
+            {"accion": "campo_especifico", "campo": "fecha", "posicion": 1, "orden": "asc"},
+        ),
+        ("Dame toda la tabla", {"accion": "listar", "limit": 100, "tipo_tarea": None}),
+        ("dame el registro número 15", {"accion": "listar", "posicion": 15, "orden": "asc"}),
+        # Desde el final: posición positiva sobre el orden descendente
+        ("dame el penúltimo resumen", {"tipo_tarea": "resumir", "posicion": 2, "orden": "desc"}),
+        ("los cinco primeros registros", {"accion": "listar", "limit": 5, "orden": "asc"}),
+        # Un número sin "últimos"/"primeros": los más recientes
+        ("dame 3 registros", {"accion": "listar", "limit": 3, "orden": "desc"}),
+        (
+            "muestra los 2 registros traducidos",
+            {"accion": "listar", "tipo_tarea": "traducir", "limit": 2, "orden": "desc"},
+        ),
+        ("dame dos resúmenes", {"accion": "listar", "tipo_tarea": "resumir", "limit": 2}),
+    ],
+)
+def test_parses_common_phrasings(texto, esperado):
+    data = parse_intent(texto)
+    assert data is not None
+    assert {clave: data.get(clave) for clave in esperado} == esperado
+
+
+@pytest.mark.parametrize("texto", ["hola, ¿qué tal?", "resume y traduce mis registros"])
+def test_unknown_or_ambiguous_falls_back(texto):
+    assert parse_intent(texto) is None
+
+
+def test_coverage_stats(monkeypatch):
+    monkeypatch.setattr(intent_parser, "_stats", {"local": 0, "fallback": 0})
+    parse_intent("dame el tercer registro")
+    parse_intent("algo que no es una consulta")
+    assert get_intent_stats() == {"local": 1, "fallback": 1, "coverage": 0.5}
+
+
+@pytest.mark.asyncio
+async def test_llm_intents_are_cached_by_normalized_text():
+    response = SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content='{"accion": "contar"}'))]
+    )
+    with patch("core.cache.get_async_redis", return_value=FakeAsyncRedis()), patch.object(
+        workflow_endpoints, "call_openai_with_retry", AsyncMock(return_value=response)
+    ) as call:
+        first = await workflow_endpoints._interpretar_con_llm("¿Qué registros tengo de AYER?")
+        second = await workflow_endpoints._interpretar_con_llm("que registros tengo de ayer")
+
+    assert first == second == {"accion": "contar"}
+    call.assert_awaited_once()
+
+
+class FakeSession:
+    """Sesión que guarda las sentencias SQL en lugar de ejecutarlas"""
+
+    def __init__(self, row=None):
+        self.row = row
+        self.statements = []
+
+    async def scalar(self, statement):
+        self.statements.append(statement)
+        return 42
+
+    async def execute(self, statement):
+        self.statements.append(statement)
+        return SimpleNamespace(first=lambda: self.row, all=lambda: [])
+
+    def sql(self, index=-1):
+        return str(
+            self.statements[index].compile(
+                dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}
+            )
+        )
+
+
+@pytest.mark.asyncio
+async def test_count_runs_in_sql():
+    db = FakeSession()
+    request = workflow_endpoints.ConsultaInteligenteRequest(chat_id=7, texto="¿cuántos resúmenes tengo?")
+    response = await workflow_endpoints.consultar_inteligente(request, db)
+
+    assert response["total"] == 42
+    sql = db.sql()
+    assert "count(*)" in sql and "texto_original" not in sql
+
+
+@pytest.mark.asyncio
+async def test_negative_position_reverses_order_and_projects_field():
+    db = FakeSession(row=("2024-01-01",))
+    intent = {
+        "accion": "campo_especifico",
+        "campo": "fecha",
+        "orden": "desc",
+        "posicion": -2,
+        "respuesta_esperada": "valor",
+    }
+    request = workflow_endpoints.ConsultaInteligenteRequest(chat_id=7, texto="x")
+    with patch.object(workflow_endpoints, "parse_intent", return_value=intent):
+        response = await workflow_endpoints.consultar_inteligente(request, db)
+
+    assert response["fecha"] == "2024-01-01"
+    assert len(db.statements) == 1  # Sin consulta previa para contar el historial
+    sql = db.sql()
+    assert sql.startswith("SELECT consultas_ia.fecha \nFROM")
+    assert "ORDER BY consultas_ia.fecha ASC" in sql
+    assert "LIMIT 1 OFFSET 1" in sql
+
+
+@pytest.mark.asyncio
+async def test_local_position_from_the_end_is_described_by_name():
+    fila = SimpleNamespace(id=1, tipo_tarea="resumir", texto_original="t", resultado="r", fecha=datetime(2024, 1, 1))
+    db = FakeSession()
+    db.execute = AsyncMock(return_value=SimpleNamespace(all=lambda: [fila]))
+    request = workflow_endpoints.ConsultaInteligenteRequest(chat_id=7, texto="dame el penúltimo resumen")
+    response = await workflow_endpoints.consultar_inteligente(request, db)
+
+    assert response["mensaje"].startswith("Registro penúltimo de tipo resumir")
@@ -0,0 +1,49 @@
+import pytest
+
+from core.language import LANGUAGES, detect_language
+from services.tasks import translate
+
+# Frases distintas de los textos de muestra de los perfiles
+LABELLED = [
+    ("hola, necesito ayuda con mi factura", "es"),
+    ("el servidor no funciona desde ayer", "es"),
+    ("por favor enviame el archivo cuando puedas", "es"),
+    ("quiero cancelar mi suscripcion", "es"),
+    ("La reunión se ha aplazado hasta el lunes.", "es"),
+    ("cuanto cuesta el plan premium", "es"),
+    ("hello, I need help with my invoice", "en"),
+    ("the server has been down since yesterday", "en"),
+    ("please send me the file when you can", "en"),
+    ("I want to cancel my subscription", "en"),
+    ("The meeting has been postponed until Monday.", "en"),
+    ("how much does the premium plan cost", "en"),
+    ("ola, preciso de ajuda com a minha fatura", "pt"),
+    ("o servidor nao funciona desde ontem", "pt"),
+    ("A reunião foi adiada para segunda-feira.", "pt"),
+    ("bonjour, j'ai besoin d'aide avec ma facture", "fr"),
+    ("le serveur ne fonctionne pas depuis hier", "fr"),
+    ("La réunion a été reportée à lundi.", "fr"),
+    ("ciao, ho bisogno di aiuto con la mia fattura", "it"),
+    ("il server non funziona da ieri", "it"),
+    ("La riunione è stata rinviata a lunedì.", "it"),
+    ("hallo, ich brauche Hilfe mit meiner Rechnung", "de"),
+    ("der Server funktioniert seit gestern nicht", "de"),
+    ("Die Besprechung wurde auf Montag verschoben.", "de"),
+]
+
+
+def test_detects_labelled_set():
+    assert set(LANGUAGES) >= {"es", "en", "pt", "fr", "it", "de"}
+    errors = [(text, lang, detect_language(text)) for text, lang in LABELLED]
+    errors = [error for error in errors if error[1] != error[2]]
+    assert len(errors) <= 1, errors
+
+
+@pytest.mark.parametrize("text", ["", "ok", "1234 !!"])
+def test_short_texts_use_default(text):
+    assert detect_language(text, default="es") == "es"
+
+
+def test_unaccented_spanish_translates_to_english():
+    # La heurística anterior lo tomaba por inglés y lo "traducía" al español
+    assert translate._resolve_languages("necesito que revises el contrato", "en") == ("es", "en")
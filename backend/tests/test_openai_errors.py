@@ -30,8 +30,8 @@ def test_client():
 @pytest.fixture
 def mock_openai_client():
     """Create a mock AsyncOpenAI client"""
-    with patch("services.tasks.summarize.client") as mock_client:
-        yield mock_client
+    with patch("services.tasks.summarize.get_openai_client") as mock_get_client:
+        yield mock_get_client.return_value
 
 
 # Test para manejar el error de timeout de OpenAI
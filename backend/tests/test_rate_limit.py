@@ -0,0 +1,70 @@
+import pytest
+import redis
+from types import SimpleNamespace
+from unittest.mock import Mock, patch
+
+from core.errors import OpenAIRateLimitError
+from core.rate_limit import RateLimiter, TokenBucket
+from core import tokens
+from core.tokens import count_tokens, estimate_request_tokens
+
+
+class UnavailableRedis:
+    """Redis caído: fuerza el uso del bucket local"""
+
+    async def eval(self, *args):
+        raise redis.ConnectionError("sin conexión")
+
+
+@pytest.fixture
+def no_redis():
+    with patch("core.rate_limit.get_async_redis", return_value=UnavailableRedis()):
+        yield
+
+
+def test_token_bucket_wait_time():
+    bucket = TokenBucket(capacity=60, per_minute=60)  # 1 unidad por segundo
+    assert bucket.wait_time(60) == 0
+    bucket.consume(60)
+    assert bucket.wait_time(2) == pytest.approx(2, abs=0.05)
+
+
+def test_estimate_request_tokens_includes_max_tokens():
+    messages = [{"role": "user", "content": "hola " * 100}]
+    assert estimate_request_tokens(messages, 200) == count_tokens("hola " * 100) + 4 + 200
+
+
+@pytest.mark.asyncio
+async def test_tokenizer_load_failure_is_retried(monkeypatch):
+    import tiktoken
+
+    encoding = SimpleNamespace(encode=lambda text, disallowed_special=(): text.split())
+    get_encoding = Mock(side_effect=[OSError("sin red"), encoding])
+    monkeypatch.setattr(tiktoken, "get_encoding", get_encoding)
+    monkeypatch.setattr(tokens, "_encoding", None)
+    monkeypatch.setattr(tokens, "_last_attempt", None)
+
+    await tokens.init_tokenizer()
+    assert count_tokens("a b c d e f g h") == 4  # Estimación por caracteres
+
+    await tokens.init_tokenizer()  # El fallo anterior no deja la estimación fijada
+    assert count_tokens("a b c d e f g h") == 8
+
+
+@pytest.mark.asyncio
+async def test_limiter_rejects_when_wait_exceeds_max(no_redis):
+    limiter = RateLimiter("test", rpm=2, tpm=10_000, max_wait=0.1)
+    await limiter.acquire(10)
+    await limiter.acquire(10)
+    with pytest.raises(OpenAIRateLimitError):
+        await limiter.acquire(10)
+    assert limiter.stats["acquired"] == 2
+    assert limiter.stats["rejected"] == 1
+
+
+@pytest.mark.asyncio
+async def test_limiter_limits_tokens_per_minute(no_redis):
+    limiter = RateLimiter("test", rpm=100, tpm=6000, max_wait=0.5)  # 100 tokens/s
+    await limiter.acquire(6000)
+    await limiter.acquire(20)  # Espera ~0.2s a que se repongan
+    assert limiter.stats["throttled"] == 1
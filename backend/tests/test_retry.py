@@ -0,0 +1,182 @@
+import asyncio
+import pytest
+from unittest.mock import patch
+
+from core.errors import CircuitOpenError
+from core.retry import (
+    CircuitBreaker,
+    RetryPolicy,
+    async_retry,
+    deadline_scope,
+    get_retry_after,
+    parse_request_timeout,
+    remaining_time,
+)
+
+
+async def ok():
+    return "ok"
+
+
+async def fail():
+    raise TimeoutError("timeout")
+
+
+async def bad_request():
+    raise ValueError("petición inválida")
+
+
+def make_breaker(**kwargs):
+    params = dict(min_calls=4, failure_rate=0.5, open_seconds=60, half_open_max_calls=1)
+    params.update(kwargs)
+    return CircuitBreaker("test", **params)
+
+
+@pytest.mark.asyncio
+async def test_circuit_opens_on_error_rate_and_fails_fast():
+    breaker = make_breaker()
+    assert await breaker.call(ok) == "ok"
+    assert await breaker.call(ok) == "ok"
+    for _ in range(2):
+        with pytest.raises(TimeoutError):
+            await breaker.call(fail)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    with pytest.raises(CircuitOpenError):
+        await breaker.call(ok)
+    assert breaker.snapshot()["rejected"] == 1
+
+
+@pytest.mark.asyncio
+async def test_client_errors_do_not_open_circuit():
+    breaker = make_breaker()
+    for _ in range(4):
+        with pytest.raises(ValueError):
+            await breaker.call(bad_request)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_circuit_opens_on_slow_calls():
+    breaker = make_breaker(slow_call_seconds=0, slow_call_rate=1.0)
+    for _ in range(4):
+        await breaker.call(ok)
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+@pytest.mark.asyncio
+async def test_half_open_probe_closes_or_reopens():
+    breaker = make_breaker(open_seconds=0)
+    breaker._open(0, "test")
+    with pytest.raises(TimeoutError):
+        await breaker.call(fail)  # La prueba falla: vuelve a abrirse
+    assert breaker.state == CircuitBreaker.OPEN
+
+    assert await breaker.call(ok) == "ok"  # La prueba funciona: se cierra
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_retry_stops_when_circuit_is_open():
+    breaker = make_breaker()
+    breaker._open(float("inf"), "test")  # Abierto indefinidamente
+    calls = []
+
+    @async_retry(max_retries=3)
+    async def call():
+        calls.append(1)
+        return await breaker.call(ok)
+
+    with pytest.raises(CircuitOpenError):
+        await call()
+    assert len(calls) == 1
+
+
+class HTTPFailure(Exception):
+    """Error con respuesta HTTP, como los de la librería de OpenAI"""
+
+    def __init__(self, headers):
+        super().__init__("429 rate limit")
+        self.response = type("Response", (), {"headers": headers})()
+
+
+def test_full_jitter_spreads_delays():
+    policy = RetryPolicy(base_delay=1.0, max_delay=10.0, jitter="full")
+    delays = {round(policy.backoff(3), 6) for _ in range(50)}
+    assert len(delays) > 40
+    assert all(0 <= d <= 4.0 for d in delays)
+
+
+def test_decorrelated_jitter_bounds():
+    policy = RetryPolicy(base_delay=1.0, max_delay=10.0, jitter="decorrelated")
+    previous = 0.0
+    for retry in range(1, 20):
+        delay = policy.backoff(retry, previous)
+        assert 1.0 <= delay <= min(10.0, max(1.0, previous * 3))
+        previous = delay
+
+
+def test_get_retry_after_headers():
+    assert get_retry_after(HTTPFailure({"retry-after-ms": "250"})) == 0.25
+    assert get_retry_after(HTTPFailure({"retry-after": "3"})) == 3.0
+    headers = {
+        "x-ratelimit-remaining-requests": "10",
+        "x-ratelimit-reset-requests": "1s",
+        "x-ratelimit-remaining-tokens": "0",
+        "x-ratelimit-reset-tokens": "6m0.5s",
+    }
+    assert get_retry_after(HTTPFailure(headers)) == 360.5
+    assert get_retry_after(ValueError("sin respuesta")) is None
+
+
+@pytest.mark.asyncio
+async def test_retry_honours_server_hint():
+    attempts = []
+
+    @async_retry(max_retries=2)
+    async def call():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise HTTPFailure({"retry-after-ms": "10"})
+        return "ok"
+
+    with patch("core.retry.asyncio.sleep") as sleep:
+        assert await call() == "ok"
+    delay = sleep.call_args[0][0]
+    assert 0.01 <= delay <= 0.011
+
+
+@pytest.mark.asyncio
+async def test_retry_respects_deadline():
+    attempts = []
+
+    @async_retry(max_retries=5, policies=[(TimeoutError, RetryPolicy(base_delay=1.0, jitter="none"))])
+    async def call():
+        attempts.append(1)
+        raise TimeoutError("timeout")
+
+    with deadline_scope(0.5):
+        assert 0 < remaining_time() <= 0.5
+        with pytest.raises(TimeoutError):
+            await call()
+    assert len(attempts) == 1  # La espera de 1s no cabe en el presupuesto
+    assert remaining_time() is None
+
+
+@pytest.mark.asyncio
+async def test_deadline_bounds_each_attempt():
+    @async_retry(max_retries=0)
+    async def slow():
+        await asyncio.sleep(1)
+
+    with deadline_scope(0.05):
+        with pytest.raises(asyncio.TimeoutError):
+            await slow()
+
+
+@pytest.mark.parametrize(
+    "header, esperado",
+    [("5", 5.0), ("0.01", 1.0), ("0", None), ("-5", None), ("nan", None), ("inf", None), ("x", None)],
+)
+def test_parse_request_timeout_rejects_and_clamps(header, esperado):
+    assert parse_request_timeout(header) == esperado
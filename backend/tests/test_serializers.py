@@ -0,0 +1,47 @@
+import json
+import pytest
+
+from core.serializers import CacheCodec, HEADER_MAGIC, msgpack, orjson, zstandard
+
+ENTRY = {
+    "_e": 1,
+    "v": {"summary": "Resumen con acentos: áéíóú ñ " * 80, "cached": False},
+    "t": 1700000000.5,
+    "d": 1.25,
+}
+
+CODECS = [("json", "zlib"), ("json", "none")]
+if orjson is not None:
+    CODECS.append(("orjson", "zlib"))
+if msgpack is not None:
+    CODECS.append(("msgpack", "zlib"))
+if zstandard is not None:
+    CODECS.append(("json", "zstd"))
+
+
+@pytest.mark.parametrize("fmt,compression", CODECS)
+def test_roundtrip(fmt, compression):
+    codec = CacheCodec(fmt=fmt, compression=compression, threshold=256)
+    data = codec.encode(ENTRY)
+    assert data.startswith(HEADER_MAGIC)
+    assert codec.decode(data) == ENTRY
+
+
+# Un valor largo se comprime y ocupa menos que el JSON actual
+def test_compression_above_threshold_reduces_size():
+    codec = CacheCodec(fmt="json", compression="zlib", threshold=256)
+    assert len(codec.encode(ENTRY)) < len(json.dumps(ENTRY))
+
+
+def test_small_values_are_not_compressed():
+    codec = CacheCodec(fmt="json", compression="zlib", threshold=4096)
+    data = codec.encode({"v": "corto"})
+    assert data[len(HEADER_MAGIC) + 2] == 0
+
+
+# Cualquier códec lee lo escrito por otra configuración y el JSON plano anterior
+def test_decodes_other_configurations_and_legacy_json():
+    writer = CacheCodec(fmt="json", compression="zlib", threshold=0)
+    reader = CacheCodec(fmt="json", compression="none")
+    assert reader.decode(writer.encode(ENTRY)) == ENTRY
+    assert reader.decode(json.dumps(ENTRY).encode()) == ENTRY
@@ -0,0 +1,86 @@
+import json
+import pytest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+from api import workflow_endpoints
+from api.schemas import ProcesarRequest
+from services.tasks import summarize
+
+
+class FakeStream:
+    """Respuesta en streaming de OpenAI"""
+
+    def __init__(self, parts):
+        self.parts = parts
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for part in self.parts:
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=part))])
+
+
+@pytest.mark.asyncio
+async def test_summarize_stream_caches_and_saves_at_the_end(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    input_data, context = {"text": "Un texto corto."}, {"user_id": "1"}
+
+    with patch.object(summarize.run, "cache_get", AsyncMock(return_value=None)), patch.object(
+        summarize.run, "cache_set", AsyncMock()
+    ) as cache_set, patch.object(summarize, "_save_history", AsyncMock()) as save, patch.object(
+        summarize,
+        "call_openai_with_retry",
+        AsyncMock(return_value=FakeStream(["Un ", "resumen", "."])),
+    ) as call:
+        parts = [part async for part in summarize.run_stream(input_data, context)]
+
+    assert parts == ["Un ", "resumen", "."]
+    assert call.await_args.kwargs["stream"] is True
+    result = cache_set.await_args[0][0]
+    assert result["summary"] == "Un resumen."
+    save.assert_awaited_once_with(result, input_data, context)
+
+
+@pytest.mark.asyncio
+async def test_stream_endpoint_emits_sse_events():
+    async def fake_stream(input, context):
+        yield "Hola "
+        yield "mundo"
+
+    request = ProcesarRequest(chat_id=1, texto="Hello world", tipo_tarea="traducir")
+    with patch.object(workflow_endpoints.translate, "run_stream", fake_stream), patch.object(
+        workflow_endpoints, "limpiar_modo_usuario", AsyncMock()
+    ):
+        response = await workflow_endpoints.procesar_texto_stream(request)
+        body = "".join([chunk async for chunk in response.body_iterator])
+
+    events = [
+        (block.split("\n")[0][len("event: "):], json.loads(block.split("\n")[1][len("data: "):]))
+        for block in body.strip().split("\n\n")
+    ]
+    assert [name for name, _ in events] == ["token", "token", "done"]
+    assert events[-1][1]["resultado"] == "Hola mundo"
+
+
+@pytest.mark.asyncio
+async def test_stream_endpoint_consumes_mode_and_restores_it_on_error():
+    async def failing_stream(input, context):
+        yield "Hola "
+        raise RuntimeError("fallo")
+
+    request = ProcesarRequest(chat_id=3, texto="Hello world")
+    consumir = AsyncMock(return_value="/traducir")
+    with patch.object(workflow_endpoints.translate, "run_stream", failing_stream), patch.object(
+        workflow_endpoints, "consumir_modo_usuario", consumir
+    ), patch.object(workflow_endpoints, "limpiar_modo_usuario", AsyncMock()) as limpiar, patch.object(
+        workflow_endpoints, "establecer_modo_usuario", AsyncMock()
+    ) as establecer:
+        response = await workflow_endpoints.procesar_texto_stream(request)
+        body = "".join([chunk async for chunk in response.body_iterator])
+
+    consumir.assert_awaited_once_with(3)
+    assert "event: error" in body
+    limpiar.assert_not_awaited()
+    establecer.assert_awaited_once_with(3, "/traducir")
@@ -0,0 +1,101 @@
+import asyncio
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from core.retry import deadline_scope, remaining_time
+from core.write_behind import WriteBehindQueue
+from services import db
+
+
+@pytest.mark.asyncio
+async def test_batches_by_size_and_drains_on_close():
+    batches = []
+
+    async def flush(items):
+        batches.append(list(items))
+
+    queue = WriteBehindQueue("test", flush, max_batch_size=3, flush_interval=0.05)
+    for i in range(7):
+        await queue.put(i)
+    await queue.close(timeout=1)
+
+    assert [item for batch in batches for item in batch] == list(range(7))
+    assert max(len(batch) for batch in batches) <= 3
+    assert queue.stats["written"] == 7
+    with pytest.raises(RuntimeError):
+        await queue.put(8)
+
+
+@pytest.mark.asyncio
+async def test_worker_does_not_inherit_request_deadline():
+    deadlines = []
+
+    async def flush(items):
+        deadlines.append(remaining_time())
+
+    queue = WriteBehindQueue("test", flush, max_batch_size=1, flush_interval=0.05)
+    with deadline_scope(5):
+        await queue.put(1)
+    await queue.close(timeout=1)
+
+    assert deadlines == [None]
+
+
+@pytest.mark.asyncio
+async def test_backpressure_and_retries():
+    release = asyncio.Event()
+    calls = []
+
+    async def flush(items):
+        calls.append(list(items))
+        if len(calls) == 1:
+            await release.wait()
+            raise ConnectionError("sin conexión")
+
+    queue = WriteBehindQueue("test", flush, max_batch_size=1, flush_interval=0, max_queue_size=1)
+    await queue.put("a")  # El worker lo toma y se queda escribiendo
+    await asyncio.sleep(0)
+    await queue.put("b")  # Ocupa la cola
+    blocked = asyncio.ensure_future(queue.put("c"))
+    await asyncio.sleep(0.01)
+    assert not blocked.done()
+    assert queue.stats["waited"] == 1
+
+    release.set()
+    await blocked
+    await queue.close(timeout=2)
+    assert calls == [["a"], ["a"], ["b"], ["c"]]
+    assert queue.stats["errors"] == 1 and queue.stats["dropped"] == 0
+
+
+@pytest.mark.asyncio
+async def test_queued_consultas_carry_content_hash_and_skip_duplicates(monkeypatch):
+    statements = []
+
+    class FakeSession:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+        def begin(self):
+            return self
+
+        async def execute(self, statement):
+            statements.append(statement)
+            return type("Result", (), {"rowcount": 1})()
+
+    monkeypatch.setattr(db, "AsyncSessionLocal", FakeSession)
+    queue = WriteBehindQueue("test", db.guardar_consultas, flush_interval=0.01)
+    monkeypatch.setattr(db, "_consultas_queue", queue)
+    monkeypatch.setattr(db, "DB_WRITE_BEHIND_ENABLED", True)
+
+    await db.guardar_consulta("7", "resumir", "Hola", "Resumen")
+    await queue.close(timeout=1)
+
+    sql = str(statements[0].compile(dialect=postgresql.dialect()))
+    assert "content_hash" in sql and "ON CONFLICT DO NOTHING" in sql
+    params = statements[0].compile(dialect=postgresql.dialect()).params
+    assert db.content_hash("Hola", "Resumen") in params.values()
+    assert db.content_hash("Hola", "Resumen") != db.content_hash("Hol", "aResumen")